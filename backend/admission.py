@@ -0,0 +1,145 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class AdmissionQueue:
+    """Admits at most `limit` concurrent requests and queues up to `max_queue` more.
+
+    A queued request waits at most `max_wait` seconds for a slot. When the
+    expected wait, estimated from the queue depth and recent service times,
+    is already past that deadline the request is shed right away instead.
+    """
+
+    def __init__(self, limit: int, max_queue: int, max_wait: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.admitted = 0
+        self.shed = 0
+        self.service_time = 0.0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+
+        if len(self._waiters) >= self.max_queue or self.expected_wait() > self.max_wait:
+            self.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # On success the releasing request hands its slot over, so `active` is unchanged.
+            await asyncio.wait_for(waiter, timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self._waiters.remove(waiter)
+            self.shed += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif not waiter.cancelled():
+                # The slot was handed over just before the client went away.
+                self._hand_over()
+            raise
+
+        self.admitted += 1
+        return True
+
+    def release(self, service_time: float) -> None:
+        # Exponentially weighted moving average of the time a request holds a slot.
+        self.service_time += 0.1 * (service_time - self.service_time)
+        self._hand_over()
+
+    def _hand_over(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def expected_wait(self) -> float:
+        return (len(self._waiters) + 1) * self.service_time / self.limit
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "service_time": self.service_time,
+        }
+
+
+def _env(name: str, default: str) -> str:
+    return os.environ.get(f"ADMISSION_{name}", default=default)
+
+
+max_wait = float(_env("MAX_WAIT", "2"))
+admission_queues = {
+    "auth": AdmissionQueue(int(_env("AUTH_CONCURRENCY", "8")), int(_env("AUTH_QUEUE", "64")), max_wait),
+    "reads": AdmissionQueue(int(_env("READS_CONCURRENCY", "32")), int(_env("READS_QUEUE", "256")), max_wait),
+    "writes": AdmissionQueue(int(_env("WRITES_CONCURRENCY", "16")), int(_env("WRITES_QUEUE", "128")), max_wait),
+}
+
+
+def route_class(scope: Scope) -> str | None:
+    """Returns the admission class of a request, or None if it bypasses admission control."""
+
+    path = scope["path"]
+    if path.startswith("/auth"):
+        return "auth"
+    if path.startswith("/chats") and path.endswith("/presence"):
+        # Presence lives in memory; updating it only reads the database.
+        return "reads"
+    if path.startswith(("/chats", "/users")):
+        return "reads" if scope["method"] in ("GET", "HEAD") else "writes"
+    # A batch only holds its sub-requests, which are admitted one by one.
+    return None
+
+
+class AdmissionMiddleware:
+    """Fails fast with 503 when a route class is saturated instead of queueing forever."""
+
+    def __init__(self, app: ASGIApp, queues: dict[str, AdmissionQueue]):
+        self.app = app
+        self.queues = queues
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        name = route_class(scope) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        queue = self.queues[name]
+        if not await queue.acquire():
+            response = JSONResponse(
+                status_code=503,
+                content={
+                    "detail": {
+                        "error": "overloaded",
+                        "error_description": "server is overloaded, try again later",
+                    },
+                },
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            queue.release(time.monotonic() - start)
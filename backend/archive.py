@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from itertools import takewhile
+
+from sqlalchemy import Engine, insert
+from sqlmodel import Session, delete, select
+
+from backend import database as db
+from backend.schema import MessageArchiveInDB, MessageInDB
+
+
+archive_after_days = os.environ.get("MESSAGE_ARCHIVE_AFTER_DAYS")
+archive_interval = float(os.environ.get("MESSAGE_ARCHIVE_INTERVAL", default="3600"))
+archive_batch_size = int(os.environ.get("MESSAGE_ARCHIVE_BATCH_SIZE", default="500"))
+
+logger = logging.getLogger(__name__)
+
+_columns = ["id", "text", "user_id", "chat_id", "created_at"]
+
+
+def archive_messages(session: Session, read_session: Session, older_than: datetime, batch_size: int) -> int:
+    """Moves up to `batch_size` messages created before `older_than` into the
+    archive in one short transaction and returns how many were moved.
+
+    Candidates are found on `read_session`; `session` only moves them.
+    """
+
+    # Ids grow with creation time, so the oldest messages are found at the
+    # start of the table without an index on created_at, and the first one
+    # too new to archive ends the batch.
+    rows = read_session.exec(
+        select(MessageInDB.id, MessageInDB.created_at)
+        .order_by(MessageInDB.id)
+        .limit(batch_size)
+    ).all()
+    ids = [id for id, _ in takewhile(lambda row: row[1] < older_than, rows)]
+    db.release_connection(read_session)
+    if not ids:
+        return 0
+
+    source = select(*(getattr(MessageInDB, c) for c in _columns)).where(MessageInDB.id.in_(ids))
+    session.exec(insert(MessageArchiveInDB).from_select(_columns, source))
+    session.exec(delete(MessageInDB).where(MessageInDB.id.in_(ids)))
+    session.commit()
+
+    return len(ids)
+
+
+def _archive_batch(writer: Engine, reader: Engine, older_than: datetime, batch_size: int) -> int:
+    with Session(writer) as session, Session(reader) as read_session:
+        return archive_messages(session, read_session, older_than, batch_size)
+
+
+async def run_archiver(max_age: timedelta, interval: float, batch_size: int) -> None:
+    """Archives old messages every `interval` seconds, batch by batch.
+
+    The writer connection is released between batches so regular writes
+    interleave with a long archival run. Shards are archived one after another.
+    """
+
+    while True:
+        moved = 0
+        try:
+            for writer, reader in db.all_engines():
+                while True:
+                    count = await asyncio.to_thread(_archive_batch, writer, reader, datetime.now() - max_age, batch_size)
+                    moved += count
+                    if count < batch_size:
+                        break
+                    await asyncio.sleep(0)
+        except Exception:
+            logger.exception("archiving messages failed")
+
+        if moved:
+            logger.info("archived %d messages", moved)
+        await asyncio.sleep(interval)
@@ -0,0 +1,296 @@
+import hashlib
+import os
+import tempfile
+from contextlib import suppress
+from typing import BinaryIO, NamedTuple
+from urllib.parse import quote
+
+import anyio
+import multipart
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import parse_options_header
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from backend.entities import InvalidStateException
+
+
+attachment_dir = os.environ.get("ATTACHMENT_DIR", default="backend/attachments")
+attachment_max_bytes = int(os.environ.get("ATTACHMENT_MAX_BYTES", default=str(25 * 1024 * 1024)))
+
+chunk_size = 64 * 1024
+
+
+# Files are stored once per content, under their SHA-256 in `attachment_dir`;
+# attachment rows only refer to them by hash, see database.add_attachment and
+# database.delete_attachments.
+
+
+class Upload(NamedTuple):
+    """A received file, hashed and waiting in a temporary file in the store."""
+
+    path: str
+    sha256: str
+    filename: str
+    content_type: str
+    size: int
+
+
+def file_path(directory: str, sha256: str) -> str:
+    return os.path.join(directory, sha256[:2], sha256)
+
+
+async def receive_upload(request: Request, directory: str, max_bytes: int, field: str = "file") -> Upload:
+    """Streams the `field` file of a multipart/form-data request body to a
+    temporary file in `directory`, hashing it on the way.
+
+    Only one chunk of the body is in memory at a time, and the upload is
+    refused as soon as it grows past `max_bytes`. Other parts are skipped.
+    """
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise InvalidStateException(error_description="expected a multipart/form-data body")
+
+    reader = _FilePartReader(field)
+    parser = multipart.MultipartParser(params[b"boundary"], reader.callbacks())
+    hasher = hashlib.sha256()
+    size = 0
+
+    os.makedirs(directory, exist_ok=True)
+    file = tempfile.NamedTemporaryFile(dir=directory, prefix=".upload-", delete=False)
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if reader.data:
+                size += sum(len(data) for data in reader.data)
+                if size > max_bytes:
+                    raise InvalidStateException(error_description=f"attachments must not be larger than {max_bytes} bytes")
+                # Off the event loop, like Starlette's own form parser.
+                await anyio.to_thread.run_sync(_write, file, hasher, reader.data)
+                reader.data = []
+        parser.finalize()
+
+        if not reader.done:
+            raise InvalidStateException(error_description=f"expected a file in the '{field}' field")
+    except MultipartParseError:
+        file.close()
+        os.remove(file.name)
+        raise InvalidStateException(error_description="invalid multipart/form-data body")
+    except BaseException:
+        file.close()
+        os.remove(file.name)
+        raise
+
+    file.close()
+    return Upload(file.name, hasher.hexdigest(), reader.filename, reader.content_type, size)
+
+
+def _write(file: BinaryIO, hasher, chunks: list[bytes]) -> None:
+    for data in chunks:
+        hasher.update(data)
+        file.write(data)
+
+
+class _FilePartReader:
+    """MultipartParser callbacks that collect the data of the first file
+    part named `field`, to be taken from `data` after each write."""
+
+    def __init__(self, field: str):
+        self.field = field.encode()
+        self.filename = ""
+        self.content_type = "application/octet-stream"
+        self.data: list[bytes] = []
+        self.done = False
+        self._reading = False
+        self._headers: dict[bytes, bytes] = {}
+        self._header_name = b""
+        self._header_value = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._reading = not self.done and options.get(b"name") == self.field and b"filename" in options
+        if self._reading:
+            filename = options[b"filename"].decode("utf-8", errors="replace")
+            # Only the name; some clients send the whole path.
+            self.filename = filename.replace("\\", "/").rsplit("/", 1)[-1] or "attachment"
+            content_type = self._headers.get(b"content-type", b"").decode("latin-1").strip()
+            if content_type:
+                self.content_type = content_type
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._reading:
+            self.data.append(data[start:end])
+
+    def on_part_end(self) -> None:
+        if self._reading:
+            self._reading = False
+            self.done = True
+
+
+def keep(upload: Upload, directory: str) -> None:
+    """Moves an upload into the store, or drops it if the same content is stored already."""
+
+    path = file_path(directory, upload.sha256)
+    if os.path.exists(path):
+        os.remove(upload.path)
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(upload.path, path)
+
+
+def discard(upload: Upload) -> None:
+    with suppress(FileNotFoundError):
+        os.remove(upload.path)
+
+
+def remove_files(directory: str, hashes: set[str]) -> None:
+    for sha256 in hashes:
+        with suppress(FileNotFoundError):
+            os.remove(file_path(directory, sha256))
+
+
+class AttachmentFileResponse(Response):
+    """Serves a stored file with its hash as strong ETag, answering
+    `If-None-Match` with 304 and a single byte `Range` with 206.
+
+    The body goes out with the ASGI `http.response.zerocopysend` extension
+    (sendfile) where the server offers it, and is otherwise read in chunks off
+    the event loop.
+    """
+
+    def __init__(self, path: str, sha256: str, filename: str, content_type: str, size: int, request_headers: Headers):
+        self.path = path
+        self.status_code = 200
+        self.background = None
+        self.offset, self.length = 0, size
+
+        etag = f'"{sha256}"'
+        headers = {
+            "etag": etag,
+            "accept-ranges": "bytes",
+            "cache-control": "private",
+            "x-content-type-options": "nosniff",
+            "content-disposition": _content_disposition(filename),
+        }
+
+        if _matches(request_headers.get("if-none-match"), etag):
+            self.status_code, self.length = 304, 0
+        elif request_headers.get("if-range", etag) == etag and "range" in request_headers:
+            byte_range = _parse_range(request_headers["range"], size)
+            if byte_range is None:
+                pass
+            elif byte_range[0] >= size:
+                self.status_code, self.length = 416, 0
+                headers["content-range"] = f"bytes */{size}"
+            else:
+                start, end = byte_range[0], min(byte_range[1], size - 1)
+                self.status_code = 206
+                self.offset, self.length = start, end - start + 1
+                headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        if self.status_code in (200, 206):
+            headers["content-type"] = content_type
+        if self.status_code != 304:
+            headers["content-length"] = str(self.length)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if scope["method"] == "HEAD" or not self.length:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.offset,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.path, "rb") as file:
+            await file.seek(self.offset)
+            remaining = self.length
+            while remaining:
+                chunk = await file.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 asks for If-None-Match.
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _parse_range(value: str, size: int) -> tuple[int, int] | None:
+    """Returns the first and last byte of a single `bytes=` range, or None to
+    ignore the header, which is also how multiple ranges are answered."""
+
+    unit, _, ranges = value.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        return None
+
+    start, _, end = ranges.strip().partition("-")
+    try:
+        if not start:
+            suffix = int(end)
+            if suffix <= 0:
+                return None
+            return max(size - suffix, 0), size - 1
+        first = int(start)
+        last = int(end) if end else max(first, size - 1)
+    except ValueError:
+        return None
+
+    if first < 0 or last < first:
+        return None
+    return first, last
+
+
+def _content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted == filename:
+        return f'attachment; filename="{filename}"'
+    return f"attachment; filename*=utf-8''{quoted}"
@@ -1,6 +1,8 @@
+import hashlib
 import os
-from datetime import datetime, timezone
-from fastapi import APIRouter, Depends, HTTPException
+import secrets
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.security import (
     OAuth2PasswordBearer,
     OAuth2PasswordRequestForm,
@@ -9,19 +11,23 @@ from jose import ExpiredSignatureError, JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel, ValidationError
 import sqlalchemy
-from sqlmodel import Session, SQLModel, select
+from sqlmodel import Session, SQLModel, delete, select
 from typing import Annotated
 
 from backend import database as db
-from backend.entities import UserResponse, transform_to_user
-from backend.schema import UserInDB
+from backend.cache import message_cache
+from backend.entities import NoPermissionException, UserResponse, transform_to_user
+from backend.revocation import revoke_token, revoked_tokens
+from backend.schema import RefreshTokenInDB, UserInDB
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 access_token_duration = 3600 
+refresh_token_duration = 30 * 24 * 3600
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 jwt_key = os.environ.get("JWT_KEY", default="a423707127f7d1e2f7f03c255f514a62abaceb3110369430f60dc1a0c094c5e9")
 jwt_alg = "HS256"
+admin_usernames = set(filter(None, os.environ.get("ADMIN_USERNAMES", default="").split(",")))
 
 auth_router = APIRouter(prefix="/auth", tags=["Authentication"])
 
@@ -40,6 +46,25 @@ class AccessToken(BaseModel):
     access_token: str
     token_type: str
     expires_in: int
+    refresh_token: str | None = None
+
+
+class RefreshRequest(BaseModel):
+    """Request model to exchange a refresh token for a new access token."""
+
+    refresh_token: str
+
+
+class RevocationRequest(BaseModel):
+    """Request model to revoke an access token or a refresh token."""
+
+    token: str
+
+
+class LogoutRequest(BaseModel):
+    """Request model to log out, optionally ending a refresh token's session too."""
+
+    refresh_token: str | None = None
 
 
 class Claims(BaseModel):
@@ -47,6 +72,7 @@ class Claims(BaseModel):
 
     sub: str
     exp: int
+    jti: str | None = None
 
 
 class DuplicateEntityException(HTTPException):
@@ -107,6 +133,22 @@ class InvalidToken(AuthException):
         )
 
 
+class InvalidRefreshToken(AuthException):
+    def __init__(self):
+        super().__init__(
+            error="invalid_grant",
+            description="invalid refresh token",
+        )
+
+
+class RevokedToken(AuthException):
+    def __init__(self):
+        super().__init__(
+            error="invalid_client",
+            description="revoked bearer token",
+        )
+
+
 class ExpiredToken(AuthException):
     def __init__(self):
         super().__init__(
@@ -116,11 +158,26 @@ class ExpiredToken(AuthException):
 
 
 def get_current_user(
-    session: Session = Depends(db.get_session),
+    request: Request,
+    session: Session = Depends(db.get_read_session),
     token: str = Depends(oauth2_scheme),
 ) -> UserInDB:
     """FastAPI dependency to get current user from bearer token."""
+    batch = getattr(request.state, "batch", None)
+    if batch:
+        # Authenticated once for the whole batch.
+        return batch.user
+
     user = _decode_access_token(session, token)
+    # Routes that query again check out a connection of their own when they do.
+    db.release_connection(session)
+    return user
+
+
+def get_admin_user(user: UserInDB = Depends(get_current_user)) -> UserInDB:
+    """FastAPI dependency to get current user, requiring them to be an administrator."""
+    if user.username not in admin_usernames:
+        raise NoPermissionException(error_description="requires administrator permission")
     return user
 
 
@@ -147,8 +204,9 @@ def update_user_by_id(session: Session, user_id: str, new_username: str | None,
             if (m.find("users.username") >= 0):
                 raise DuplicateUsernameException(new_username)
             raise e
-    
-    session.refresh(user)
+
+    # Cached messages embed their author.
+    message_cache.clear()
     return user
 
 
@@ -178,20 +236,93 @@ def register_user(
             if (m.find("users.username") >= 0):
                 raise DuplicateUsernameException(registration.username)
             raise e
-        
-    session.refresh(user)
+
     return UserResponse(user=transform_to_user(user))
 
 
 @auth_router.post("/token", response_model=AccessToken)
 def get_access_token(
     form: OAuth2PasswordRequestForm = Depends(),
-    session: Session = Depends(db.get_session),
+    session: Session = Depends(db.get_read_session),
+    write_session: Session = Depends(db.get_session),
 ):
-    """Get access token for user."""
+    """Get access token and refresh token for user."""
 
     user = _get_authenticated_user(session, form)
-    return _build_access_token(user)
+    token = _build_access_token(user)
+    token.refresh_token = _issue_refresh_token(write_session, user.id)
+    write_session.commit()
+
+    return token
+
+
+@auth_router.post("/refresh", response_model=AccessToken)
+def refresh_access_token(
+    request: RefreshRequest,
+    session: Session = Depends(db.get_session),
+):
+    """Exchange a refresh token for a new access token and refresh token."""
+
+    refresh_token = session.exec(
+        select(RefreshTokenInDB).where(RefreshTokenInDB.token_hash == _hash_refresh_token(request.refresh_token))
+    ).first()
+
+    if refresh_token is None or refresh_token.expires_at < datetime.now():
+        raise InvalidRefreshToken()
+
+    if refresh_token.used_at is not None:
+        # A rotated token came back: assume it leaked and revoke its whole family.
+        session.exec(delete(RefreshTokenInDB).where(RefreshTokenInDB.family_id == refresh_token.family_id))
+        session.commit()
+        raise InvalidRefreshToken()
+
+    refresh_token.used_at = datetime.now()
+    session.add(refresh_token)
+
+    user = db.get_user_by_id(session, refresh_token.user_id)
+    token = _build_access_token(user)
+    token.refresh_token = _issue_refresh_token(session, user.id, refresh_token.family_id)
+    session.commit()
+
+    return token
+
+
+@auth_router.post("/logout", status_code=204)
+def logout(
+    request: LogoutRequest | None = None,
+    token: str = Depends(oauth2_scheme),
+    user: UserInDB = Depends(get_current_user),
+    session: Session = Depends(db.get_session),
+):
+    """Revoke the current access token and, if given, the session of a refresh token."""
+
+    claims = _decode_claims(token)
+    if claims.jti:
+        revoke_token(session, claims.jti, claims.exp)
+
+    if request and request.refresh_token:
+        _revoke_refresh_token(session, request.refresh_token, user.id)
+
+
+@auth_router.post("/revoke", status_code=204)
+def revoke(
+    request: RevocationRequest,
+    user: UserInDB = Depends(get_current_user),
+    session: Session = Depends(db.get_session),
+):
+    """Revoke one of the current user's access tokens or refresh tokens.
+
+    Unknown tokens and tokens of other users are ignored.
+    """
+
+    try:
+        claims = _decode_claims(request.token, verify_exp=False)
+    except (JWTError, ValidationError):
+        _revoke_refresh_token(session, request.token, user.id)
+        return
+
+    if claims.jti and claims.sub == str(user.id):
+        revoke_token(session, claims.jti, claims.exp)
 
 
 def _get_authenticated_user(
@@ -210,7 +341,7 @@ def _get_authenticated_user(
 
 def _build_access_token(user: UserInDB) -> AccessToken:
     expiration = int(datetime.now(timezone.utc).timestamp()) + access_token_duration
-    claims = Claims(sub=str(user.id), exp=expiration)
+    claims = Claims(sub=str(user.id), exp=expiration, jti=secrets.token_hex(16))
     access_token = jwt.encode(claims.model_dump(), key=jwt_key, algorithm=jwt_alg)
 
     return AccessToken(
@@ -220,10 +351,44 @@ def _build_access_token(user: UserInDB) -> AccessToken:
     )
 
 
+def _hash_refresh_token(token: str) -> str:
+    # Refresh tokens are random and high-entropy, so a fast hash is enough.
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _issue_refresh_token(session: Session, user_id: int, family_id: str | None = None) -> str:
+    token = secrets.token_urlsafe(32)
+    session.add(RefreshTokenInDB(
+        token_hash=_hash_refresh_token(token),
+        family_id=family_id or secrets.token_hex(16),
+        user_id=user_id,
+        expires_at=datetime.now() + timedelta(seconds=refresh_token_duration),
+    ))
+
+    return token
+
+
+def _revoke_refresh_token(session: Session, token: str, user_id: int) -> None:
+    refresh_token = session.exec(
+        select(RefreshTokenInDB).where(RefreshTokenInDB.token_hash == _hash_refresh_token(token))
+    ).first()
+
+    if refresh_token and refresh_token.user_id == user_id:
+        session.exec(delete(RefreshTokenInDB).where(RefreshTokenInDB.family_id == refresh_token.family_id))
+        session.commit()
+
+
+def _decode_claims(token: str, verify_exp: bool = True) -> Claims:
+    claims_dict = jwt.decode(token, key=jwt_key, algorithms=[jwt_alg], options={"verify_exp": verify_exp})
+    return Claims(**claims_dict)
+
+
 def _decode_access_token(session: Session, token: str) -> UserInDB:
     try:
-        claims_dict = jwt.decode(token, key=jwt_key, algorithms=[jwt_alg])
-        claims = Claims(**claims_dict)
+        claims = _decode_claims(token)
+        if claims.jti and revoked_tokens.is_revoked(session, claims.jti):
+            raise RevokedToken()
+
         user_id = claims.sub
         user = session.get(UserInDB, user_id)
 
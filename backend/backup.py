@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from backend import database as db
+
+
+backup_dir = os.environ.get("BACKUP_DIR", default="backend/backups")
+backup_interval = os.environ.get("BACKUP_INTERVAL")
+backup_pages_per_step = int(os.environ.get("BACKUP_PAGES_PER_STEP", default="256"))
+backup_step_sleep = float(os.environ.get("BACKUP_STEP_SLEEP", default="0.005"))
+
+logger = logging.getLogger(__name__)
+
+
+class BackupJob:
+    """Progress of one backup of the database into `path`."""
+
+    def __init__(self, path: str):
+        self.id = secrets.token_hex(8)
+        self.path = path
+        self.status = "pending"
+        self.error: str | None = None
+        self.pages_total = 0
+        self.pages_remaining = 0
+        self.started_at = datetime.now()
+        self.finished_at: datetime | None = None
+
+    def stats(self) -> dict:
+        done = self.pages_total - self.pages_remaining
+        end = self.finished_at or datetime.now()
+        return {
+            "id": self.id,
+            "path": self.path,
+            "status": self.status,
+            "error": self.error,
+            "pages_total": self.pages_total,
+            "pages_remaining": self.pages_remaining,
+            "progress": done / self.pages_total if self.pages_total else 0.0,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": (end - self.started_at).total_seconds(),
+        }
+
+
+def backup_database(job: BackupJob, pages_per_step: int, step_sleep: float) -> None:
+    """Copies the database into `job.path` with SQLite's online backup API.
+
+    The copy is taken from a read-only connection that holds one read
+    transaction for the whole backup. In WAL mode that pins a consistent
+    snapshot: writers carry on between steps, and their commits neither
+    block the backup nor force it to restart.
+
+    Each shard is copied after the main database, from a snapshot of its own,
+    into a file named after `job.path` the way `database.shard_path` names it.
+    """
+
+    copied = 0
+
+    def _progress(_status, remaining, total):
+        job.pages_remaining = remaining
+        job.pages_total = copied + total
+
+    job.status = "running"
+    try:
+        for shard, (_, reader) in enumerate(db.all_engines()):
+            path = db.shard_path(job.path, shard) if shard else job.path
+            _backup_file(reader, path, pages_per_step, step_sleep, _progress)
+            copied = job.pages_total
+
+        job.status = "completed"
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        logger.exception("backup into %s failed", job.path)
+    finally:
+        job.finished_at = datetime.now()
+
+
+def _backup_file(reader, path: str, pages_per_step: int, step_sleep: float, progress) -> None:
+    source = reader.raw_connection()
+    try:
+        connection: sqlite3.Connection = source.driver_connection
+        owns_transaction = not connection.in_transaction
+        if owns_transaction:
+            connection.execute("BEGIN")
+            connection.execute("SELECT count(*) FROM sqlite_master").fetchone()
+
+        target = sqlite3.connect(path)
+        try:
+            connection.backup(target, pages=pages_per_step, progress=progress, sleep=step_sleep)
+        finally:
+            target.close()
+            if owns_transaction:
+                connection.execute("ROLLBACK")
+    finally:
+        source.close()
+
+
+class BackupJobs:
+    """The most recent backup jobs of this process, by id."""
+
+    def __init__(self, max_jobs: int = 20):
+        self.max_jobs = max_jobs
+        self._jobs: OrderedDict[str, BackupJob] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, directory: str) -> BackupJob:
+        """Starts a backup into a new timestamped file in `directory` on a background thread."""
+
+        os.makedirs(directory, exist_ok=True)
+        job = BackupJob(os.path.join(directory, f"RESTchat-{datetime.now():%Y%m%d-%H%M%S}-{secrets.token_hex(4)}.db"))
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+        thread = threading.Thread(
+            target=backup_database,
+            args=(job, backup_pages_per_step, backup_step_sleep),
+            name=f"backup-{job.id}",
+            daemon=True,
+        )
+        thread.start()
+        return job
+
+    def get(self, job_id: str) -> BackupJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+backup_jobs = BackupJobs()
+
+
+async def run_scheduled_backups(interval: float, directory: str) -> None:
+    """Starts a backup into `directory` every `interval` seconds."""
+
+    while True:
+        await asyncio.sleep(interval)
+        job = backup_jobs.start(directory)
+        while job.finished_at is None:
+            await asyncio.sleep(1)
+        logger.info("scheduled backup %s %s in %.1fs", job.path, job.status, job.stats()["duration"])
@@ -0,0 +1,188 @@
+import os
+import threading
+from collections import OrderedDict, deque
+
+from backend.readmodel import MessageRow
+
+
+capacity = int(os.environ.get("MESSAGE_CACHE_SIZE", default="100"))
+memory_budget = int(os.environ.get("MESSAGE_CACHE_BUDGET_BYTES", default=str(64 * 1024 * 1024)))
+
+# Rough per-message overhead of the row and its datetime, on top of the text;
+# authors are shared between rows.
+_message_overhead = 200
+_attachment_overhead = 250
+
+
+def _message_size(message: MessageRow) -> int:
+    return _message_overhead + len(message.text) + _attachment_overhead * len(message.attachments)
+
+
+class _ChatBuffer:
+    __slots__ = ("messages", "complete", "size")
+
+    def __init__(self, messages: deque[MessageRow], complete: bool):
+        self.messages = messages
+        self.complete = complete
+        self.size = sum(_message_size(m) for m in messages)
+
+
+class MessageCache:
+    """Ring buffers of the most recent messages of recently read chats.
+
+    Each cached chat keeps its newest `capacity` messages in id order. Chats
+    are evicted least recently used first once the estimated size of all
+    buffers exceeds `memory_budget` bytes.
+
+    A buffer is filled on the first read of a chat and then kept current by
+    the write helpers in `backend.database`. Every write bumps a version of
+    the chat, so a fill computed from a read that raced a write is dropped.
+    """
+
+    def __init__(self, capacity: int, memory_budget: int, version_slots: int = 4096):
+        self.capacity = capacity
+        self.memory_budget = memory_budget
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._chats: OrderedDict[int, _ChatBuffer] = OrderedDict()
+        self._versions = [0] * version_slots
+        self._lock = threading.Lock()
+
+    def version(self, chat_id: int) -> int:
+        return self._versions[chat_id % len(self._versions)]
+
+    def get(self, chat_id: int, limit: int | None = None, before: int | None = None) -> list[MessageRow] | None:
+        """Returns the messages of a chat with ids below `before`, newest `limit` only,
+        or None if the buffer cannot answer the request."""
+
+        with self._lock:
+            buffer = self._chats.get(chat_id)
+            if buffer is not None:
+                messages = list(buffer.messages)
+                if before is not None:
+                    messages = [m for m in messages if m.id < before]
+                if limit is not None and len(messages) >= limit:
+                    self._hit(chat_id)
+                    return messages[len(messages) - limit:]
+                if buffer.complete:
+                    self._hit(chat_id)
+                    return messages
+
+            self.misses += 1
+            return None
+
+    def fill(self, chat_id: int, messages: list[MessageRow], complete: bool, version: int) -> None:
+        """Caches the newest messages of a chat, read while the chat was at `version`.
+
+        `complete` tells whether `messages` is the whole history of the chat.
+        """
+
+        with self._lock:
+            if version != self.version(chat_id):
+                return
+
+            self._drop(chat_id)
+            buffer = _ChatBuffer(
+                deque(messages[-self.capacity:], maxlen=self.capacity),
+                complete and len(messages) <= self.capacity,
+            )
+            self._chats[chat_id] = buffer
+            self._size += buffer.size
+            self._evict()
+
+    def append(self, message: MessageRow) -> None:
+        with self._lock:
+            self._bump(message.chat_id)
+            buffer = self._chats.get(message.chat_id)
+            if buffer is None:
+                return
+
+            if buffer.messages and message.id < buffer.messages[-1].id:
+                # Committed out of order; rebuild on the next read rather than reorder.
+                self._drop(message.chat_id)
+                return
+
+            if len(buffer.messages) == buffer.messages.maxlen:
+                buffer.complete = False
+                self._resize(buffer, -_message_size(buffer.messages[0]))
+            buffer.messages.append(message)
+            self._resize(buffer, _message_size(message))
+            self._evict()
+
+    def replace(self, message: MessageRow) -> None:
+        with self._lock:
+            self._bump(message.chat_id)
+            buffer = self._chats.get(message.chat_id)
+            if buffer is None:
+                return
+
+            for i, cached in enumerate(buffer.messages):
+                if cached.id == message.id:
+                    # Edits only change the text; attachments are added with evict().
+                    message = message._replace(attachments=cached.attachments)
+                    buffer.messages[i] = message
+                    self._resize(buffer, _message_size(message) - _message_size(cached))
+                    return
+
+    def remove(self, chat_id: int, message_id: int) -> None:
+        with self._lock:
+            self._bump(chat_id)
+            buffer = self._chats.get(chat_id)
+            if buffer is None:
+                return
+
+            # What remains is still the newest messages of the chat, just one fewer.
+            for cached in buffer.messages:
+                if cached.id == message_id:
+                    buffer.messages.remove(cached)
+                    self._resize(buffer, -_message_size(cached))
+                    return
+
+    def evict(self, chat_id: int) -> None:
+        with self._lock:
+            self._bump(chat_id)
+            self._drop(chat_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._chats.clear()
+            self._size = 0
+            self._versions = [v + 1 for v in self._versions]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "chats": len(self._chats),
+                "messages": sum(len(b.messages) for b in self._chats.values()),
+                "size": self._size,
+                "memory_budget": self.memory_budget,
+            }
+
+    def _hit(self, chat_id: int) -> None:
+        self.hits += 1
+        self._chats.move_to_end(chat_id)
+
+    def _bump(self, chat_id: int) -> None:
+        self._versions[chat_id % len(self._versions)] += 1
+
+    def _resize(self, buffer: _ChatBuffer, delta: int) -> None:
+        buffer.size += delta
+        self._size += delta
+
+    def _drop(self, chat_id: int) -> None:
+        buffer = self._chats.pop(chat_id, None)
+        if buffer is not None:
+            self._size -= buffer.size
+
+    def _evict(self) -> None:
+        while self._size > self.memory_budget and self._chats:
+            _, buffer = self._chats.popitem(last=False)
+            self._size -= buffer.size
+
+
+message_cache = MessageCache(capacity, memory_budget)
@@ -0,0 +1,160 @@
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from typing import Iterable
+
+from sqlalchemy import Engine, text as sql, type_coerce
+from sqlalchemy.types import TypeDecorator
+from sqlmodel.sql.sqltypes import AutoString
+
+
+compression_threshold = int(os.environ.get("MESSAGE_COMPRESSION_THRESHOLD", default="1024"))
+compression_level = int(os.environ.get("MESSAGE_COMPRESSION_LEVEL", default="6"))
+
+# zlib only looks back this far, so that is all of a dictionary it can use.
+dictionary_size = 32 * 1024
+
+
+# Message texts of at least `compression_threshold` bytes are stored as a BLOB
+# in the same column as the plain TEXT of shorter ones: two bytes with the id
+# of the dictionary they were compressed with (0 for none), then a zlib stream.
+
+
+class Dictionaries:
+    """Preset dictionaries from the `compression_dictionaries` table, see
+    `python -m backend.recompress train`.
+
+    New texts are compressed with the newest one. Stored texts refer to
+    theirs by id, so dictionaries are never changed or deleted; one this
+    process has not seen yet, e.g. trained by another process, is loaded
+    when a text needs it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engine: Engine | None = None
+        self._dictionaries: dict[int, bytes] = {}
+        self._current: tuple[int, bytes | None] = (0, None)
+
+    def load(self, engine: Engine) -> None:
+        with engine.connect() as connection:
+            rows = connection.execute(sql("SELECT id, data FROM compression_dictionaries")).all()
+
+        with self._lock:
+            self._engine = engine
+            self._dictionaries = dict(rows)
+            if self._dictionaries:
+                newest = max(self._dictionaries)
+                self._current = (newest, self._dictionaries[newest])
+
+    def current(self) -> tuple[int, bytes | None]:
+        return self._current
+
+    def get(self, dictionary_id: int) -> bytes:
+        dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None and self._engine is not None:
+            self.load(self._engine)
+            dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None:
+            raise LookupError(f"unknown compression dictionary {dictionary_id}")
+        return dictionary
+
+
+dictionaries = Dictionaries()
+
+
+def compress_text(value: str) -> str | bytes:
+    """Returns the stored form of a message text: compressed if it is long
+    enough and that makes it smaller, otherwise the text itself."""
+
+    data = value.encode()
+    if not compression_threshold or len(data) < compression_threshold:
+        return value
+
+    dictionary_id, dictionary = dictionaries.current()
+    if dictionary:
+        compressor = zlib.compressobj(compression_level, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(compression_level)
+    compressed = dictionary_id.to_bytes(2, "big") + compressor.compress(data) + compressor.flush()
+
+    return compressed if len(compressed) < len(data) else value
+
+
+def decompress_text(value: str | bytes) -> str:
+    if isinstance(value, str):
+        return value
+
+    dictionary_id = int.from_bytes(value[:2], "big")
+    if not dictionary_id:
+        return zlib.decompress(value[2:]).decode()
+
+    decompressor = zlib.decompressobj(zdict=dictionaries.get(dictionary_id))
+    return (decompressor.decompress(value[2:]) + decompressor.flush()).decode()
+
+
+def dictionary_id(value: str | bytes) -> int | None:
+    """Returns the id of the dictionary a stored text was compressed with, 0
+    for none, or None if it is stored plain."""
+
+    return None if isinstance(value, str) else int.from_bytes(value[:2], "big")
+
+
+class CompressedText(TypeDecorator):
+    """A text column that stores long values compressed, see compress_text.
+
+    ORM objects and plain selects see the text; select `stored_text(column)`
+    to get it as stored and leave decompressing to whoever needs it.
+    """
+
+    impl = AutoString
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else decompress_text(value)
+
+
+def stored_text(column):
+    return type_coerce(column, AutoString)
+
+
+_segment_pattern = re.compile(rb"[^\n]*\n?")
+_token_pattern = re.compile(rb"\S+\s*")
+
+
+def train_dictionary(samples: Iterable[str], size: int = dictionary_size) -> bytes:
+    """Builds a zlib preset dictionary from sample texts.
+
+    It holds the lines and runs of three tokens that recur in the most
+    samples, weighted by length; the most valuable go last, where matches
+    are cheapest for zlib to encode.
+    """
+
+    counts: Counter[bytes] = Counter()
+    for sample in samples:
+        data = sample.encode()
+        tokens = _token_pattern.findall(data)
+        segments = {line for line in _segment_pattern.findall(data) if len(line) > 3}
+        segments.update(b"".join(tokens[i:i + 3]) for i in range(len(tokens) - 2))
+        # Counted once per sample, so one repetitive text cannot fill the dictionary.
+        counts.update(segments)
+
+    scored = sorted(
+        ((count * len(segment), segment) for segment, count in counts.items() if count > 1),
+        reverse=True,
+    )
+    chosen = []
+    remaining = size
+    for _, segment in scored:
+        if len(segment) <= remaining:
+            chosen.append(segment)
+            remaining -= len(segment)
+        if remaining < 8:
+            break
+
+    return b"".join(reversed(chosen))
@@ -1,37 +1,314 @@
-from sqlalchemy import select
-from sqlmodel import Session, SQLModel, create_engine, select
-from backend.entities import ( 
-    Chat,
-)
+import os
+import string
+from datetime import datetime
+from typing import NamedTuple
+from sqlalchemy import Engine, and_, case, event, func, literal, or_, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.schema import CreateIndex
+from starlette.requests import Request
+from sqlmodel import Session, SQLModel, create_engine, delete, select
+from backend import attachments, compression, outbox
+from backend.cache import message_cache
+from backend.readmodel import message_row
 from backend.schema import (
-    UserInDB, MessageInDB, ChatInDB
+    AttachmentInDB, OutboxInDB, UserInDB, MessageInDB, MessageArchiveInDB, ChatInDB, ChatShardInDB, ReadMarkerInDB, RetentionPolicyInDB, UserChatLinkInDB
 )
+from backend.writer import GroupCommitWriter
 
 
-engine = create_engine(
-    "sqlite:///backend/RESTchat.db",
-    echo=True,
-    connect_args={"check_same_thread": False},
-)
+database_path = "backend/RESTchat.db"
+database_url = f"sqlite:///{database_path}"
+read_pool_size = int(os.environ.get("DATABASE_READ_POOL_SIZE", default=os.cpu_count() or 4))
+
+# How long a request waits for a pooled connection before it is turned away
+# with 503, rather than queueing behind the writer indefinitely.
+pool_timeout = float(os.environ.get("DATABASE_POOL_TIMEOUT", default="5"))
+
+# Messages and the rows that hang off them are spread over this many database
+# files by chat, each with a writer of its own; see shard_of. Shard 0 is the
+# main database, which also holds everything else.
+shard_count = int(os.environ.get("DATABASE_SHARDS", default="1"))
+
+
+def _configure_writer_connection(dbapi_connection, _connection_record):
+    cursor = dbapi_connection.cursor()
+    # Only takes effect on a new database, or after a full VACUUM, so it has
+    # to come before anything that writes the database header.
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.close()
+
+
+def _configure_reader_connection(dbapi_connection, _connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only = ON")
+    cursor.close()
+    # The driver would run each SELECT in a transaction of its own; take over
+    # so that all reads of a session share one snapshot, see below.
+    dbapi_connection.isolation_level = None
+
+
+def _attach_main_database(path: str):
+    def _attach(dbapi_connection, _connection_record):
+        # Tables a shard does not have, users and chats among them, resolve
+        # to the main database's by their plain names.
+        dbapi_connection.execute("ATTACH DATABASE ? AS main_database", (path,))
+    return _attach
+
+
+def _begin_read_transaction(connection):
+    # A deferred transaction never takes a write lock. It pins a WAL snapshot
+    # on its first read until the session commits, which also hands the
+    # connection back to the pool.
+    connection.exec_driver_sql("BEGIN DEFERRED")
+
+
+def create_writer_engine(url: str, echo: bool = False, attach: str | None = None) -> Engine:
+    """All writes go through a single connection: requests that need it wait
+    in the pool's checkout queue instead of fighting over SQLite's write lock.
+
+    A shard's engine `attach`es the main database file.
+    """
+
+    writer = create_engine(
+        url,
+        echo=echo,
+        connect_args={"check_same_thread": False},
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=pool_timeout,
+    )
+    event.listen(writer, "connect", _configure_writer_connection)
+    if attach:
+        event.listen(writer, "connect", _attach_main_database(attach))
+    return writer
+
+
+def create_read_engine(url: str, pool_size: int, echo: bool = False, attach: str | None = None) -> Engine:
+    """Read-only routes use their own pool; in WAL mode they never block on,
+    or block, the writer."""
+
+    reader = create_engine(
+        url,
+        echo=echo,
+        connect_args={"check_same_thread": False},
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=pool_timeout,
+    )
+    event.listen(reader, "connect", _configure_reader_connection)
+    if attach:
+        event.listen(reader, "connect", _attach_main_database(attach))
+    event.listen(reader, "begin", _begin_read_transaction)
+    return reader
+
+
+def shard_path(path: str, shard: int) -> str:
+    """Returns where a shard of the database at `path` is stored, next to it."""
+
+    root, extension = os.path.splitext(path)
+    return f"{root}-shard{shard}{extension}"
+
+
+def create_shard_engines(path: str, count: int, echo: bool = False) -> list[tuple[Engine, Engine]]:
+    """Returns the writer and read engines of shards 1 to `count` - 1 of the
+    main database at `path`."""
+
+    return [
+        (
+            create_writer_engine(f"sqlite:///{shard_path(path, shard)}", echo, attach=path),
+            create_read_engine(f"sqlite:///{shard_path(path, shard)}", read_pool_size, echo, attach=path),
+        )
+        for shard in range(1, count)
+    ]
+
+
+engine = create_writer_engine(database_url, echo=True)
+read_engine = create_read_engine(database_url, read_pool_size, echo=True)
+shard_engines = create_shard_engines(database_path, shard_count, echo=True)
+
+# Tables whose rows live in the shard of their chat.
+shard_tables = [MessageInDB.__table__, MessageArchiveInDB.__table__, AttachmentInDB.__table__, OutboxInDB.__table__]
+
+
+# Opt-in group commit for message inserts, see GroupCommitWriter.
+message_writer = None
+if os.environ.get("MESSAGE_GROUP_COMMIT", default="0") == "1":
+    message_writer = GroupCommitWriter(
+        window=float(os.environ.get("MESSAGE_GROUP_COMMIT_WINDOW_MS", default="2")) / 1000,
+        synchronous=os.environ.get("MESSAGE_GROUP_COMMIT_SYNCHRONOUS", default="FULL"),
+    )
 
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    _create_tables(engine, SQLModel.metadata.sorted_tables)
+    for writer, _ in shard_engines:
+        _create_tables(writer, shard_tables)
+
+    with engine.begin() as connection:
+        highest = connection.execute(select(func.max(ChatShardInDB.shard))).scalar()
+        if highest is not None and highest >= shard_count:
+            raise RuntimeError(f"chats are stored in shard {highest}, DATABASE_SHARDS cannot be lowered to {shard_count}")
+        if shard_engines:
+            # Chats created before sharding keep their messages in the main database.
+            connection.execute(insert(ChatShardInDB).from_select(
+                ["chat_id", "shard"],
+                select(ChatInDB.id, literal(0)).where(ChatInDB.id.not_in(select(ChatShardInDB.chat_id))),
+            ))
+
+    compression.dictionaries.load(read_engine)
+
 
+def _create_tables(writer: Engine, tables) -> None:
+    SQLModel.metadata.create_all(writer, tables=tables)
+    # create_all skips tables that already exist together with their indexes,
+    # so indexes added to existing tables are created here. Reflection does not
+    # see expression indexes, so the existence check is left to SQLite.
+    with writer.begin() as connection:
+        for table in tables:
+            for index in table.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
 
-def get_session():
-    with Session(engine) as session:
+
+# Shards never change, so they are looked up once per chat.
+_chat_shards: dict[int, int] = {}
+
+
+def shard_of(chat_id: int) -> int:
+    """Returns the shard holding the messages of a chat, 0 for the main database."""
+
+    if not shard_engines:
+        return 0
+
+    shard = _chat_shards.get(chat_id)
+    if shard is None:
+        with Session(read_engine) as session:
+            row = session.get(ChatShardInDB, chat_id)
+        if row is None:
+            # No such chat; the route finds out on its own.
+            return 0
+        shard = _chat_shards[chat_id] = row.shard
+    return shard
+
+
+def chat_engines(chat_id: int) -> tuple[Engine, Engine]:
+    """Returns the writer and read engine of the shard of a chat."""
+
+    shard = shard_of(chat_id)
+    return (engine, read_engine) if shard == 0 else shard_engines[shard - 1]
+
+
+def all_engines() -> list[tuple[Engine, Engine]]:
+    """Returns the writer and read engine of every shard, the main database first."""
+
+    return [(engine, read_engine), *shard_engines]
+
+
+# Rows stay loaded after commit, so responses are built from what was
+# written instead of reloading it with another SELECT. Write helpers set
+# relationships to the caller from the user already loaded while
+# authenticating, for the same reason.
+def get_session(request: Request):
+    # Sub-requests of a batch share the sessions of the batch request.
+    batch = getattr(request.state, "batch", None)
+    if batch:
+        yield batch.session
+        return
+
+    with Session(engine, expire_on_commit=False) as session:
+        yield session
+
+
+def get_read_session(request: Request):
+    batch = getattr(request.state, "batch", None)
+    if batch:
+        yield batch.read_session
+        return
+
+    with Session(read_engine, expire_on_commit=False) as session:
+        yield session
+
+
+# Routes that read or write messages use these instead, for the shard of the
+# chat in their path. The main database's tables can be queried all the same.
+def get_chat_session(request: Request, chat_id: int):
+    writer, _ = chat_engines(chat_id)
+    batch = getattr(request.state, "batch", None)
+    if batch:
+        yield batch.session_on(writer)
+        return
+
+    with Session(writer, expire_on_commit=False) as session:
+        yield session
+
+
+def get_chat_read_session(request: Request, chat_id: int):
+    _, reader = chat_engines(chat_id)
+    batch = getattr(request.state, "batch", None)
+    if batch:
+        yield batch.session_on(reader)
+        return
+
+    with Session(reader, expire_on_commit=False) as session:
         yield session
 
 
+def release_connection(session: Session) -> None:
+    """Ends the session's transaction so its connection goes back to the pool
+    before the request is done.
+
+    Loaded rows stay usable. Querying again checks out a connection anew.
+    """
+    session.commit()
+
+
 class EntityNotFoundException(Exception):
     def __init__(self, *, entity_name: str, entity_id: str):
         self.entity_name = entity_name
         self.entity_id = entity_id
 
 
-def get_all_users(session: Session) -> list[UserInDB]:
-    return session.exec(select(UserInDB)).all()
+def _prefix_range(column, prefix: str):
+    # Every string starting with `prefix` sorts in [prefix, prefix + U+10FFFF),
+    # which lets SQLite answer the match with an index range scan.
+    return (column >= prefix, column < prefix + "\U0010ffff")
+
+
+# SQLite's lower() only folds ASCII letters, so the prefix is folded the same
+# way to compare equal to the indexed keys.
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def search_users(session: Session, prefix: str, limit: int) -> list[UserInDB]:
+    """Returns up to `limit` users whose username or email starts with `prefix`.
+
+    Matching is case-insensitive for ASCII letters. Username matches come
+    first, ordered by username, followed by email-only matches ordered by email.
+    """
+    prefix = prefix.translate(_ASCII_LOWER)
+    username_key = func.lower(UserInDB.username)
+    email_key = func.lower(UserInDB.email)
+
+    by_username = session.exec(
+        select(UserInDB)
+        .where(*_prefix_range(username_key, prefix))
+        .order_by(username_key, UserInDB.id)
+        .limit(limit)
+    ).all()
+    if len(by_username) == limit:
+        return by_username
+
+    seen = {u.id for u in by_username}
+    by_email = session.exec(
+        select(UserInDB)
+        .where(*_prefix_range(email_key, prefix))
+        .order_by(email_key, UserInDB.id)
+        .limit(limit)
+    ).all()
+
+    return (by_username + [u for u in by_email if u.id not in seen])[:limit]
 
 
 def get_user_by_id(session: Session, user_id: int) -> UserInDB:
@@ -41,24 +318,25 @@ def get_user_by_id(session: Session, user_id: int) -> UserInDB:
     raise EntityNotFoundException(entity_name="User", entity_id=user_id)
 
 
-def get_user_chats_by_id(session: Session, user_id: int) -> list[ChatInDB]:
-    user = get_user_by_id(session, user_id)
-    return user.chats
+def is_user_in_chat(session: Session, chat_id: int, user_id: int) -> bool:
+    return session.get(UserChatLinkInDB, (user_id, chat_id)) is not None
 
 
 def get_all_chats(session: Session) -> list[ChatInDB]:
     return session.exec(select(ChatInDB)).all()
 
 
-def create_new_chat(session: Session, user_id: int, chat_name: str) -> ChatInDB:
-    chat = ChatInDB(owner_id=user_id, name=chat_name)
-    
+def create_new_chat(session: Session, owner: UserInDB, chat_name: str) -> ChatInDB:
+    chat = ChatInDB(name=chat_name, owner_id=owner.id)
+
     session.add(chat)
+    session.flush()
+    session.add(UserChatLinkInDB(user_id=owner.id, chat_id=chat.id))
+    if shard_engines:
+        session.add(ChatShardInDB(chat_id=chat.id, shard=chat.id % shard_count))
     session.commit()
-    session.refresh(chat)
+    set_committed_value(chat, "owner", owner)
 
-    add_user_to_chat_by_id(session, chat.id, user_id)
-    
     return chat
 
 
@@ -76,13 +354,14 @@ def get_message_by_id(session: Session, message_id: int) -> MessageInDB:
     raise EntityNotFoundException(entity_name="Message", entity_id=message_id)
 
 
-def update_message_by_id(session: Session, message_id: int, updated_text: str) -> MessageInDB:
+def update_message_by_id(session: Session, message_id: int, updated_text: str, user: UserInDB) -> MessageInDB:
     message_in_db = get_message_by_id(session, message_id)
 
     setattr(message_in_db, "text", updated_text)
     session.add(message_in_db)
     session.commit()
-    session.refresh(message_in_db)
+    set_committed_value(message_in_db, "user", user)
+    message_cache.replace(message_row(message_in_db))
 
     return message_in_db
 
@@ -90,17 +369,94 @@ def update_message_by_id(session: Session, message_id: int, updated_text: str) -
 def delete_message_by_id(session: Session, message_id: int) -> None:
     message_in_db = get_message_by_id(session, message_id)
     session.delete(message_in_db)
+    delete_attachments(session, message_in_db.chat_id, [message_id])
     session.commit()
+    message_cache.remove(message_in_db.chat_id, message_id)
 
 
-def update_chat_by_id(session: Session, chat_id: int, new_name: str) -> ChatInDB:
+def get_attachment_by_id(session: Session, attachment_id: int) -> AttachmentInDB:
+    attachment = session.get(AttachmentInDB, attachment_id)
+    if attachment:
+        return attachment
+    raise EntityNotFoundException(entity_name="Attachment", entity_id=attachment_id)
+
+
+def attachment_dir(chat_id: int) -> str:
+    """Returns the directory the attached files of a chat are stored in.
+
+    Files are shared by content within a shard, whose writer serializes
+    adding and removing them, so each shard has a directory of its own.
+    """
+
+    shard = shard_of(chat_id)
+    if shard == 0:
+        return attachments.attachment_dir
+    return os.path.join(attachments.attachment_dir, f"shard{shard}")
+
+
+def add_attachment(session: Session, message: MessageInDB, upload: attachments.Upload) -> AttachmentInDB:
+    """Stores an uploaded file for a message; identical content is stored only once."""
+
+    # Checking out the writer connection first keeps delete_attachments from
+    # removing a file with the same content while this one takes its place.
+    session.connection()
+    try:
+        attachments.keep(upload, attachment_dir(message.chat_id))
+    except BaseException:
+        attachments.discard(upload)
+        raise
+
+    attachment = AttachmentInDB(
+        message_id=message.id,
+        chat_id=message.chat_id,
+        sha256=upload.sha256,
+        filename=upload.filename,
+        content_type=upload.content_type,
+        size=upload.size,
+    )
+    session.add(attachment)
+    session.commit()
+    message_cache.evict(message.chat_id)
+
+    return attachment
+
+
+def delete_attachments(session: Session, chat_id: int, message_ids: list[int]) -> None:
+    """Deletes the attachments of the given messages of a chat in the caller's
+    transaction. Stored files no other attachment refers to are removed once
+    it commits, and kept if it does not."""
+
+    hashes = set(session.exec(select(AttachmentInDB.sha256).where(AttachmentInDB.message_id.in_(message_ids))))
+    if not hashes:
+        return
+
+    session.exec(delete(AttachmentInDB).where(AttachmentInDB.message_id.in_(message_ids)))
+    shared = session.exec(select(AttachmentInDB.sha256).where(AttachmentInDB.sha256.in_(hashes)))
+    unreferenced = session.info.setdefault("unreferenced_files", {})
+    unreferenced.setdefault(attachment_dir(chat_id), set()).update(hashes.difference(shared))
+
+
+@event.listens_for(Session, "after_commit")
+def _remove_unreferenced_files(session: Session) -> None:
+    # Runs before the session hands the writer connection back, see add_attachment.
+    for directory, hashes in session.info.pop("unreferenced_files", {}).items():
+        attachments.remove_files(directory, hashes)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _keep_files_on_rollback(session: Session, transaction) -> None:
+    if transaction.parent is None:
+        session.info.pop("unreferenced_files", None)
+
+
+def update_chat_by_id(session: Session, chat_id: int, new_name: str, owner: UserInDB) -> ChatInDB:
 
     chat_in_db = get_chat_by_id(session, chat_id)
 
     setattr(chat_in_db, "name", new_name)
     session.add(chat_in_db)
     session.commit()
-    session.refresh(chat_in_db)
+    set_committed_value(chat_in_db, "owner", owner)
 
     return chat_in_db
 
@@ -114,7 +470,6 @@ def add_user_to_chat_by_id(session: Session, chat_id: int, user_id: int) -> list
         chat_in_db.users.append(user_in_db)
         session.add(chat_in_db)
         session.commit()
-        session.refresh(chat_in_db)
 
     return chat_in_db.users
 
@@ -127,33 +482,242 @@ def remove_user_from_chat_by_id(session: Session, chat_id: int, user_id: int) ->
         chat_in_db.users.remove(user_in_db)
         session.add(chat_in_db)
         session.commit()
-        session.refresh(chat_in_db)
     
     return chat_in_db.users
 
 
-def add_message_to_chat_by_id(session: Session, chat_id: int, user_id: int, text: str):
+def add_message_to_chat_by_id(session: Session, chat_id: int, user: UserInDB, text: str):
 
     get_chat_by_id(session, chat_id)
     message = MessageInDB(
         text=text,
-        user_id=user_id,
+        user_id=user.id,
         chat_id=chat_id,
     )
 
-    session.add(message)
-    session.commit()
-    session.refresh(message)
+    if message_writer:
+        # Hand the writer connection back before waiting on the writer thread.
+        session.commit()
+        message = message_writer.submit(session.get_bind(), message, message_created_events)
+        message = session.merge(message, load=False)
+    else:
+        session.add(message)
+        session.flush()
+        session.add_all(message_created_events(message))
+        session.commit()
 
+    set_committed_value(message, "user", user)
+    message_cache.append(message_row(message))
     return message
 
 
-def get_chat_messages_by_id(session: Session, chat_id: int) -> list[MessageInDB]:
-    chat = get_chat_by_id(session, chat_id)
-    return chat.messages
+def message_created_events(message: MessageInDB) -> list[OutboxInDB]:
+    """Outbox rows announcing a new message, written in the transaction that
+    inserts it. None while no handler is registered for them."""
 
+    if not outbox.has_handlers("message.created"):
+        return []
 
-def get_chat_users_by_id(session: Session, chat_id: int) -> list[UserInDB]:
-    chat = get_chat_by_id(session, chat_id)
-    return chat.users
+    return [OutboxInDB(
+        topic="message.created",
+        payload={
+            "id": message.id,
+            "chat_id": message.chat_id,
+            "user_id": message.user_id,
+            "text": message.text,
+            "created_at": message.created_at.isoformat(),
+        },
+    )]
 
+
+def count_chat_messages(session: Session, chat_id: int) -> int:
+    return sum(
+        session.exec(select(func.count()).select_from(model).where(model.chat_id == chat_id)).one()
+        for model in (MessageInDB, MessageArchiveInDB)
+    )
+
+
+class InboxRow(NamedTuple):
+    chat: ChatInDB
+    owner: UserInDB
+    last_message: MessageInDB | None
+    last_message_author: UserInDB | None
+    message_count: int
+    unread_count: int
+    last_activity: datetime
+
+
+def get_user_inbox(
+    session: Session,
+    user_id: int,
+    limit: int,
+    before: tuple[datetime, int] | None = None,
+    pending: dict[int, int] | None = None,
+) -> list[InboxRow]:
+    """Returns a user's chats by last activity, each with its latest message,
+    message count and unread count, in a single query.
+
+    `before` is the (last_activity, chat_id) of the last row of the previous page.
+    `pending` maps chat ids to read markers not written yet, which count where
+    they are further than the stored ones.
+
+    With shards, each one's chats are queried on its own read engine and the
+    pages are merged.
+    """
+
+    if not shard_engines:
+        return _get_shard_inbox(session, None, user_id, limit, before, pending)
+
+    rows = _get_shard_inbox(session, 0, user_id, limit, before, pending)
+    for shard, (_, reader) in enumerate(shard_engines, start=1):
+        with Session(reader, expire_on_commit=False) as shard_session:
+            rows += _get_shard_inbox(shard_session, shard, user_id, limit, before, pending)
+    rows.sort(key=lambda row: (row.last_activity, row.chat.id), reverse=True)
+    return rows[:limit]
+
+
+def _get_shard_inbox(
+    session: Session,
+    shard: int | None,
+    user_id: int,
+    limit: int,
+    before: tuple[datetime, int] | None,
+    pending: dict[int, int] | None,
+) -> list[InboxRow]:
+    last_read = func.coalesce(ReadMarkerInDB.last_read_message_id, 0)
+    if pending:
+        last_read = func.max(last_read, case(pending, value=MessageInDB.chat_id, else_=0))
+    per_chat = dict(partition_by=MessageInDB.chat_id)
+    ranked = (
+        select(
+            MessageInDB.id,
+            MessageInDB.chat_id,
+            func.row_number().over(**per_chat, order_by=MessageInDB.id.desc()).label("rank"),
+            func.count().over(**per_chat).label("message_count"),
+            func.sum(
+                case((and_(MessageInDB.id > last_read, MessageInDB.user_id != user_id), 1), else_=0)
+            ).over(**per_chat).label("unread_count"),
+        )
+        .join(UserChatLinkInDB, and_(
+            UserChatLinkInDB.chat_id == MessageInDB.chat_id,
+            UserChatLinkInDB.user_id == user_id,
+        ))
+        .outerjoin(ReadMarkerInDB, and_(
+            ReadMarkerInDB.chat_id == MessageInDB.chat_id,
+            ReadMarkerInDB.user_id == user_id,
+        ))
+        .subquery()
+    )
+
+    owner = aliased(UserInDB)
+    last_message = aliased(MessageInDB)
+    author = aliased(UserInDB)
+    last_activity = func.coalesce(last_message.created_at, ChatInDB.created_at)
+    archived_count = (
+        select(func.count())
+        .select_from(MessageArchiveInDB)
+        .where(MessageArchiveInDB.chat_id == ChatInDB.id)
+        .scalar_subquery()
+    )
+
+    query = (
+        select(
+            ChatInDB,
+            owner,
+            last_message,
+            author,
+            func.coalesce(ranked.c.message_count, 0) + archived_count,
+            func.coalesce(ranked.c.unread_count, 0),
+            last_activity,
+        )
+        .join(UserChatLinkInDB, and_(
+            UserChatLinkInDB.chat_id == ChatInDB.id,
+            UserChatLinkInDB.user_id == user_id,
+        ))
+        .join(owner, owner.id == ChatInDB.owner_id)
+        .outerjoin(ranked, and_(ranked.c.chat_id == ChatInDB.id, ranked.c.rank == 1))
+        .outerjoin(last_message, last_message.id == ranked.c.id)
+        .outerjoin(author, author.id == last_message.user_id)
+        .order_by(last_activity.desc(), ChatInDB.id.desc())
+        .limit(limit)
+    )
+
+    if shard is not None:
+        query = query.where(ChatInDB.id.in_(select(ChatShardInDB.chat_id).where(ChatShardInDB.shard == shard)))
+
+    if before:
+        before_activity, before_id = before
+        query = query.where(or_(
+            last_activity < before_activity,
+            and_(last_activity == before_activity, ChatInDB.id < before_id),
+        ))
+
+    return [InboxRow(*row) for row in session.exec(query).all()]
+
+
+def upsert_read_markers(session: Session, markers: dict[tuple[int, int], int]) -> None:
+    """Moves read markers, keyed by (user_id, chat_id), forward in one statement."""
+
+    statement = insert(ReadMarkerInDB).values([
+        {"user_id": user_id, "chat_id": chat_id, "last_read_message_id": message_id}
+        for (user_id, chat_id), message_id in markers.items()
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=[ReadMarkerInDB.user_id, ReadMarkerInDB.chat_id],
+        set_={"last_read_message_id": statement.excluded.last_read_message_id},
+        where=ReadMarkerInDB.last_read_message_id < statement.excluded.last_read_message_id,
+    )
+
+    session.exec(statement)
+    session.commit()
+
+
+def get_read_marker(session: Session, user_id: int, chat_id: int) -> int:
+    marker = session.get(ReadMarkerInDB, (user_id, chat_id))
+    return marker.last_read_message_id if marker else 0
+
+
+def get_newest_message_id(session: Session, chat_id: int) -> int:
+    """Returns the id of the newest message of a chat, 0 if it has none.
+
+    Archived messages are older than any left in the hot table, so the archive
+    is only looked at for chats whose messages were all archived.
+    """
+
+    for model in (MessageInDB, MessageArchiveInDB):
+        newest = session.exec(select(func.max(model.id)).where(model.chat_id == chat_id)).one()
+        if newest is not None:
+            return newest
+    return 0
+
+
+def count_unread_messages(session: Session, user_id: int, chat_id: int, last_read_message_id: int) -> int:
+    """Counts messages after the read marker with a range count over the
+    (chat_id, id, user_id) index, never touching the messages themselves."""
+
+    return session.exec(
+        select(func.count())
+        .select_from(MessageInDB)
+        .where(
+            MessageInDB.chat_id == chat_id,
+            MessageInDB.id > last_read_message_id,
+            MessageInDB.user_id != user_id,
+        )
+    ).one()
+
+
+def set_retention_policy(session: Session, chat_id: int, max_age_days: int | None) -> None:
+    """Sets how many days the messages of a chat are kept, or removes the
+    chat's own policy if `max_age_days` is None."""
+
+    policy = session.get(RetentionPolicyInDB, chat_id)
+    if max_age_days is None:
+        if policy:
+            session.delete(policy)
+    elif policy:
+        policy.max_age_days = max_age_days
+        session.add(policy)
+    else:
+        session.add(RetentionPolicyInDB(chat_id=chat_id, max_age_days=max_age_days))
+
+    session.commit()
@@ -1,5 +1,8 @@
+import os
 from datetime import datetime
-from pydantic import BaseModel
+from typing import Annotated, Any, Literal
+from pydantic import BaseModel, ConfigDict, Field, PlainSerializer, WrapValidator
+from backend.compression import decompress_text
 from backend.schema import ChatInDB, MessageInDB, UserInDB
 
 
@@ -13,16 +16,31 @@ class InvalidStateException(Exception):
         self.error_description = error_description
 
 
+max_ids = int(os.environ.get("MAX_IDS_PER_REQUEST", default="100"))
+max_batch_requests = int(os.environ.get("BATCH_MAX_REQUESTS", default="20"))
+
+
 class Metadata(BaseModel):
     count: int
 
 
+class IdsMetadata(Metadata):
+    """Metadata of a collection requested by id, listing the ids that were
+    not found or that the user may not see."""
+
+    missing: list[int]
+    forbidden: list[int] | None = None
+
+
 class ChatMetadata(BaseModel):
     message_count: int
     user_count: int
 
 
+# Read-model rows from `backend.readmodel` validate into these directly.
 class User(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     username: str
     email: str
@@ -37,12 +55,52 @@ class UserRequest(BaseModel):
     id: int
 
 
+def _keep_compressed(value, handler):
+    return value if isinstance(value, bytes) else handler(value)
+
+
+# Texts read in their stored form are only decompressed when serialized, and
+# not at all when a sparse fieldset leaves them out.
+MessageText = Annotated[str, WrapValidator(_keep_compressed), PlainSerializer(decompress_text, return_type=str)]
+
+
+class Attachment(BaseModel):
+    """Metadata of a file attached to a message; the file itself is downloaded
+    from `/chats/{chat_id}/attachments/{id}`."""
+
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
+
+class AttachmentResponse(BaseModel):
+    attachment: Attachment
+
+
 class Message(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
-    text: str
+    text: MessageText
     chat_id: int
     user: User
     created_at: datetime
+    attachments: list[Attachment] = []
+
+
+class NormalizedMessage(BaseModel):
+    """A message that refers to its author by id, see NormalizedMessageCollection."""
+
+    id: int
+    text: MessageText
+    chat_id: int
+    user_id: int
+    created_at: datetime
+    attachments: list[Attachment] = []
 
 
 class MessageResponse(BaseModel):
@@ -57,7 +115,36 @@ class MessagePutRequest(BaseModel):
     text: str
 
 
+class ReadMarker(BaseModel):
+    chat_id: int
+    last_read_message_id: int
+    unread_count: int
+
+
+class ReadMarkerResponse(BaseModel):
+    read_marker: ReadMarker
+
+
+class ReadMarkerPutRequest(BaseModel):
+    message_id: int
+
+
+class RetentionPolicy(BaseModel):
+    chat_id: int
+    max_age_days: int | None
+
+
+class RetentionPolicyResponse(BaseModel):
+    retention_policy: RetentionPolicy
+
+
+class RetentionPolicyPutRequest(BaseModel):
+    max_age_days: int | None = Field(default=None, ge=1)
+
+
 class Chat(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     name: str
     owner: User
@@ -71,6 +158,42 @@ class ChatResponse(BaseModel):
     users: list[User] | None = None
 
 
+class InboxMetadata(BaseModel):
+    count: int
+    next_cursor: str | None = None
+
+
+class InboxEntry(BaseModel):
+    chat: Chat
+    last_message: Message | None = None
+    message_count: int
+    unread_count: int
+
+
+class InboxCollection(BaseModel):
+    meta: InboxMetadata
+    chats: list[InboxEntry]
+
+
+class BatchOperation(BaseModel):
+    method: Literal["GET", "POST", "PUT", "DELETE"]
+    path: str = Field(pattern=r"^/")
+    body: Any = None
+
+
+class BatchRequest(BaseModel):
+    requests: list[BatchOperation] = Field(min_length=1, max_length=max_batch_requests)
+
+
+class BatchResult(BaseModel):
+    status: int
+    body: Any = None
+
+
+class BatchResponse(BaseModel):
+    responses: list[BatchResult]
+
+
 class ChatRequest(BaseModel):
     name: str
 
@@ -85,12 +208,42 @@ class UserPutRequest(BaseModel):
 
 
 class UserCollection(BaseModel):
-    meta: Metadata | None = None
+    meta: IdsMetadata | Metadata | None = Field(default=None, union_mode="left_to_right")
     users: list[User]
 
 
-class ChatCollection(BaseModel):
+class ChatMember(User):
+    """A member of a chat, with whether they are online or typing in it right now."""
+
+    online: bool = False
+    typing: bool = False
+
+
+class ChatMemberCollection(BaseModel):
     meta: Metadata
+    users: list[ChatMember]
+
+
+class Presence(BaseModel):
+    user_id: int
+    typing: bool
+
+
+class PresenceMetadata(Metadata):
+    version: int
+
+
+class PresenceCollection(BaseModel):
+    meta: PresenceMetadata
+    presence: list[Presence]
+
+
+class PresencePutRequest(BaseModel):
+    typing: bool = False
+
+
+class ChatCollection(BaseModel):
+    meta: IdsMetadata | Metadata = Field(union_mode="left_to_right")
     chats: list[Chat]
 
 
@@ -99,6 +252,14 @@ class MessageCollection(BaseModel):
     messages: list[Message]
 
 
+class NormalizedMessageCollection(BaseModel):
+    """Messages without embedded authors; each author is sent once in `users`, keyed by id."""
+
+    meta: Metadata
+    messages: list[NormalizedMessage]
+    users: dict[int, User]
+
+
 def transform_to_chat(c: ChatInDB):
     return Chat(
         id=c.id,
@@ -108,15 +269,77 @@ def transform_to_chat(c: ChatInDB):
     )
 
 
-def transform_to_message(m: MessageInDB):
+def transform_to_message(m: MessageInDB, attachments=()):
     return Message(
         id=m.id,
         text=m.text,
         chat_id=m.chat_id,
         user=User(**m.user.model_dump()),
         created_at=m.created_at,
+        attachments=[Attachment.model_validate(a) for a in attachments],
     )
 
 
+def normalize_messages(messages) -> NormalizedMessageCollection:
+    users = {}
+    normalized = []
+    for m in messages:
+        if m.user.id not in users:
+            users[m.user.id] = User.model_validate(m.user)
+        normalized.append(NormalizedMessage(
+            id=m.id,
+            text=m.text,
+            chat_id=m.chat_id,
+            user_id=m.user.id,
+            created_at=m.created_at,
+            attachments=[Attachment.model_validate(a) for a in m.attachments],
+        ))
+
+    return NormalizedMessageCollection(
+        meta={"count": len(normalized)},
+        messages=normalized,
+        users=users,
+    )
+
+
+def transform_to_inbox_entry(row):
+    last_message = None
+    if row.last_message:
+        last_message = Message(
+            id=row.last_message.id,
+            text=row.last_message.text,
+            chat_id=row.last_message.chat_id,
+            user=User(**row.last_message_author.model_dump()),
+            created_at=row.last_message.created_at,
+        )
+
+    return InboxEntry(
+        chat=Chat(
+            id=row.chat.id,
+            name=row.chat.name,
+            owner=User(**row.owner.model_dump()),
+            created_at=row.chat.created_at,
+        ),
+        last_message=last_message,
+        message_count=row.message_count,
+        unread_count=row.unread_count,
+    )
+
+
+def parse_ids(ids: str) -> list[int]:
+    """Parses a comma separated list of ids, dropping duplicates."""
+
+    try:
+        parsed = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise InvalidStateException(error_description="ids must be a comma separated list of integers")
+
+    if not parsed:
+        raise InvalidStateException(error_description="ids must not be empty")
+    if len(parsed) > max_ids:
+        raise InvalidStateException(error_description=f"at most {max_ids} ids can be requested at once")
+    return parsed
+
+
 def transform_to_user(u: UserInDB):
     return User(**u.model_dump())
\ No newline at end of file
@@ -0,0 +1,83 @@
+import typing
+from typing import Annotated
+
+from fastapi import Query
+from pydantic import BaseModel
+from starlette.responses import Response
+
+from backend.entities import InvalidStateException
+from backend.negotiation import NegotiatedResponse, wants_msgpack
+
+
+Fields = Annotated[str | None, Query(
+    description="Comma separated fields of the items to return, e.g. `id,text,user.username`",
+)]
+
+# Documents what response models cannot: with `fields`, items only have the
+# fields asked for.
+sparse_responses = {
+    200: {"description": "Successful Response. With `fields`, items only have the fields asked for."},
+}
+
+
+def parse_fields(fields: str, model: type[BaseModel]) -> dict:
+    """Turns a `fields=` value like `id,text,user.username` into a pydantic
+    `include` for items of `model`.
+
+    Nested models are selected with dotted names; naming a nested model
+    without a dot selects all of its fields.
+    """
+
+    include: dict = {}
+    for name in (f.strip() for f in fields.split(",")):
+        if not name:
+            continue
+
+        target, current = include, model
+        *parents, leaf = name.split(".")
+        for parent in parents:
+            current = _nested_model(current, parent, name)
+            selected = target.setdefault(parent, {})
+            if selected is True:
+                break
+            target = selected
+        else:
+            if leaf not in current.model_fields:
+                raise InvalidStateException(error_description=f"unknown field '{name}'")
+            target[leaf] = True
+
+    if not include:
+        raise InvalidStateException(error_description="fields must not be empty")
+    return include
+
+
+def _nested_model(model: type[BaseModel], field: str, name: str) -> type[BaseModel]:
+    info = model.model_fields.get(field)
+    annotation = info.annotation if info else None
+    for candidate in (annotation, *typing.get_args(annotation)):
+        if isinstance(candidate, type) and issubclass(candidate, BaseModel):
+            return candidate
+    raise InvalidStateException(error_description=f"unknown field '{name}'")
+
+
+def sparse_response(collection: BaseModel, items: str, fields: str | None, exclude_none: bool = False) -> Response:
+    """Serializes a collection response, keeping only `fields` of its `items`
+    if given. Everything besides the items is always included."""
+
+    include = None
+    if fields:
+        item_model = _item_model(type(collection), items)
+        include = {name: True for name in type(collection).model_fields if name != items}
+        include[items] = {"__all__": parse_fields(fields, item_model)}
+
+    if wants_msgpack():
+        return NegotiatedResponse(collection.model_dump(mode="json", include=include, exclude_none=exclude_none))
+
+    return Response(
+        content=collection.model_dump_json(include=include, exclude_none=exclude_none),
+        media_type="application/json",
+    )
+
+
+def _item_model(collection: type[BaseModel], items: str) -> type[BaseModel]:
+    return typing.get_args(collection.model_fields[items].annotation)[0]
@@ -1,30 +1,80 @@
+import asyncio
 from contextlib import asynccontextmanager
+from datetime import timedelta
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, HTMLResponse
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
+from backend import archive, backup, database as db, outbox, retention
+from backend.admission import AdmissionMiddleware, admission_queues
 from backend.auth import ExpiredToken, InvalidToken, auth_router
 from backend.entities import InvalidStateException, NoPermissionException
+from backend.ratelimit import RateLimitMiddleware, rate_limiter
+from backend.receipts import read_markers
+from backend.routers.admin import admin_router
+from backend.routers.batch import batch_router
 from backend.routers.chats import chats_router
 from backend.routers.users import users_router
 from backend.database import create_db_and_tables, EntityNotFoundException
+from backend.negotiation import ContentNegotiationMiddleware, NegotiatedResponse
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+
+    tasks = []
+    if archive.archive_after_days:
+        tasks.append(asyncio.create_task(archive.run_archiver(
+            max_age=timedelta(days=float(archive.archive_after_days)),
+            interval=archive.archive_interval,
+            batch_size=archive.archive_batch_size,
+        )))
+    tasks.append(asyncio.create_task(retention.run_retention(
+        default_days=float(retention.retention_days) if retention.retention_days else None,
+        interval=retention.retention_interval,
+        batch_size=retention.retention_batch_size,
+    )))
+    # Without handlers no events are written, see message_created_events.
+    if outbox.handlers:
+        for shard, (writer, reader) in enumerate(db.all_engines()):
+            tasks.append(asyncio.create_task(outbox.run_workers(
+                writer,
+                reader,
+                workers=outbox.outbox_workers,
+                batch_size=outbox.outbox_batch_size,
+                poll_interval=outbox.outbox_poll_interval,
+                shard=shard,
+            )))
+    if backup.backup_interval:
+        tasks.append(asyncio.create_task(backup.run_scheduled_backups(
+            interval=float(backup.backup_interval),
+            directory=backup.backup_dir,
+        )))
+
     yield
 
+    for task in tasks:
+        task.cancel()
+    read_markers.flush()
+
 app = FastAPI(
     title="RESTchat API",
     description="An API for the RESTchat application",
     version="0.1.0",
     lifespan=lifespan,
+    default_response_class=NegotiatedResponse,
 )
 
 app.include_router(auth_router)
 app.include_router(chats_router)
 app.include_router(users_router)
+app.include_router(admin_router)
+app.include_router(batch_router)
+app.add_middleware(ContentNegotiationMiddleware)
+app.add_middleware(AdmissionMiddleware, queues=admission_queues)
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173"],
@@ -83,6 +133,24 @@ def handle_invalid_client(
     )
 
 
+@app.exception_handler(PoolTimeoutError)
+def handle_pool_timeout(
+    _request: Request,
+    _exception: PoolTimeoutError,
+) -> JSONResponse:
+    # No database connection came free within DATABASE_POOL_TIMEOUT.
+    return JSONResponse(
+        status_code=503,
+        content={
+            "detail": {
+                "error": "overloaded",
+                "error_description": "database is busy, try again later",
+            },
+        },
+        headers={"Retry-After": "1"},
+    )
+
+
 @app.exception_handler(InvalidToken)
 def handle_invalid_client(
     _request: Request,
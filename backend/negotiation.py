@@ -0,0 +1,122 @@
+import json
+from contextvars import ContextVar
+from typing import Any
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import msgpack
+except ImportError:  # optional dependency, see the `msgpack` extra
+    msgpack = None
+
+
+msgpack_types = ("application/msgpack", "application/x-msgpack")
+
+# The format the current request asked for, set by ContentNegotiationMiddleware.
+response_format: ContextVar[str] = ContextVar("response_format", default="json")
+
+
+def wants_msgpack() -> bool:
+    return response_format.get() == "msgpack"
+
+
+class NegotiatedResponse(JSONResponse):
+    """Renders JSON, or MessagePack if the client asked for it with `Accept`."""
+
+    def render(self, content: Any) -> bytes:
+        if wants_msgpack():
+            self.media_type = msgpack_types[0]
+            return msgpack.packb(content)
+        return super().render(content)
+
+
+def _accepts_msgpack(accept: str) -> bool:
+    for media_range in accept.split(","):
+        media_type, *params = (part.strip() for part in media_range.split(";"))
+        if media_type in msgpack_types:
+            return not any(p.replace(" ", "") in ("q=0", "q=0.0") for p in params)
+    return False
+
+
+class ContentNegotiationMiddleware:
+    """Picks the response format from `Accept` and decodes MessagePack request
+    bodies into JSON for the routes, which only parse JSON.
+
+    Without the msgpack package installed, responses stay JSON and MessagePack
+    request bodies are refused with 415.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_type = headers.get(b"content-type", b"").split(b";")[0].strip().decode("latin-1")
+        if content_type in msgpack_types:
+            if msgpack is None:
+                await _error(415, "unsupported_media_type", "MessagePack is not supported")(scope, receive, send)
+                return
+            try:
+                scope, receive = await _transcode_body(scope, receive)
+            except (ValueError, TypeError, msgpack.UnpackException):
+                await _error(400, "invalid_body", "request body is not valid MessagePack")(scope, receive, send)
+                return
+
+        negotiated = "json"
+        if msgpack is not None and _accepts_msgpack(headers.get(b"accept", b"").decode("latin-1")):
+            negotiated = "msgpack"
+
+        async def send_with_vary(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"vary", b"Accept")]
+            await send(message)
+
+        token = response_format.set(negotiated)
+        try:
+            await self.app(scope, receive, send_with_vary)
+        finally:
+            response_format.reset(token)
+
+
+async def _transcode_body(scope: Scope, receive: Receive) -> tuple[Scope, Receive]:
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+
+    body = json.dumps(msgpack.unpackb(b"".join(chunks))).encode()
+    headers = [
+        (name, value) for name, value in scope["headers"]
+        if name not in (b"content-type", b"content-length")
+    ]
+    headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+
+    sent = False
+
+    async def receive_json() -> Message:
+        nonlocal sent
+        if sent:
+            return await receive()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return {**scope, "headers": headers}, receive_json
+
+
+def _error(status_code: int, error: str, description: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={
+            "detail": {
+                "error": error,
+                "error_description": description,
+            },
+        },
+    )
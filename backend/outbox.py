@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple
+
+import httpx
+from sqlalchemy import Engine
+from sqlmodel import Session, delete, select, update
+
+from backend.schema import OutboxInDB
+
+
+outbox_workers = int(os.environ.get("OUTBOX_WORKERS", default="2"))
+outbox_batch_size = int(os.environ.get("OUTBOX_BATCH_SIZE", default="100"))
+outbox_poll_interval = float(os.environ.get("OUTBOX_POLL_INTERVAL", default="0.5"))
+outbox_lease = float(os.environ.get("OUTBOX_LEASE", default="60"))
+outbox_max_attempts = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", default="8"))
+outbox_retry_backoff = float(os.environ.get("OUTBOX_RETRY_BACKOFF", default="1"))
+outbox_max_backoff = float(os.environ.get("OUTBOX_MAX_BACKOFF", default="3600"))
+webhook_url = os.environ.get("OUTBOX_WEBHOOK_URL")
+webhook_timeout = float(os.environ.get("OUTBOX_WEBHOOK_TIMEOUT", default="5"))
+
+logger = logging.getLogger(__name__)
+
+
+# Side effects of writes are delivered from the outbox table instead of inside
+# the request: the request only adds rows to its own transaction, and workers
+# hand them to the handlers registered for their topic. Delivery is at least
+# once, so handlers have to tolerate seeing an event twice.
+
+
+class OutboxEvent(NamedTuple):
+    id: int
+    topic: str
+    payload: dict
+    attempts: int
+    # Each shard numbers its events on its own, see database.shard_of.
+    shard: int = 0
+
+    @property
+    def key(self) -> str:
+        """Identifies the event across shards; its plain id without them."""
+
+        return f"{self.shard}-{self.id}" if self.shard else str(self.id)
+
+
+handlers: dict[str, list[Callable[[OutboxEvent], None]]] = {}
+
+
+def handler(topic: str):
+    """Registers a function to be called with each event of `topic`."""
+
+    def register(function: Callable[[OutboxEvent], None]) -> Callable[[OutboxEvent], None]:
+        handlers.setdefault(topic, []).append(function)
+        return function
+
+    return register
+
+
+def has_handlers(topic: str) -> bool:
+    """Whether events of `topic` are wanted; nobody would take them otherwise."""
+
+    return bool(handlers.get(topic))
+
+
+def has_due_events(session: Session) -> bool:
+    """Looks for an event to deliver without taking the writer connection."""
+
+    due = select(OutboxInDB.id).where(OutboxInDB.available_at <= datetime.now()).limit(1)
+    return session.exec(due).first() is not None
+
+
+def claim_events(session: Session, batch_size: int, lease: float, shard: int = 0) -> list[OutboxEvent]:
+    """Takes up to `batch_size` due events in one short transaction.
+
+    Claimed events are due again after `lease` seconds, so the events of a
+    worker that died are picked up by another.
+    """
+
+    now = datetime.now()
+    due = select(OutboxInDB.id).where(OutboxInDB.available_at <= now).order_by(OutboxInDB.id).limit(batch_size)
+    rows = session.exec(
+        update(OutboxInDB)
+        .where(OutboxInDB.id.in_(due))
+        .values(available_at=now + timedelta(seconds=lease), attempts=OutboxInDB.attempts + 1)
+        .returning(OutboxInDB.id, OutboxInDB.topic, OutboxInDB.payload, OutboxInDB.attempts)
+    ).all()
+    session.commit()
+
+    return sorted(OutboxEvent(*row, shard) for row in rows)
+
+
+def deliver(event: OutboxEvent) -> None:
+    for function in handlers.get(event.topic, []):
+        function(event)
+
+
+def complete_events(
+    session: Session,
+    delivered: list[int],
+    failed: list[tuple[OutboxEvent, str]],
+    max_attempts: int,
+    backoff: float,
+) -> None:
+    """Deletes delivered events and schedules failed ones for a retry with
+    exponential backoff, or gives up on them after `max_attempts`."""
+
+    if delivered:
+        session.exec(delete(OutboxInDB).where(OutboxInDB.id.in_(delivered)))
+
+    now = datetime.now()
+    for event, error in failed:
+        if event.attempts >= max_attempts:
+            logger.error("giving up on outbox event %s (%s): %s", event.key, event.topic, error)
+            available_at = None
+        else:
+            delay = min(backoff * 2 ** (event.attempts - 1), outbox_max_backoff)
+            available_at = now + timedelta(seconds=delay)
+        session.exec(
+            update(OutboxInDB)
+            .where(OutboxInDB.id == event.id)
+            .values(available_at=available_at, last_error=error[:1000])
+        )
+
+    session.commit()
+
+
+def drain_events(session: Session, batch_size: int, lease: float, max_attempts: int, backoff: float, shard: int = 0) -> int:
+    """Claims, delivers and completes one batch of events; returns how many were claimed.
+
+    The writer connection is only held to claim and to complete the batch,
+    not while the handlers run.
+    """
+
+    events = claim_events(session, batch_size, lease, shard)
+
+    delivered, failed = [], []
+    for event in events:
+        try:
+            deliver(event)
+        except Exception as e:
+            failed.append((event, f"{type(e).__name__}: {e}"))
+        else:
+            delivered.append(event.id)
+
+    if events:
+        complete_events(session, delivered, failed, max_attempts, backoff)
+    return len(events)
+
+
+def _drain_batch(engine: Engine, read_engine: Engine, batch_size: int, shard: int = 0) -> int:
+    # An idle outbox costs a read now and then, never a write transaction
+    # competing with requests for the writer connection.
+    with Session(read_engine) as session:
+        if not has_due_events(session):
+            return 0
+
+    with Session(engine) as session:
+        return drain_events(session, batch_size, outbox_lease, outbox_max_attempts, outbox_retry_backoff, shard)
+
+
+async def _work(engine: Engine, read_engine: Engine, batch_size: int, poll_interval: float, shard: int) -> None:
+    while True:
+        try:
+            count = await asyncio.to_thread(_drain_batch, engine, read_engine, batch_size, shard)
+        except Exception:
+            logger.exception("draining the outbox failed")
+            count = 0
+
+        # A full batch means there is probably more waiting.
+        await asyncio.sleep(0 if count == batch_size else poll_interval)
+
+
+async def run_workers(
+    engine: Engine,
+    read_engine: Engine,
+    workers: int,
+    batch_size: int,
+    poll_interval: float,
+    shard: int = 0,
+) -> None:
+    """Drains the outbox of a shard with `workers` concurrent workers until cancelled.
+
+    Workers look for due events on `read_engine` and only claim and complete
+    them on `engine`. Each worker delivers its batch in a thread of its own,
+    so a slow handler holds up one worker rather than the event loop or the
+    others.
+    """
+
+    await asyncio.gather(*(_work(engine, read_engine, batch_size, poll_interval, shard) for _ in range(workers)))
+
+
+if webhook_url:
+    _webhook_client = httpx.Client(timeout=webhook_timeout)
+
+    @handler("message.created")
+    def post_webhook(event: OutboxEvent) -> None:
+        response = _webhook_client.post(
+            webhook_url,
+            json={"id": event.id, "topic": event.topic, "payload": event.payload},
+            # Lets the receiver drop events it has already seen.
+            headers={"Idempotency-Key": event.key},
+        )
+        response.raise_for_status()
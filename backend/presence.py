@@ -0,0 +1,173 @@
+import math
+import os
+import secrets
+import threading
+import time
+from typing import Callable
+
+
+presence_ttl = float(os.environ.get("PRESENCE_TTL", default="60"))
+typing_ttl = float(os.environ.get("TYPING_TTL", default="6"))
+presence_max_entries = int(os.environ.get("PRESENCE_MAX_ENTRIES", default="100000"))
+
+
+class PresenceTracker:
+    """Who is online and who is typing in which chat, kept in memory only.
+
+    Entries expire a TTL after their last refresh. Expiry runs on a timer
+    wheel with one slot per tick: a refresh moves an entry to a later slot,
+    and every call first clears the slots whose time has passed, so expiring
+    costs what expired rather than a scan of everything.
+
+    Refreshes within the same tick change nothing, and a chat's version only
+    moves when someone comes or goes or starts or stops typing, so a client
+    sending heartbeats in a tight loop is invisible to everyone polling the
+    chat. When full, the entries closest to expiry make room.
+
+    State is per process; clients of one chat have to reach the same worker.
+    """
+
+    def __init__(
+        self,
+        presence_ttl: float,
+        typing_ttl: float,
+        max_entries: int,
+        tick: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.tick = tick
+        self.max_entries = max_entries
+        self._clock = clock
+        self._ttls = {
+            "online": max(math.ceil(presence_ttl / tick), 1),
+            "typing": max(math.ceil(typing_ttl / tick), 1),
+        }
+        self._lock = threading.Lock()
+        self._slots: list[set[tuple[int, int, str]]] = [set() for _ in range(max(self._ttls.values()) + 1)]
+        # chat id -> (user id, "online" or "typing") -> tick it expires at
+        self._chats: dict[int, dict[tuple[int, str], int]] = {}
+        self._versions: dict[int, int] = {}
+        self._changes = 0
+        self._size = 0
+        self._now = self._current_tick()
+        # Versions restart with the process; the epoch keeps their ETags apart.
+        self.epoch = secrets.token_hex(4)
+
+    def heartbeat(self, chat_id: int, user_id: int, typing: bool = False) -> None:
+        """Marks a user online in a chat, and typing or not."""
+
+        with self._lock:
+            self._advance()
+            changed = self._set(chat_id, user_id, "online")
+            if typing:
+                changed = self._set(chat_id, user_id, "typing") or changed
+            else:
+                changed = self._discard(chat_id, user_id, "typing") or changed
+            if changed:
+                self._changed(chat_id)
+
+    def leave(self, chat_id: int, user_id: int) -> None:
+        with self._lock:
+            self._advance()
+            changed = self._discard(chat_id, user_id, "typing")
+            changed = self._discard(chat_id, user_id, "online") or changed
+            if changed:
+                self._changed(chat_id)
+
+    def chat(self, chat_id: int) -> tuple[int, dict[int, bool]]:
+        """Returns the version of a chat's presence and its online users, each
+        with whether they are typing."""
+
+        with self._lock:
+            self._advance()
+            entries = self._chats.get(chat_id, {})
+            online = {user_id: False for user_id, kind in entries if kind == "online"}
+            for user_id, kind in entries:
+                if kind == "typing" and user_id in online:
+                    online[user_id] = True
+            return self._versions.get(chat_id, 0), online
+
+    def clear(self) -> None:
+        with self._lock:
+            for slot in self._slots:
+                slot.clear()
+            self._chats.clear()
+            self._versions.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._advance()
+            return {"entries": self._size, "chats": len(self._chats)}
+
+    def _current_tick(self) -> int:
+        return int(self._clock() // self.tick)
+
+    def _advance(self) -> None:
+        now = self._current_tick()
+        # Each slot needs clearing at most once, however long nobody called.
+        for tick in range(self._now + 1, min(now, self._now + len(self._slots)) + 1):
+            slot = self._slots[tick % len(self._slots)]
+            for key in [key for key in slot if self._expires(key) <= now]:
+                self._remove(key)
+                self._changed(key[0])
+        self._now = max(now, self._now)
+
+    def _expires(self, key: tuple[int, int, str]) -> int:
+        chat_id, user_id, kind = key
+        return self._chats[chat_id][(user_id, kind)]
+
+    def _set(self, chat_id: int, user_id: int, kind: str) -> bool:
+        """Schedules an entry to expire a TTL from now; returns whether it is new."""
+
+        expires = self._now + self._ttls[kind]
+        key = (chat_id, user_id, kind)
+        old = self._chats.get(chat_id, {}).get((user_id, kind))
+        if old == expires:
+            return False
+
+        if old is None:
+            if self._size >= self.max_entries:
+                self._evict()
+            self._size += 1
+        else:
+            self._slots[old % len(self._slots)].discard(key)
+
+        self._chats.setdefault(chat_id, {})[(user_id, kind)] = expires
+        self._slots[expires % len(self._slots)].add(key)
+        return old is None
+
+    def _discard(self, chat_id: int, user_id: int, kind: str) -> bool:
+        if (user_id, kind) not in self._chats.get(chat_id, {}):
+            return False
+        self._remove((chat_id, user_id, kind))
+        return True
+
+    def _remove(self, key: tuple[int, int, str]) -> None:
+        chat_id, user_id, kind = key
+        entries = self._chats[chat_id]
+        expires = entries.pop((user_id, kind))
+        self._slots[expires % len(self._slots)].discard(key)
+        self._size -= 1
+        if not entries:
+            del self._chats[chat_id]
+
+    def _evict(self) -> None:
+        for offset in range(1, len(self._slots) + 1):
+            slot = self._slots[(self._now + offset) % len(self._slots)]
+            if slot:
+                key = min(slot, key=self._expires)
+                self._remove(key)
+                self._changed(key[0])
+                return
+
+    def _changed(self, chat_id: int) -> None:
+        if chat_id not in self._chats:
+            # Nobody left; the same as never having had anyone.
+            self._versions.pop(chat_id, None)
+            return
+        self._changes += 1
+        self._versions[chat_id] = self._changes
+
+
+presence = PresenceTracker(presence_ttl, typing_ttl, presence_max_entries)
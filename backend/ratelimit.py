@@ -0,0 +1,212 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Protocol
+
+from jose import JWTError, jwt
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import compile_path
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from backend.auth import jwt_alg, jwt_key
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Allows `rate` requests per second on average with bursts of up to `burst`."""
+
+    rate: float
+    burst: int
+
+
+default_limit = RateLimit(
+    rate=float(os.environ.get("RATE_LIMIT_RATE", default="20")),
+    burst=int(os.environ.get("RATE_LIMIT_BURST", default="100")),
+)
+
+# Per-route overrides, keyed by method and route path.
+route_limits = {
+    "POST /auth/token": RateLimit(rate=1, burst=10),
+    "POST /auth/registration": RateLimit(rate=1, burst=10),
+    "GET /chats/{chat_id}/messages": RateLimit(rate=5, burst=20),
+}
+
+
+class BucketStore(Protocol):
+    # Whether `take` does I/O, and so has to be kept off the event loop.
+    blocking: bool
+
+    def take(self, key: str, limit: RateLimit, now: float) -> float:
+        """Takes a token for `key` and returns 0, or the seconds to wait if none is left."""
+
+
+def _gcra(tat: float, limit: RateLimit, now: float) -> tuple[float, float]:
+    # Generic cell rate algorithm: a token bucket tracked as a single
+    # "theoretical arrival time" instead of a token count and a timestamp.
+    # Returns the new arrival time and the seconds to wait (0 if allowed).
+    interval = 1 / limit.rate
+    tat = max(tat, now)
+    wait = tat - now - (limit.burst - 1) * interval
+    if wait > 0:
+        return tat, wait
+    return tat + interval, 0.0
+
+
+class MemoryBucketStore:
+    """Buckets for a single process, held in a bounded LRU.
+
+    Keys are spread over independently locked stripes so concurrent requests
+    rarely wait on each other. Evicting an idle key only refills its bucket.
+    """
+
+    blocking = False
+
+    def __init__(self, max_keys: int = 100_000, stripes: int = 16):
+        self._stripes = [(threading.Lock(), OrderedDict()) for _ in range(stripes)]
+        self._max_keys_per_stripe = max(1, max_keys // stripes)
+
+    def take(self, key: str, limit: RateLimit, now: float) -> float:
+        lock, buckets = self._stripes[zlib.crc32(key.encode()) % len(self._stripes)]
+        with lock:
+            tat, wait = _gcra(buckets.get(key, now), limit, now)
+            buckets[key] = tat
+            buckets.move_to_end(key)
+            if len(buckets) > self._max_keys_per_stripe:
+                buckets.popitem(last=False)
+        return wait
+
+    def clear(self) -> None:
+        for lock, buckets in self._stripes:
+            with lock:
+                buckets.clear()
+
+
+class SqliteBucketStore:
+    """Buckets shared by all worker processes through a SQLite file."""
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, "connection"):
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = OFF")
+            self._local.connection = connection
+        return self._local.connection
+
+    def take(self, key: str, limit: RateLimit, now: float) -> float:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tat FROM rate_limit_buckets WHERE key = ?", (key,)).fetchone()
+            tat, wait = _gcra(row[0] if row else now, limit, now)
+            connection.execute("INSERT OR REPLACE INTO rate_limit_buckets (key, tat) VALUES (?, ?)", (key, tat))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM rate_limit_buckets")
+
+
+class RateLimiter:
+    """Picks the limit and bucket key for a request and takes a token from the store."""
+
+    def __init__(self, store: BucketStore, default: RateLimit, routes: dict[str, RateLimit]):
+        self.store = store
+        self.default = default
+        self.routes = []
+        for route, limit in routes.items():
+            method, path = route.split(" ", 1)
+            regex, _, _ = compile_path(path)
+            self.routes.append((method, regex, path, limit))
+
+    def check(self, scope: Scope) -> float:
+        """Returns 0 if the request may proceed, or the seconds to wait."""
+
+        method, path = scope["method"], scope["path"]
+        route, limit = "*", self.default
+        for route_method, regex, route_path, route_limit in self.routes:
+            if route_method == method and regex.match(path):
+                route, limit = f"{method} {route_path}", route_limit
+                break
+
+        return self.store.take(f"{_client_key(scope)}|{route}", limit, time.time())
+
+
+_bearer = re.compile(r"^bearer\s+(\S+)$", re.IGNORECASE)
+
+
+def _client_key(scope: Scope) -> str:
+    # Verifying the signature is cheap, and keeps clients from spending
+    # another user's bucket with a forged `sub`.
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            match = _bearer.match(value.decode("latin-1"))
+            if match:
+                try:
+                    claims = jwt.decode(match.group(1), key=jwt_key, algorithms=[jwt_alg])
+                    return f"user:{claims['sub']}"
+                except (JWTError, KeyError):
+                    pass
+            break
+
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+class RateLimitMiddleware:
+    """Rejects requests over their rate limit with 429 and a `Retry-After` header."""
+
+    def __init__(self, app: ASGIApp, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.limiter.store.blocking:
+            wait = await run_in_threadpool(self.limiter.check, scope)
+        else:
+            wait = self.limiter.check(scope)
+        if wait:
+            response = JSONResponse(
+                status_code=429,
+                content={
+                    "detail": {
+                        "error": "rate_limited",
+                        "error_description": "too many requests",
+                    },
+                },
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
+
+store_path = os.environ.get("RATE_LIMIT_STORE_PATH")
+rate_limiter = RateLimiter(
+    store=SqliteBucketStore(store_path) if store_path else MemoryBucketStore(),
+    default=default_limit,
+    routes=route_limits,
+)
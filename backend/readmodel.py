@@ -0,0 +1,210 @@
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import and_, select
+from sqlmodel import Session
+
+from backend.compression import stored_text
+from backend.schema import AttachmentInDB, ChatInDB, MessageArchiveInDB, MessageInDB, UserChatLinkInDB, UserInDB
+
+
+# Read-only queries for the list endpoints. They select plain columns with
+# Core and return named tuples, so a large collection never passes through
+# the ORM identity map and its change tracking on the way to serialization.
+
+
+class UserRow(NamedTuple):
+    id: int
+    username: str
+    email: str
+    created_at: datetime
+
+
+class ChatRow(NamedTuple):
+    id: int
+    name: str
+    owner: UserRow
+    created_at: datetime
+
+
+class AttachmentRow(NamedTuple):
+    id: int
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
+
+class MessageRow(NamedTuple):
+    id: int
+    # Long texts stay compressed until the response is serialized, see entities.MessageText.
+    text: str | bytes
+    chat_id: int
+    user: UserRow
+    created_at: datetime
+    attachments: tuple[AttachmentRow, ...] = ()
+
+
+_user_columns = (UserInDB.id, UserInDB.username, UserInDB.email, UserInDB.created_at)
+_attachment_columns = (
+    AttachmentInDB.id,
+    AttachmentInDB.filename,
+    AttachmentInDB.content_type,
+    AttachmentInDB.size,
+    AttachmentInDB.sha256,
+)
+
+
+def message_row(m: MessageInDB, attachments: tuple[AttachmentRow, ...] = ()) -> MessageRow:
+    return MessageRow(
+        m.id,
+        m.text,
+        m.chat_id,
+        UserRow(m.user.id, m.user.username, m.user.email, m.user.created_at),
+        m.created_at,
+        attachments,
+    )
+
+
+def list_users(session: Session) -> list[UserRow]:
+    query = select(*_user_columns).order_by(UserInDB.id)
+    return [UserRow._make(row) for row in session.connection().execute(query)]
+
+
+def get_users_by_ids(session: Session, ids: list[int]) -> list[UserRow]:
+    query = select(*_user_columns).where(UserInDB.id.in_(ids))
+    return [UserRow._make(row) for row in session.connection().execute(query)]
+
+
+def get_chats_by_ids(session: Session, user_id: int, ids: list[int]) -> list[tuple[ChatRow, bool]]:
+    """Returns the chats with the given ids, each with whether `user_id` is a member."""
+
+    query = (
+        select(ChatInDB.id, ChatInDB.name, ChatInDB.created_at, UserChatLinkInDB.user_id.is_not(None), *_user_columns)
+        .join(UserInDB, UserInDB.id == ChatInDB.owner_id)
+        .outerjoin(UserChatLinkInDB, and_(
+            UserChatLinkInDB.chat_id == ChatInDB.id,
+            UserChatLinkInDB.user_id == user_id,
+        ))
+        .where(ChatInDB.id.in_(ids))
+    )
+
+    return [
+        (ChatRow(chat_id, name, UserRow._make(owner), created_at), is_member)
+        for chat_id, name, created_at, is_member, *owner in session.connection().execute(query)
+    ]
+
+
+def list_chat_users(session: Session, chat_id: int) -> list[UserRow]:
+    query = (
+        select(*_user_columns)
+        .join(UserChatLinkInDB, UserChatLinkInDB.user_id == UserInDB.id)
+        .where(UserChatLinkInDB.chat_id == chat_id)
+        .order_by(UserInDB.id)
+    )
+    return [UserRow._make(row) for row in session.connection().execute(query)]
+
+
+def list_user_chats(session: Session, user_id: int) -> list[ChatRow]:
+    query = (
+        select(ChatInDB.id, ChatInDB.name, ChatInDB.created_at, *_user_columns)
+        .join(UserChatLinkInDB, and_(
+            UserChatLinkInDB.chat_id == ChatInDB.id,
+            UserChatLinkInDB.user_id == user_id,
+        ))
+        .join(UserInDB, UserInDB.id == ChatInDB.owner_id)
+        .order_by(ChatInDB.name, ChatInDB.id)
+    )
+
+    owners: dict[int, UserRow] = {}
+    chats = []
+    for chat_id, name, created_at, *owner in session.connection().execute(query):
+        if owner[0] not in owners:
+            owners[owner[0]] = UserRow._make(owner)
+        chats.append(ChatRow(chat_id, name, owners[owner[0]], created_at))
+    return chats
+
+
+def list_chat_messages(
+    session: Session,
+    chat_id: int,
+    limit: int | None = None,
+    before: int | None = None,
+) -> list[MessageRow]:
+    """Returns the messages of a chat in id order, optionally only the newest
+    `limit` of those with ids below `before`.
+
+    Messages that have been archived are read from the archive once the
+    requested range reaches past the messages still in the messages table.
+    """
+
+    authors: dict[int, UserRow] = {}
+    messages = _list_chat_messages_page(session, MessageInDB, chat_id, limit, before, authors)
+
+    if limit is None or len(messages) < limit:
+        if messages:
+            before = messages[0].id
+        remaining = None if limit is None else limit - len(messages)
+        messages = _list_chat_messages_page(session, MessageArchiveInDB, chat_id, remaining, before, authors) + messages
+
+    return _with_attachments(session, chat_id, messages)
+
+
+def list_message_attachments(session: Session, message_id: int) -> tuple[AttachmentRow, ...]:
+    query = select(*_attachment_columns).where(AttachmentInDB.message_id == message_id).order_by(AttachmentInDB.id)
+    return tuple(AttachmentRow._make(row) for row in session.connection().execute(query))
+
+
+def _with_attachments(session: Session, chat_id: int, messages: list[MessageRow]) -> list[MessageRow]:
+    if not messages:
+        return messages
+
+    # One range query for the whole page rather than a parameter per message.
+    query = (
+        select(AttachmentInDB.message_id, *_attachment_columns)
+        .where(
+            AttachmentInDB.chat_id == chat_id,
+            AttachmentInDB.message_id.between(messages[0].id, messages[-1].id),
+        )
+        .order_by(AttachmentInDB.id)
+    )
+    attachments: dict[int, list[AttachmentRow]] = {}
+    for message_id, *attachment in session.connection().execute(query):
+        attachments.setdefault(message_id, []).append(AttachmentRow._make(attachment))
+
+    if not attachments:
+        return messages
+    return [
+        m._replace(attachments=tuple(attachments[m.id])) if m.id in attachments else m
+        for m in messages
+    ]
+
+
+def _list_chat_messages_page(
+    session: Session,
+    model,
+    chat_id: int,
+    limit: int | None,
+    before: int | None,
+    authors: dict[int, UserRow],
+) -> list[MessageRow]:
+    query = (
+        select(model.id, stored_text(model.text), model.created_at, *_user_columns)
+        .join(UserInDB, UserInDB.id == model.user_id)
+        .where(model.chat_id == chat_id)
+        .order_by(model.id.desc())
+    )
+    if before is not None:
+        query = query.where(model.id < before)
+    if limit is not None:
+        query = query.limit(limit)
+
+    # Authors repeat across a chat's messages; each is built once per call.
+    messages = []
+    for message_id, text, created_at, *author in session.connection().execute(query):
+        if author[0] not in authors:
+            authors[author[0]] = UserRow._make(author)
+        messages.append(MessageRow(message_id, text, chat_id, authors[author[0]], created_at))
+
+    messages.reverse()
+    return messages
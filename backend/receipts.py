@@ -0,0 +1,89 @@
+import logging
+import os
+import threading
+
+from sqlmodel import Session
+
+from backend import database as db
+
+
+flush_interval = float(os.environ.get("READ_MARKER_FLUSH_INTERVAL", default="0.25"))
+
+logger = logging.getLogger(__name__)
+
+
+class ReadMarkerBuffer:
+    """Coalesces read marker updates and writes them in batches.
+
+    A client that marks a chat read many times in quick succession costs a
+    single upsert per flush interval; only the furthest marker is written.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: dict[tuple[int, int], int] = {}
+        # The batch being written, still visible until it is committed.
+        self._flushing: dict[tuple[int, int], int] = {}
+        self._timer: threading.Timer | None = None
+
+    def record(self, user_id: int, chat_id: int, message_id: int) -> None:
+        with self._lock:
+            key = (user_id, chat_id)
+            if message_id > self._pending.get(key, 0):
+                self._pending[key] = message_id
+            self._schedule()
+
+    def _schedule(self) -> None:
+        # Called with the lock held.
+        if self._timer is None:
+            self._timer = threading.Timer(self.interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def pending(self, user_id: int, chat_id: int) -> int:
+        with self._lock:
+            key = (user_id, chat_id)
+            return max(self._pending.get(key, 0), self._flushing.get(key, 0))
+
+    def pending_for_user(self, user_id: int) -> dict[int, int]:
+        """Returns the markers of a user not written yet, by chat id."""
+
+        markers: dict[int, int] = {}
+        with self._lock:
+            for batch in (self._flushing, self._pending):
+                for (user, chat_id), message_id in batch.items():
+                    if user == user_id:
+                        markers[chat_id] = max(message_id, markers.get(chat_id, 0))
+        return markers
+
+    def flush(self) -> None:
+        # Serialized so a caller never returns while an earlier batch is still in flight.
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._flushing = pending
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+            try:
+                if pending:
+                    with Session(db.engine) as session:
+                        db.upsert_read_markers(session, pending)
+            except Exception:
+                # Kept for the next flush; markers recorded meanwhile may
+                # already be further along.
+                logger.exception("writing %d read markers failed", len(pending))
+                with self._lock:
+                    for key, message_id in pending.items():
+                        if message_id > self._pending.get(key, 0):
+                            self._pending[key] = message_id
+                    self._schedule()
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+
+read_markers = ReadMarkerBuffer(flush_interval)
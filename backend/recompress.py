@@ -0,0 +1,159 @@
+"""Offline maintenance of compressed message texts.
+
+Run from the repository root, with or without the server running:
+
+    python -m backend.recompress train --samples 2000
+    python -m backend.recompress recompress --batch-size 500
+    python -m backend.recompress stats
+
+`train` adds a dictionary built from recent long messages; new messages are
+compressed with it once the server is restarted. `recompress` then rewrites
+existing messages with it batch by batch, also compressing long ones stored
+before compression was enabled.
+"""
+
+import argparse
+import time
+
+from sqlalchemy import LargeBinary, bindparam, case, cast, func, update
+from sqlmodel import Session, select
+from sqlmodel.sql.sqltypes import AutoString
+
+from backend import compression, database as db
+from backend.compression import compress_text, decompress_text, dictionary_id, stored_text
+from backend.schema import CompressionDictionaryInDB, MessageArchiveInDB, MessageInDB
+
+
+def train(session: Session, samples: int) -> CompressionDictionaryInDB | None:
+    """Trains a dictionary on the newest `samples` messages long enough to be
+    compressed and makes it the current one."""
+
+    query = (
+        select(stored_text(MessageInDB.text))
+        .where(func.length(cast(stored_text(MessageInDB.text), LargeBinary)) >= compression.compression_threshold)
+        .order_by(MessageInDB.id.desc())
+        .limit(samples)
+    )
+    texts = [decompress_text(text) for text in session.exec(query)]
+    data = compression.train_dictionary(texts)
+    if not data:
+        return None
+
+    dictionary = CompressionDictionaryInDB(data=data)
+    session.add(dictionary)
+    session.commit()
+    compression.dictionaries.load(session.get_bind())
+
+    return dictionary
+
+
+def recompress(session: Session, model, after_id: int, batch_size: int) -> tuple[int | None, int, int, int]:
+    """Compresses the next `batch_size` messages after `after_id` with the
+    current dictionary where they are not already, in one transaction.
+
+    Returns the last id seen (None when done), how many rows were rewritten,
+    and their stored size before and after.
+    """
+
+    rows = session.exec(
+        select(model.id, stored_text(model.text))
+        .where(model.id > after_id)
+        .order_by(model.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return None, 0, 0, 0
+
+    current, _ = compression.dictionaries.current()
+    changes = []
+    before = after = 0
+    for message_id, stored in rows:
+        used = dictionary_id(stored)
+        if used == current or used is None and len(stored.encode()) < compression.compression_threshold:
+            continue
+
+        rewritten = compress_text(decompress_text(stored))
+        if rewritten != stored:
+            changes.append({"message_id": message_id, "stored": rewritten})
+            before += len(stored) if isinstance(stored, bytes) else len(stored.encode())
+            after += len(rewritten) if isinstance(rewritten, bytes) else len(rewritten.encode())
+
+    if changes:
+        # Bound as stored, past CompressedText.
+        statement = (
+            update(model.__table__)
+            .where(model.__table__.c.id == bindparam("message_id"))
+            .values(text=bindparam("stored", type_=AutoString))
+        )
+        session.connection().execute(statement, changes)
+    session.commit()
+
+    return rows[-1][0], len(changes), before, after
+
+
+def storage_stats(session: Session, model) -> tuple[int, int, int]:
+    """Returns the number of messages, how many of them are compressed, and
+    the stored size of their texts."""
+
+    text = stored_text(model.text)
+    count, compressed, size = session.exec(select(
+        func.count(),
+        func.coalesce(func.sum(case((func.typeof(text) == "blob", 1), else_=0)), 0),
+        func.coalesce(func.sum(func.length(cast(text, LargeBinary))), 0),
+    )).one()
+    return count, compressed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m backend.recompress")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train_parser = commands.add_parser("train", help="train a new dictionary on recent long messages")
+    train_parser.add_argument("--samples", type=int, default=2000)
+    recompress_parser = commands.add_parser("recompress", help="compress existing messages with the current dictionary")
+    recompress_parser.add_argument("--batch-size", type=int, default=500)
+    recompress_parser.add_argument("--sleep", type=float, default=0.01, help="seconds to pause between batches")
+    commands.add_parser("stats", help="show how messages are stored")
+    args = parser.parse_args()
+
+    # The engines log every statement.
+    for writer, reader in db.all_engines():
+        writer.echo = reader.echo = False
+    db.create_db_and_tables()
+
+    if args.command == "train":
+        with Session(db.engine, expire_on_commit=False) as session:
+            dictionary = train(session, args.samples)
+        if dictionary is None:
+            print("not enough long messages to train on")
+        else:
+            print(f"dictionary {dictionary.id}: {len(dictionary.data)} bytes")
+            print(
+                "a running server keeps compressing new messages with the dictionary it "
+                "started with; restart it to use this one"
+            )
+
+    elif args.command == "recompress":
+        for model in (MessageArchiveInDB, MessageInDB):
+            total, before, after = 0, 0, 0
+            for writer, _ in db.all_engines():
+                last_id = 0
+                while last_id is not None:
+                    with Session(writer) as session:
+                        last_id, rewritten, batch_before, batch_after = recompress(session, model, last_id, args.batch_size)
+                    total, before, after = total + rewritten, before + batch_before, after + batch_after
+                    # Lets the server's writes in between batches.
+                    time.sleep(args.sleep)
+            print(f"{model.__tablename__}: rewrote {total} messages, {before} -> {after} bytes")
+
+    else:
+        for model in (MessageInDB, MessageArchiveInDB):
+            count, compressed, size = 0, 0, 0
+            for _, reader in db.all_engines():
+                with Session(reader) as session:
+                    shard_count, shard_compressed, shard_size = storage_stats(session, model)
+                count, compressed, size = count + shard_count, compressed + shard_compressed, size + shard_size
+            print(f"{model.__tablename__}: {count} messages, {compressed} compressed, {size} bytes of text")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from itertools import takewhile
+
+from sqlmodel import Session, delete, select
+
+from backend import database as db
+from backend.cache import message_cache
+from backend.schema import ChatInDB, MessageArchiveInDB, MessageInDB, RetentionPolicyInDB
+
+
+retention_days = os.environ.get("MESSAGE_RETENTION_DAYS")
+retention_interval = float(os.environ.get("MESSAGE_RETENTION_INTERVAL", default="3600"))
+retention_batch_size = int(os.environ.get("MESSAGE_RETENTION_BATCH_SIZE", default="500"))
+vacuum_pages = int(os.environ.get("MESSAGE_RETENTION_VACUUM_PAGES", default="1000"))
+
+logger = logging.getLogger(__name__)
+
+
+def purge_messages(session: Session, read_session: Session, older_than: datetime, batch_size: int, chat_id: int) -> int:
+    """Deletes up to `batch_size` messages of a chat, live or archived, created
+    before `older_than` in one short transaction and returns how many were deleted.
+
+    Candidates are found on `read_session`; `session` only deletes them.
+    """
+
+    candidates = []
+    remaining = batch_size
+    for model in (MessageArchiveInDB, MessageInDB):
+        # Ids grow with creation time, so a chat's oldest messages come first
+        # in its (chat_id, id) index and the first one too new ends the scan.
+        rows = read_session.exec(
+            select(model.id, model.created_at)
+            .where(model.chat_id == chat_id)
+            .order_by(model.id)
+            .limit(remaining)
+        ).all()
+        ids = [id for id, _ in takewhile(lambda row: row[1] < older_than, rows)]
+        if ids:
+            candidates.append((model, ids))
+            remaining -= len(ids)
+        if not remaining:
+            break
+    db.release_connection(read_session)
+    if not candidates:
+        return 0
+
+    for model, ids in candidates:
+        session.exec(delete(model).where(model.id.in_(ids)))
+        db.delete_attachments(session, chat_id, ids)
+    session.commit()
+
+    message_cache.evict(chat_id)
+    return batch_size - remaining
+
+
+def get_retention_cutoffs(session: Session, default_days: float | None) -> list[tuple[int, datetime]]:
+    """Returns (chat_id, cutoff) pairs to purge.
+
+    Chats without a policy of their own get `default_days`, or are left out
+    when it is None.
+    """
+
+    now = datetime.now()
+    cutoffs = [
+        (policy.chat_id, now - timedelta(days=policy.max_age_days))
+        for policy in session.exec(select(RetentionPolicyInDB)).all()
+    ]
+    if default_days is not None:
+        default = now - timedelta(days=default_days)
+        chat_ids = session.exec(
+            select(ChatInDB.id)
+            .where(ChatInDB.id.not_in(select(RetentionPolicyInDB.chat_id)))
+            .order_by(ChatInDB.id)
+        ).all()
+        cutoffs.extend((chat_id, default) for chat_id in chat_ids)
+
+    return cutoffs
+
+
+def _purge_batch(older_than: datetime, batch_size: int, chat_id: int) -> int:
+    writer, reader = db.chat_engines(chat_id)
+    with Session(writer) as session, Session(reader) as read_session:
+        return purge_messages(session, read_session, older_than, batch_size, chat_id)
+
+
+def _get_cutoffs(default_days: float | None) -> list[tuple[int, datetime]]:
+    with Session(db.read_engine) as session:
+        return get_retention_cutoffs(session, default_days)
+
+
+def _incremental_vacuum(pages: int) -> None:
+    for writer, _ in db.all_engines():
+        with writer.connect() as connection:
+            # The pragma frees a page per step, but returns no rows for the driver
+            # to step through on execute(); executescript() runs it to the end.
+            connection.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({pages})")
+
+
+async def run_retention(default_days: float | None, interval: float, batch_size: int) -> None:
+    """Enforces retention policies every `interval` seconds.
+
+    Messages are deleted in chunks of `batch_size`, each its own short
+    transaction, and the writer is yielded between chunks. Freed pages are
+    then handed back to the file system with an incremental vacuum.
+    """
+
+    while True:
+        purged = 0
+        try:
+            for chat_id, older_than in await asyncio.to_thread(_get_cutoffs, default_days):
+                while True:
+                    count = await asyncio.to_thread(_purge_batch, older_than, batch_size, chat_id)
+                    purged += count
+                    if count < batch_size:
+                        break
+                    await asyncio.sleep(0)
+
+            if purged:
+                await asyncio.to_thread(_incremental_vacuum, vacuum_pages)
+                logger.info("purged %d messages", purged)
+        except Exception:
+            logger.exception("enforcing retention policies failed")
+
+        await asyncio.sleep(interval)
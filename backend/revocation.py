@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select
+
+from backend.schema import RevokedTokenInDB
+
+
+sync_interval = float(os.environ.get("TOKEN_REVOCATION_SYNC_INTERVAL", default="5"))
+
+
+class RevocationList:
+    """In-memory set of revoked token ids, pruned as the tokens expire.
+
+    Checking a token is a set lookup. Only a hit is confirmed against the
+    database, so unrevoked tokens never cost a query. Revocations made by
+    other worker processes are picked up by re-reading recent rows at most
+    every `interval` seconds, which bounds how long they take to propagate.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._expirations: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._synced_at: datetime | None = None
+        self._next_sync = 0.0
+
+    def add(self, jti: str, exp: int) -> None:
+        with self._lock:
+            self._expirations[jti] = exp
+
+    def is_revoked(self, session: Session, jti: str) -> bool:
+        if time.monotonic() >= self._next_sync:
+            self._sync(session)
+
+        if jti not in self._expirations:
+            return False
+
+        return session.get(RevokedTokenInDB, jti) is not None
+
+    def _sync(self, session: Session) -> None:
+        # Let a single thread sync while the others carry on with the current set.
+        if not self._lock.acquire(blocking=False):
+            return
+
+        try:
+            self._next_sync = time.monotonic() + self.interval
+            now = datetime.now()
+            query = select(RevokedTokenInDB.jti, RevokedTokenInDB.expires_at).where(RevokedTokenInDB.expires_at > now)
+            if self._synced_at:
+                # Overlap the previous sync to catch rows committed while it ran.
+                query = query.where(RevokedTokenInDB.revoked_at >= self._synced_at - timedelta(seconds=self.interval))
+
+            for jti, expires_at in session.exec(query):
+                self._expirations[jti] = expires_at.timestamp()
+            self._synced_at = now
+
+            cutoff = now.timestamp()
+            self._expirations = {jti: exp for jti, exp in self._expirations.items() if exp > cutoff}
+        finally:
+            self._lock.release()
+
+
+revoked_tokens = RevocationList(sync_interval)
+
+
+def revoke_token(session: Session, jti: str, exp: int) -> None:
+    """Persists a token revocation and applies it to this process immediately."""
+
+    if session.get(RevokedTokenInDB, jti) is None:
+        session.add(RevokedTokenInDB(jti=jti, expires_at=datetime.fromtimestamp(exp)))
+        session.commit()
+
+    revoked_tokens.add(jti, exp)
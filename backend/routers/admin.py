@@ -0,0 +1,81 @@
+import os
+import tempfile
+from fastapi import APIRouter, Depends
+from starlette.background import BackgroundTask
+from starlette.responses import FileResponse
+from backend import backup, database as db
+from backend.admission import admission_queues
+from backend.auth import get_admin_user
+from backend.cache import message_cache
+from backend.database import EntityNotFoundException
+from backend.entities import InvalidStateException
+from backend.presence import presence
+
+
+admin_router = APIRouter(prefix="/admin", tags=["Administration"], dependencies=[Depends(get_admin_user)])
+
+
+@admin_router.get("/admission")
+def get_admission_stats():
+    """Gets concurrency, queue depth and shed counts of each admission class."""
+
+    return {name: queue.stats() for name, queue in admission_queues.items()}
+
+
+@admin_router.get("/cache")
+def get_cache_stats():
+    """Gets hit rate and memory use of the hot message cache."""
+
+    return message_cache.stats()
+
+
+@admin_router.get("/presence")
+def get_presence_stats():
+    """Gets how many presence entries and chats are held in memory."""
+
+    return presence.stats()
+
+
+@admin_router.post("/backups", status_code=202)
+def start_backup():
+    """Starts an online backup of the database into the backup directory."""
+
+    return backup.backup_jobs.start(backup.backup_dir).stats()
+
+
+@admin_router.get("/backups/{job_id}")
+def get_backup(job_id: str):
+    """Gets the progress and duration of a backup."""
+
+    job = backup.backup_jobs.get(job_id)
+    if job is None:
+        raise EntityNotFoundException(entity_name="Backup", entity_id=job_id)
+
+    return job.stats()
+
+
+@admin_router.get("/snapshot")
+def get_snapshot():
+    """Streams a consistent copy of the database, taken with the online backup API.
+
+    Not available while messages are sharded: a single file would not hold them.
+    """
+
+    if db.shard_engines:
+        raise InvalidStateException(error_description="snapshots are not available with DATABASE_SHARDS, start a backup instead")
+
+    fd, path = tempfile.mkstemp(prefix="RESTchat-snapshot-", suffix=".db")
+    os.close(fd)
+    job = backup.BackupJob(path)
+    backup.backup_database(job, backup.backup_pages_per_step, backup.backup_step_sleep)
+    if job.status != "completed":
+        os.remove(path)
+        raise InvalidStateException(error_description=f"snapshot failed: {job.error}")
+
+    return FileResponse(
+        path,
+        media_type="application/vnd.sqlite3",
+        filename=os.path.basename(path),
+        headers={"X-Backup-Duration": f"{job.stats()['duration']:.3f}"},
+        background=BackgroundTask(os.remove, path),
+    )
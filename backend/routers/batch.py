@@ -0,0 +1,125 @@
+import json
+from dataclasses import dataclass, field
+from fastapi import APIRouter, Depends, Request
+from sqlalchemy import Engine
+from sqlmodel import Session
+from backend import database as db
+from backend.admission import AdmissionMiddleware, admission_queues
+from backend.auth import get_current_user
+from backend.entities import BatchOperation, BatchRequest, BatchResponse, BatchResult, InvalidStateException
+from backend.negotiation import response_format
+from backend.ratelimit import RateLimitMiddleware, rate_limiter
+from backend.schema import UserInDB
+
+
+batch_router = APIRouter(tags=["Batch"])
+
+
+@dataclass
+class Batch:
+    """What the sub-requests of a batch share, kept in their scope's state."""
+
+    user: UserInDB
+    session: Session
+    read_session: Session
+    # Sessions on the shards of the chats the batch touches, see session_on.
+    shard_sessions: dict[Engine, Session] = field(default_factory=dict)
+
+    def session_on(self, engine: Engine) -> Session:
+        """Returns the batch's session on a writer or read engine."""
+
+        if engine is db.engine:
+            return self.session
+        if engine is db.read_engine:
+            return self.read_session
+        if engine not in self.shard_sessions:
+            self.shard_sessions[engine] = Session(engine, expire_on_commit=False)
+        return self.shard_sessions[engine]
+
+
+@batch_router.post("/batch", response_model=BatchResponse)
+async def run_batch(
+    batch_request: BatchRequest,
+    request: Request,
+    session: Session = Depends(db.get_session),
+    read_session: Session = Depends(db.get_read_session),
+    user: UserInDB = Depends(get_current_user)):
+    """Runs several API requests in one round trip and returns all their responses.
+
+    The requests run in order, authenticated as the caller and against the
+    same database sessions. Each one is rate limited and admitted on its own
+    and gets its own status; a failing request does not stop the ones after it.
+    """
+
+    # Checked up front, so that a rejected batch has not run any of its requests.
+    if any(operation.path.split("?", 1)[0].rstrip("/") == "/batch" for operation in batch_request.requests):
+        raise InvalidStateException(error_description="batches cannot be nested")
+
+    batch = Batch(user=user, session=session, read_session=read_session)
+    responses = []
+    try:
+        for operation in batch_request.requests:
+            try:
+                responses.append(await _run(request, batch, operation))
+            finally:
+                # A failed request can leave its transaction open, holding the
+                # only writer connection, or with writes the next request would
+                # commit. Its read snapshot would hide what comes after it.
+                session.rollback()
+                db.release_connection(read_session)
+                for shard_session in batch.shard_sessions.values():
+                    shard_session.rollback()
+    finally:
+        for shard_session in batch.shard_sessions.values():
+            shard_session.close()
+
+    return BatchResponse(responses=responses)
+
+
+async def _run(request: Request, batch: Batch, operation: BatchOperation) -> BatchResult:
+    path, _, query = operation.path.partition("?")
+    headers = [(name, value) for name, value in request.scope["headers"] if name == b"authorization"]
+    body = b""
+    if operation.body is not None:
+        body = json.dumps(operation.body).encode()
+        headers.append((b"content-type", b"application/json"))
+
+    # Rate limited and admitted like a request of its own, then dispatched to
+    # the router. Content negotiation is skipped, see below.
+    scope = {
+        **{key: value for key, value in request.scope.items() if key not in ("router", "endpoint", "route", "path_params", "state")},
+        "method": operation.method,
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": headers,
+        "state": {"batch": batch},
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    status = 500
+    chunks = []
+    content_type = b""
+
+    async def send(message):
+        nonlocal status, content_type
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    # Sub-responses are embedded in the batch response, which is negotiated as a whole.
+    token = response_format.set("json")
+    try:
+        app = RateLimitMiddleware(AdmissionMiddleware(request.app.router, admission_queues), rate_limiter)
+        await app(scope, receive, send)
+    finally:
+        response_format.reset(token)
+
+    content = b"".join(chunks)
+    if content and content_type.startswith(b"application/json"):
+        return BatchResult(status=status, body=json.loads(content))
+    return BatchResult(status=status, body=content.decode(errors="replace") if content else None)
@@ -1,35 +1,100 @@
+import base64
+import os
+from datetime import datetime
 from typing import Annotated, Literal
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import Field
 from sqlmodel import Session
-from backend import database as db
+from backend import attachments, database as db, readmodel
 from backend.auth import get_current_user
+from backend.cache import message_cache
 from backend.entities import *
+from backend.fieldsets import Fields, sparse_response, sparse_responses
+from backend.presence import presence
+from backend.receipts import read_markers
 from backend.schema import UserInDB
 
 
 chats_router = APIRouter(prefix="/chats", tags=["Chats"])
 
 
-@chats_router.get("", response_model=ChatCollection)
-def get_chats(session: Session = Depends(db.get_session), user: UserInDB = Depends(get_current_user)):
-    """Gets a collection of chats."""
+@chats_router.get("", response_model=ChatCollection, response_model_exclude_none=True, responses=sparse_responses)
+def get_chats(
+    ids: str | None = Query(default=None, description="Comma separated ids of the chats to get"),
+    fields: Fields = None,
+    session: Session = Depends(db.get_read_session),
+    user: UserInDB = Depends(get_current_user)):
+    """Gets a collection of chats, optionally only those with the given ids."""
+
+    if ids is None:
+        chats = readmodel.list_user_chats(session, user.id)
+        db.release_connection(session)
+
+        collection = ChatCollection(
+            meta={"count": len(chats)},
+            chats=chats,
+        )
+        return sparse_response(collection, "chats", fields, exclude_none=True) if fields else collection
 
-    chats_in_db = db.get_user_chats_by_id(session, user.id)
-    chats = [transform_to_chat(c) for c in chats_in_db]
-    sort_key = lambda chat: getattr(chat, "name")
+    requested = parse_ids(ids)
+    found = {chat.id: (chat, is_member) for chat, is_member in readmodel.get_chats_by_ids(session, user.id, requested)}
+    db.release_connection(session)
+    chats = [found[i][0] for i in requested if i in found and found[i][1]]
 
-    return ChatCollection(
-        meta={"count": len(chats)},
-        chats=sorted(chats, key=sort_key),
+    collection = ChatCollection(
+        meta={
+            "count": len(chats),
+            "missing": [i for i in requested if i not in found],
+            "forbidden": [i for i in requested if i in found and not found[i][1]],
+        },
+        chats=chats,
     )
+    return sparse_response(collection, "chats", fields, exclude_none=True) if fields else collection
+
+
+@chats_router.get("/inbox", response_model=InboxCollection, responses=sparse_responses)
+def get_inbox(
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: str | None = None,
+    fields: Fields = None,
+    session: Session = Depends(db.get_read_session),
+    user: UserInDB = Depends(get_current_user)):
+    """Gets the current user's chats by last activity with their latest message and unread count."""
+
+    before = _decode_inbox_cursor(cursor) if cursor else None
+    rows = db.get_user_inbox(session, user.id, limit, before, read_markers.pending_for_user(user.id))
+    db.release_connection(session)
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = _encode_inbox_cursor(rows[-1].last_activity, rows[-1].chat.id)
+
+    collection = InboxCollection(
+        meta={"count": len(rows), "next_cursor": next_cursor},
+        chats=[transform_to_inbox_entry(row) for row in rows],
+    )
+    return sparse_response(collection, "chats", fields) if fields else collection
+
+
+def _encode_inbox_cursor(last_activity: datetime, chat_id: int) -> str:
+    raw = f"{last_activity.isoformat()}|{chat_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_inbox_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        last_activity, chat_id = base64.urlsafe_b64decode(cursor).decode().split("|")
+        return datetime.fromisoformat(last_activity), int(chat_id)
+    except ValueError:
+        raise InvalidStateException(error_description="invalid inbox cursor")
 
 
 @chats_router.post("", response_model=ChatResponse, response_model_exclude_none=True, status_code=201)
 def add_chat(chat_request: ChatPostRequest, session: Session = Depends(db.get_session), user: UserInDB = Depends(get_current_user)):
     """Creates a new chat."""
 
-    chat_in_db = db.create_new_chat(session, user.id, chat_request.name)
+    chat_in_db = db.create_new_chat(session, user, chat_request.name)
     chat = transform_to_chat(chat_in_db)
     
     return ChatResponse(chat=chat)
@@ -39,13 +104,13 @@ def add_chat(chat_request: ChatPostRequest, session: Session = Depends(db.get_se
 def get_chat(
     chat_id: int,
     include: Annotated[list[Literal["messages", "users"]] | None, Query()] = None,
-    session: Session = Depends(db.get_session),
+    session: Session = Depends(db.get_chat_read_session),
     user: UserInDB = Depends(get_current_user)):
     """Gets a chat for a given id."""
 
     chat_in_db = db.get_chat_by_id(session, chat_id)
     
-    if user not in chat_in_db.users:
+    if not db.is_user_in_chat(session, chat_id, user.id):
         raise NoPermissionException(error_description="requires permission to view chat")
 
     chat = transform_to_chat(chat_in_db)
@@ -54,15 +119,18 @@ def get_chat(
 
     if include:
         if "messages" in include:
-            messages = [transform_to_message(m) for m in chat_in_db.messages]
+            messages = readmodel.list_chat_messages(session, chat_id)
         if "users" in include:
-            users = [transform_to_user(u) for u in chat_in_db.users]
+            users = readmodel.list_chat_users(session, chat_id)
+
+    meta = {
+        "message_count": len(messages) if messages is not None else db.count_chat_messages(session, chat_id),
+        "user_count": len(users) if users is not None else len(chat_in_db.users),
+    }
+    db.release_connection(session)
 
     return ChatResponse(
-        meta={
-            "message_count": len(chat_in_db.messages),
-            "user_count": len(chat_in_db.users),
-        },
+        meta=meta,
         chat=chat,
         messages=messages,
         users=users,
@@ -70,105 +138,306 @@ def get_chat(
 
 
 @chats_router.put("/{chat_id}", response_model=ChatResponse, response_model_exclude_none=True)
-def update_chat(chat_id: str, request: ChatRequest, session: Session = Depends(db.get_session), user: UserInDB = Depends(get_current_user)):
+def update_chat(chat_id: int, request: ChatRequest, session: Session = Depends(db.get_session), user: UserInDB = Depends(get_current_user)):
     """Updates the name of a chat for a given id."""
 
     chat_in_db = db.get_chat_by_id(session, chat_id)
 
-    if chat_in_db.owner != user:
+    if chat_in_db.owner_id != user.id:
         raise NoPermissionException(error_description="requires permission to edit chat")
 
-    chat_in_db = db.update_chat_by_id(session, chat_id, request.name)
+    chat_in_db = db.update_chat_by_id(session, chat_id, request.name, user)
 
     return ChatResponse(
         chat=transform_to_chat(chat_in_db),
     )
 
 
-@chats_router.get("/{chat_id}/messages", response_model=MessageCollection)
-def get_chat_messages(chat_id: int,  session: Session = Depends(db.get_session), user: UserInDB = Depends(get_current_user)):
-    """Gets a collection of messages for a given chat id."""
+@chats_router.put("/{chat_id}/retention", response_model=RetentionPolicyResponse)
+def update_chat_retention(chat_id: int, request: RetentionPolicyPutRequest, session: Session = Depends(db.get_session), user: UserInDB = Depends(get_current_user)):
+    """Sets how many days the messages of a chat are kept; null falls back to the global policy."""
 
     chat_in_db = db.get_chat_by_id(session, chat_id)
-    
-    if user not in chat_in_db.users:
+
+    if chat_in_db.owner_id != user.id:
+        raise NoPermissionException(error_description="requires permission to edit chat")
+
+    db.set_retention_policy(session, chat_id, request.max_age_days)
+
+    return RetentionPolicyResponse(
+        retention_policy=RetentionPolicy(chat_id=chat_id, max_age_days=request.max_age_days),
+    )
+
+
+@chats_router.get(
+    "/{chat_id}/messages",
+    response_model=MessageCollection | NormalizedMessageCollection,
+    responses=sparse_responses,
+)
+def get_chat_messages(
+    chat_id: int,
+    limit: int | None = Query(default=None, ge=1, le=1000),
+    before: int | None = None,
+    shape: Literal["nested", "normalized"] = Query(
+        default="nested",
+        description="`normalized` sends each author once in a `users` map and refers to it by `user_id`",
+    ),
+    fields: Fields = None,
+    session: Session = Depends(db.get_chat_read_session),
+    user: UserInDB = Depends(get_current_user)):
+    """Gets a collection of messages for a given chat id, optionally only the
+    newest `limit` messages with ids below `before`."""
+
+    # Taken before the first query pins the read snapshot, so that a write
+    # the snapshot misses always bumps the version past it.
+    version = message_cache.version(chat_id)
+    if not db.is_user_in_chat(session, chat_id, user.id):
+        db.get_chat_by_id(session, chat_id)
         raise NoPermissionException(error_description="requires permission to view chat")
 
-    messages_in_db = db.get_chat_messages_by_id(session, chat_id)
-    messages = [transform_to_message(m) for m in messages_in_db]
-    sort_key = lambda message: getattr(message, "created_at")
+    messages = message_cache.get(chat_id, limit, before)
+    if messages is None:
+        messages = readmodel.list_chat_messages(session, chat_id, limit, before)
+        if before is None:
+            complete = limit is None or len(messages) < limit
+            message_cache.fill(chat_id, messages, complete, version)
+    db.release_connection(session)
+
+    if messages:
+        read_markers.record(user.id, chat_id, messages[-1].id)
 
-    return MessageCollection(
+    if shape == "normalized":
+        return sparse_response(normalize_messages(messages), "messages", fields)
+
+    collection = MessageCollection(
         meta={"count": len(messages)},
-        messages=sorted(messages, key=sort_key),
+        messages=messages,
     )
+    return sparse_response(collection, "messages", fields) if fields else collection
 
 
 @chats_router.post("/{chat_id}/messages", response_model=MessageResponse, status_code=201)
-def add_message_to_chat(chat_id: int, new_message: MessagePostRequest,  session: Session = Depends(db.get_session), user: UserInDB = Depends(get_current_user)):
+def add_message_to_chat(chat_id: int, new_message: MessagePostRequest,  session: Session = Depends(db.get_chat_session), user: UserInDB = Depends(get_current_user)):
     """Adds a message to a chat."""
 
     chat_in_db = db.get_chat_by_id(session, chat_id)
     
-    if user not in chat_in_db.users:
+    if not db.is_user_in_chat(session, chat_id, user.id):
         raise NoPermissionException(error_description="requires permission to view chat")
 
-    message = db.add_message_to_chat_by_id(session, chat_id, user.id, new_message.text)
+    message = db.add_message_to_chat_by_id(session, chat_id, user, new_message.text)
     return MessageResponse(message=transform_to_message(message))
 
 
 @chats_router.put("/{chat_id}/messages/{message_id}", response_model=MessageResponse)
-def edit_message_in_chat(chat_id: int, message_id: int, updated_message: MessagePostRequest,  session: Session = Depends(db.get_session), user: UserInDB = Depends(get_current_user)):
+def edit_message_in_chat(chat_id: int, message_id: int, updated_message: MessagePostRequest,  session: Session = Depends(db.get_chat_session), user: UserInDB = Depends(get_current_user)):
     """Edits a message in a chat."""
 
     chat = db.get_chat_by_id(session, chat_id)
     message = db.get_message_by_id(session, message_id)
-    if message.user != user:
+    if message.user_id != user.id:
         raise NoPermissionException(error_description="requires permission to edit message")
 
-    message = db.update_message_by_id(session, message_id, updated_message.text)
+    message = db.update_message_by_id(session, message_id, updated_message.text, user)
+    message_attachments = readmodel.list_message_attachments(session, message_id)
 
-    return MessageResponse(message=transform_to_message(message))
+    return MessageResponse(message=transform_to_message(message, message_attachments))
 
 
 @chats_router.delete("/{chat_id}/messages/{message_id}", status_code=204)
-def delete_message_in_chat(chat_id: int, message_id: int,  session: Session = Depends(db.get_session), user: UserInDB = Depends(get_current_user)):
+def delete_message_in_chat(chat_id: int, message_id: int,  session: Session = Depends(db.get_chat_session), user: UserInDB = Depends(get_current_user)):
     """Deletes a message in a chat."""
 
     chat = db.get_chat_by_id(session, chat_id)
     message = db.get_message_by_id(session, message_id)
-    if message.user != user:
+    if message.user_id != user.id:
         raise NoPermissionException(error_description="requires permission to edit message")
 
     message = db.delete_message_by_id(session, message_id)
 
 
-@chats_router.get("/{chat_id}/users", response_model=UserCollection)
-def get_chat_users(chat_id: int, session: Session = Depends(db.get_session), user: UserInDB = Depends(get_current_user)):
-    """Gets a collection of users for a given chat id."""
+_upload_body = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "required": ["file"],
+                "properties": {"file": {"type": "string", "format": "binary"}},
+            },
+        },
+    },
+}
 
-    chat_in_db = db.get_chat_by_id(session, chat_id)
 
-    if user not in chat_in_db.users:
+@chats_router.post(
+    "/{chat_id}/messages/{message_id}/attachments",
+    response_model=AttachmentResponse,
+    status_code=201,
+    openapi_extra={"requestBody": _upload_body},
+)
+async def add_message_attachment(chat_id: int, message_id: int, request: Request, session: Session = Depends(db.get_chat_session), user: UserInDB = Depends(get_current_user)):
+    """Attaches the `file` of a multipart/form-data body to a message.
+
+    The body is streamed to disk as it arrives instead of being parsed as a
+    form first, so large files never sit in memory."""
+
+    message = await run_in_threadpool(_get_own_message, session, chat_id, message_id, user)
+    upload = await attachments.receive_upload(request, db.attachment_dir(chat_id), attachments.attachment_max_bytes)
+    attachment = await run_in_threadpool(db.add_attachment, session, message, upload)
+
+    return AttachmentResponse(attachment=Attachment.model_validate(attachment))
+
+
+def _get_own_message(session: Session, chat_id: int, message_id: int, user: UserInDB):
+    message = db.get_message_by_id(session, message_id)
+    if message.chat_id != chat_id:
+        raise db.EntityNotFoundException(entity_name="Message", entity_id=message_id)
+    if message.user_id != user.id:
+        raise NoPermissionException(error_description="requires permission to edit message")
+
+    # Not holding the writer connection while the upload comes in.
+    db.release_connection(session)
+    return message
+
+
+@chats_router.get(
+    "/{chat_id}/attachments/{attachment_id}",
+    response_class=attachments.AttachmentFileResponse,
+    # The response class has no default status code to document.
+    status_code=200,
+    responses={200: {"content": {"application/octet-stream": {}}}, 206: {}, 304: {}, 416: {}},
+)
+def get_attachment(chat_id: int, attachment_id: int, request: Request, session: Session = Depends(db.get_chat_read_session), user: UserInDB = Depends(get_current_user)):
+    """Downloads an attached file, in full or a single byte `Range` of it."""
+
+    if not db.is_user_in_chat(session, chat_id, user.id):
+        db.get_chat_by_id(session, chat_id)
         raise NoPermissionException(error_description="requires permission to view chat")
 
-    users_in_db = db.get_chat_users_by_id(session, chat_id)
-    users = [transform_to_user(u) for u in users_in_db]
-    sort_key = lambda message: getattr(message, "id")
+    attachment = db.get_attachment_by_id(session, attachment_id)
+    db.release_connection(session)
+    path = attachments.file_path(db.attachment_dir(chat_id), attachment.sha256)
+    if attachment.chat_id != chat_id or not os.path.isfile(path):
+        raise db.EntityNotFoundException(entity_name="Attachment", entity_id=attachment_id)
+
+    return attachments.AttachmentFileResponse(
+        path,
+        attachment.sha256,
+        attachment.filename,
+        attachment.content_type,
+        attachment.size,
+        request.headers,
+    )
 
-    return UserCollection(
+
+@chats_router.put("/{chat_id}/read", response_model=ReadMarkerResponse)
+def mark_chat_read(chat_id: int, request: ReadMarkerPutRequest, session: Session = Depends(db.get_chat_read_session), user: UserInDB = Depends(get_current_user)):
+    """Marks the messages of a chat as read up to a given message id.
+
+    Ids past the chat's newest message mark it read up to that message, so
+    messages sent later are still unread.
+    """
+
+    db.get_chat_by_id(session, chat_id)
+
+    if not db.is_user_in_chat(session, chat_id, user.id):
+        raise NoPermissionException(error_description="requires permission to view chat")
+
+    message_id = min(request.message_id, db.get_newest_message_id(session, chat_id))
+    read_markers.record(user.id, chat_id, message_id)
+    last_read = max(
+        db.get_read_marker(session, user.id, chat_id),
+        read_markers.pending(user.id, chat_id),
+    )
+    unread_count = db.count_unread_messages(session, user.id, chat_id, last_read)
+    db.release_connection(session)
+
+    return ReadMarkerResponse(
+        read_marker=ReadMarker(
+            chat_id=chat_id,
+            last_read_message_id=last_read,
+            unread_count=unread_count,
+        ),
+    )
+
+
+@chats_router.get("/{chat_id}/users", response_model=ChatMemberCollection, responses=sparse_responses)
+def get_chat_users(chat_id: int, fields: Fields = None, session: Session = Depends(db.get_read_session), user: UserInDB = Depends(get_current_user)):
+    """Gets a collection of users for a given chat id, with whether they are online or typing."""
+
+    db.get_chat_by_id(session, chat_id)
+
+    if not db.is_user_in_chat(session, chat_id, user.id):
+        raise NoPermissionException(error_description="requires permission to view chat")
+
+    users = readmodel.list_chat_users(session, chat_id)
+    db.release_connection(session)
+
+    _, online = presence.chat(chat_id)
+    collection = ChatMemberCollection(
         meta={"count": len(users)},
-        users=sorted(users, key=sort_key),
+        users=[
+            ChatMember(**u._asdict(), online=u.id in online, typing=online.get(u.id, False))
+            for u in users
+        ],
+    )
+    return sparse_response(collection, "users", fields) if fields else collection
+
+
+@chats_router.put("/{chat_id}/presence", status_code=204)
+def update_presence(chat_id: int, request: PresencePutRequest, session: Session = Depends(db.get_read_session), user: UserInDB = Depends(get_current_user)):
+    """Marks the current user online in a chat, and typing or not, for a short while.
+
+    Clients repeat this as a heartbeat; presence is kept in memory and never written."""
+
+    _check_member(session, chat_id, user)
+    presence.heartbeat(chat_id, user.id, request.typing)
+
+
+@chats_router.delete("/{chat_id}/presence", status_code=204)
+def leave_presence(chat_id: int, session: Session = Depends(db.get_read_session), user: UserInDB = Depends(get_current_user)):
+    """Marks the current user offline in a chat."""
+
+    _check_member(session, chat_id, user)
+    presence.leave(chat_id, user.id)
+
+
+@chats_router.get("/{chat_id}/presence", response_model=PresenceCollection, responses={304: {}})
+def get_presence(chat_id: int, request: Request, response: Response, session: Session = Depends(db.get_read_session), user: UserInDB = Depends(get_current_user)):
+    """Gets who is online and typing in a chat.
+
+    The `ETag` only changes when someone comes, goes, or starts or stops
+    typing, so polling with `If-None-Match` is answered with 304 otherwise."""
+
+    _check_member(session, chat_id, user)
+    version, online = presence.chat(chat_id)
+
+    etag = f'"{presence.epoch}-{version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"etag": etag})
+    response.headers["etag"] = etag
+
+    return PresenceCollection(
+        meta={"count": len(online), "version": version},
+        presence=[Presence(user_id=user_id, typing=typing) for user_id, typing in sorted(online.items())],
     )
 
 
+def _check_member(session: Session, chat_id: int, user: UserInDB) -> None:
+    if not db.is_user_in_chat(session, chat_id, user.id):
+        db.get_chat_by_id(session, chat_id)
+        raise NoPermissionException(error_description="requires permission to view chat")
+    db.release_connection(session)
+
+
 @chats_router.put("/{chat_id}/users/{user_id}", response_model=UserCollection, response_model_exclude_none=True, status_code=201)
 def add_new_chat_user(chat_id: int, user_id: int, session: Session = Depends(db.get_session), user: UserInDB = Depends(get_current_user)):
     """Adds a user to a chat."""
 
     chat_in_db = db.get_chat_by_id(session, chat_id)
 
-    if chat_in_db.owner != user:
+    if chat_in_db.owner_id != user.id:
         raise NoPermissionException(error_description="requires permission to edit chat members")
 
     users_in_db = db.add_user_to_chat_by_id(session, chat_id, user_id)
@@ -187,7 +456,7 @@ def remove_chat_user(chat_id: int, user_id: int, session: Session = Depends(db.g
 
     chat_in_db = db.get_chat_by_id(session, chat_id)
 
-    if chat_in_db.owner != user:
+    if chat_in_db.owner_id != user.id:
         raise NoPermissionException(error_description="requires permission to edit chat members")
     
     if chat_in_db.owner_id == user_id:
@@ -1,33 +1,69 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlmodel import Session
-from backend import database as db
+from backend import database as db, readmodel
 from backend.auth import get_current_user, update_user_by_id
 from backend.entities import (
     UserPutRequest,
     UserResponse,
     UserCollection,
     ChatCollection,
-    transform_to_chat,
+    parse_ids,
     transform_to_user,
 )
+from backend.fieldsets import Fields, sparse_response, sparse_responses
 from backend.schema import UserInDB
 
 
 users_router = APIRouter(prefix="/users", tags=["Users"])
 
 
-@users_router.get("", response_model=UserCollection)
-def get_users(session: Session = Depends(db.get_session)):
-    """Get a collection of users."""
+@users_router.get("", response_model=UserCollection, response_model_exclude_none=True, responses=sparse_responses)
+def get_users(
+    ids: str | None = Query(default=None, description="Comma separated ids of the users to get"),
+    fields: Fields = None,
+    session: Session = Depends(db.get_read_session)):
+    """Get a collection of users, optionally only those with the given ids."""
 
-    users_in_db = db.get_all_users(session)
+    if ids is None:
+        users = readmodel.list_users(session)
+        db.release_connection(session)
+
+        collection = UserCollection(
+            meta={"count": len(users)},
+            users=users,
+        )
+        return sparse_response(collection, "users", fields, exclude_none=True) if fields else collection
+
+    requested = parse_ids(ids)
+    found = {u.id: u for u in readmodel.get_users_by_ids(session, requested)}
+    db.release_connection(session)
+    users = [found[i] for i in requested if i in found]
+
+    collection = UserCollection(
+        meta={"count": len(users), "missing": [i for i in requested if i not in found]},
+        users=users,
+    )
+    return sparse_response(collection, "users", fields, exclude_none=True) if fields else collection
+
+
+@users_router.get("/search", response_model=UserCollection, responses=sparse_responses)
+def search_users(
+    prefix: str = Query(min_length=1),
+    limit: int = Query(default=10, ge=1, le=100),
+    fields: Fields = None,
+    session: Session = Depends(db.get_read_session),
+):
+    """Get the users whose username or email starts with a given prefix."""
+
+    users_in_db = db.search_users(session, prefix, limit)
+    db.release_connection(session)
     users = [transform_to_user(u) for u in users_in_db]
-    sort_key = lambda user: getattr(user, "id")
 
-    return UserCollection(
+    collection = UserCollection(
         meta={"count": len(users)},
-        users=sorted(users, key=sort_key),
+        users=users,
     )
+    return sparse_response(collection, "users", fields) if fields else collection
 
 
 @users_router.get("/me", response_model=None)
@@ -46,22 +82,23 @@ def update_current_user(request: UserPutRequest, session: Session = Depends(db.g
 
 
 @users_router.get("/{user_id}", response_model=UserResponse)
-def get_user(user_id: int, session: Session = Depends(db.get_session)):
+def get_user(user_id: int, session: Session = Depends(db.get_read_session)):
     """Get an user for a given id."""
 
     return UserResponse(user=transform_to_user(db.get_user_by_id(session, user_id)))
 
 
-@users_router.get("/{user_id}/chats", response_model=ChatCollection)
-def get_user_chats(user_id: int, session: Session = Depends(db.get_session)):
+@users_router.get("/{user_id}/chats", response_model=ChatCollection, responses=sparse_responses)
+def get_user_chats(user_id: int, fields: Fields = None, session: Session = Depends(db.get_read_session)):
     """Get a collection of a user's chats for a given user id."""
 
-    chats_in_db = db.get_user_chats_by_id(session, user_id)
-    chats = [transform_to_chat(c) for c in chats_in_db]
-    sort_key = lambda chat: getattr(chat, "name")
+    db.get_user_by_id(session, user_id)
+    chats = readmodel.list_user_chats(session, user_id)
+    db.release_connection(session)
 
-    return ChatCollection(
+    collection = ChatCollection(
         meta={"count": len(chats)},
-        chats=sorted(chats, key=sort_key),
+        chats=chats,
     )
+    return sparse_response(collection, "chats", fields) if fields else collection
 
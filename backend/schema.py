@@ -1,8 +1,11 @@
 from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import JSON, ForeignKeyConstraint, Index, func
 from sqlmodel import Field, Relationship, SQLModel
 
+from backend.compression import CompressedText
+
 
 class UserChatLinkInDB(SQLModel, table=True):
     """Database model for many-to-many relation of users to chats."""
@@ -30,6 +33,11 @@ class UserInDB(SQLModel, table=True):
     )
 
 
+# Case-insensitive prefix search walks these as index range scans.
+Index("ix_users_username_lower", func.lower(UserInDB.__table__.c.username))
+Index("ix_users_email_lower", func.lower(UserInDB.__table__.c.email))
+
+
 class ChatInDB(SQLModel, table=True):
     """Database model for chat."""
 
@@ -48,13 +56,25 @@ class ChatInDB(SQLModel, table=True):
     messages: list["MessageInDB"] = Relationship(back_populates="chat")
 
 
+class ChatShardInDB(SQLModel, table=True):
+    """Database model for the shard file that holds the messages of a chat.
+
+    Only written while messages are sharded, see `backend.database.shard_of`.
+    """
+
+    __tablename__ = "chat_shards"
+
+    chat_id: int = Field(foreign_key="chats.id", primary_key=True)
+    shard: int
+
+
 class MessageInDB(SQLModel, table=True):
     """Database model for message."""
 
     __tablename__ = "messages"
 
     id: Optional[int] = Field(default=None, primary_key=True)
-    text: str
+    text: str = Field(sa_type=CompressedText)
     user_id: int = Field(foreign_key="users.id")
     chat_id: int = Field(foreign_key="chats.id")
     created_at: Optional[datetime] = Field(default_factory=datetime.now)
@@ -62,3 +82,142 @@ class MessageInDB(SQLModel, table=True):
     user: UserInDB = Relationship()
     chat: ChatInDB = Relationship(back_populates="messages")
 
+
+# Serves per-chat windows over messages and covers unread range counts.
+Index(
+    "ix_messages_chat_id_id_user_id",
+    MessageInDB.__table__.c.chat_id,
+    MessageInDB.__table__.c.id,
+    MessageInDB.__table__.c.user_id,
+)
+
+
+class ReadMarkerInDB(SQLModel, table=True):
+    """Database model for the last message a user has read in a chat."""
+
+    __tablename__ = "read_markers"
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["user_id", "chat_id"],
+            ["user_chat_links.user_id", "user_chat_links.chat_id"],
+            ondelete="CASCADE",
+        ),
+        # Rows are stored in the primary key b-tree without a separate rowid.
+        {"sqlite_with_rowid": False},
+    )
+
+    user_id: int = Field(primary_key=True)
+    chat_id: int = Field(primary_key=True)
+    last_read_message_id: int
+
+
+class RefreshTokenInDB(SQLModel, table=True):
+    """Database model for refresh token.
+
+    Only a hash of the token is stored. Tokens rotated from one another share
+    a family so that reuse of a spent token can revoke the whole chain.
+    """
+
+    __tablename__ = "refresh_tokens"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    token_hash: str = Field(unique=True, index=True)
+    family_id: str = Field(index=True)
+    user_id: int = Field(foreign_key="users.id")
+    expires_at: datetime
+    used_at: Optional[datetime] = None
+
+
+class RevokedTokenInDB(SQLModel, table=True):
+    """Database model for a revoked access token, kept until it expires."""
+
+    __tablename__ = "revoked_tokens"
+
+    jti: str = Field(primary_key=True)
+    expires_at: datetime = Field(index=True)
+    revoked_at: datetime = Field(default_factory=datetime.now, index=True)
+
+
+class MessageArchiveInDB(SQLModel, table=True):
+    """Database model for a message moved out of the messages table once it got old.
+
+    Archived messages keep their ids, so they sort before the chat's newer messages.
+    """
+
+    __tablename__ = "messages_archive"
+
+    id: int = Field(primary_key=True)
+    text: str = Field(sa_type=CompressedText)
+    user_id: int = Field(foreign_key="users.id")
+    chat_id: int = Field(foreign_key="chats.id")
+    created_at: datetime
+
+    user: UserInDB = Relationship()
+
+
+Index(
+    "ix_messages_archive_chat_id_id",
+    MessageArchiveInDB.__table__.c.chat_id,
+    MessageArchiveInDB.__table__.c.id,
+)
+
+
+class RetentionPolicyInDB(SQLModel, table=True):
+    """Database model for how long the messages of a chat are kept."""
+
+    __tablename__ = "retention_policies"
+
+    chat_id: int = Field(foreign_key="chats.id", primary_key=True)
+    max_age_days: int
+
+
+class AttachmentInDB(SQLModel, table=True):
+    """Database model for a file attached to a message.
+
+    The file itself is stored once per content hash, see `backend.attachments`;
+    rows only reference it. `message_id` is not a foreign key because messages
+    keep their ids when they move to the archive.
+    """
+
+    __tablename__ = "attachments"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    message_id: int = Field(index=True)
+    chat_id: int = Field(foreign_key="chats.id")
+    sha256: str = Field(index=True)
+    filename: str
+    content_type: str
+    size: int
+    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+
+
+class CompressionDictionaryInDB(SQLModel, table=True):
+    """Database model for a preset dictionary that long message texts are compressed with.
+
+    Rows are only ever added, see `backend.compression.Dictionaries`.
+    """
+
+    __tablename__ = "compression_dictionaries"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    data: bytes
+    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+
+
+class OutboxInDB(SQLModel, table=True):
+    """Database model for a side effect of a write, waiting to be delivered.
+
+    Rows are written in the same transaction as the change they announce and
+    drained by the workers in `backend.outbox`. `available_at` is when the
+    next attempt may start; it is null once delivery has been given up.
+    """
+
+    __tablename__ = "outbox"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    topic: str
+    payload: dict = Field(sa_type=JSON)
+    attempts: int = 0
+    available_at: Optional[datetime] = Field(default_factory=datetime.now, index=True)
+    last_error: Optional[str] = None
+    created_at: Optional[datetime] = Field(default_factory=datetime.now)
@@ -0,0 +1,121 @@
+"""Measures storage savings and read path overhead of message compression on
+a corpus of chat messages, log pastes and code pastes.
+
+Code pastes are cut from the standard library's sources. Run from the
+repository root:
+
+    python -m benchmarks.compression --messages 5000
+"""
+
+import argparse
+import glob
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlmodel import Session, SQLModel, create_engine
+
+from backend import compression, readmodel
+from backend.recompress import storage_stats
+from backend.entities import MessageCollection
+from backend.schema import ChatInDB, CompressionDictionaryInDB, MessageInDB, UserInDB
+
+
+_words = "the a to and of is in it that for on with this you we can be not are at have".split()
+_levels = ["DEBUG", "INFO", "INFO", "INFO", "WARNING", "ERROR"]
+
+
+def _corpus(count: int, rng: random.Random) -> list[str]:
+    sources = glob.glob(os.path.join(os.path.dirname(os.__file__), "*.py"))
+    texts = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.8:
+            texts.append(" ".join(rng.choice(_words) for _ in range(rng.randint(3, 30))))
+        elif kind < 0.9:
+            texts.append("".join(
+                f"2024-03-{rng.randint(1, 28):02} {rng.randint(0, 23):02}:{rng.randint(0, 59):02}:{rng.randint(0, 59):02},"
+                f"{rng.randint(0, 999):03} {rng.choice(_levels)} [worker-{rng.randint(1, 8)}] "
+                f"request id={rng.getrandbits(64):016x} path=/chats/{rng.randint(1, 5000)}/messages "
+                f"status={rng.choice([200, 200, 201, 404, 500])} duration_ms={rng.randint(1, 900)}\n"
+                for _ in range(rng.randint(10, 200))
+            ))
+        else:
+            with open(rng.choice(sources), encoding="utf-8", errors="replace") as file:
+                lines = file.readlines()
+            start = rng.randrange(max(len(lines) - 20, 1))
+            texts.append("".join(lines[start:start + rng.randint(20, 150)]))
+    return texts
+
+
+def _store(path: str, texts: list[str], threshold: int, dictionary: bytes | None):
+    compression.compression_threshold = threshold
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine, expire_on_commit=False) as session:
+        if dictionary:
+            session.add(CompressionDictionaryInDB(data=dictionary))
+            session.commit()
+        compression.dictionaries.load(engine)
+
+        user = UserInDB(username="bench", email="bench@test.email", hashed_password="x")
+        chat = ChatInDB(name="bench", owner=user, users=[user])
+        session.add(chat)
+        session.add_all(MessageInDB(text=text, user=user, chat=chat) for text in texts)
+        session.commit()
+    return engine, chat.id
+
+
+def _read(engine, chat_id: int, rounds: int) -> float:
+    timings = []
+    with Session(engine) as session:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            rows = readmodel.list_chat_messages(session, chat_id, limit=500)
+            MessageCollection(meta={"count": len(rows)}, messages=rows).model_dump_json()
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--threshold", type=int, default=1024)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    # Trained on other messages than it is measured on.
+    dictionary = compression.train_dictionary(_corpus(2000, rng))
+    texts = _corpus(args.messages, rng)
+
+    with tempfile.TemporaryDirectory() as directory:
+        variants = {
+            "plain": (0, None),
+            "zlib": (args.threshold, None),
+            "zlib + dictionary": (args.threshold, dictionary),
+        }
+        baseline = None
+        for name, (threshold, variant_dictionary) in variants.items():
+            path = f"{directory}/{name.replace(' ', '')}.db"
+            engine, chat_id = _store(path, texts, threshold, variant_dictionary)
+            with Session(engine) as session:
+                _, compressed, size = storage_stats(session, MessageInDB)
+            with engine.connect() as connection:
+                connection.exec_driver_sql("VACUUM")
+            file_size = os.path.getsize(path)
+            read = _read(engine, chat_id, args.rounds)
+            baseline = baseline or (size, file_size, read)
+
+            print(
+                f"{name:18} text {size / 1024:9.1f} KiB ({size / baseline[0]:5.1%})"
+                f"   file {file_size / 1024:9.1f} KiB ({file_size / baseline[1]:5.1%})"
+                f"   {compressed:5} compressed   read 500 {read * 1000:6.2f} ms ({read / baseline[2]:5.1%})"
+            )
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
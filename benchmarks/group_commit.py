@@ -0,0 +1,70 @@
+"""Compares per-message commits against group commit for concurrent posters.
+
+Run from the repository root:
+
+    python -m benchmarks.group_commit --posters 1000
+"""
+
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlmodel import Session, SQLModel, create_engine
+
+from backend.schema import ChatInDB, MessageInDB, UserInDB
+from backend.writer import GroupCommitWriter
+
+
+def _setup(path: str):
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False, "timeout": 60},
+        pool_size=64,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = UserInDB(username="bench", email="bench@test.email", hashed_password="x")
+        chat = ChatInDB(name="bench", owner=user, users=[user])
+        session.add(chat)
+        session.commit()
+        return engine, user.id, chat.id
+
+
+def _run(posters: int, post) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=posters) as executor:
+        list(executor.map(post, range(posters)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posters", type=int, default=1000)
+    parser.add_argument("--window-ms", type=float, default=2)
+    parser.add_argument("--synchronous", default="FULL")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine, user_id, chat_id = _setup(f"{directory}/per_message.db")
+
+        def post_per_message(i: int):
+            with Session(engine) as session:
+                session.add(MessageInDB(text=f"message {i}", user_id=user_id, chat_id=chat_id))
+                session.commit()
+
+        elapsed = _run(args.posters, post_per_message)
+        print(f"per-message commit: {args.posters / elapsed:8.0f} msg/s ({elapsed:.2f}s)")
+
+        engine, user_id, chat_id = _setup(f"{directory}/group.db")
+        writer = GroupCommitWriter(window=args.window_ms / 1000, synchronous=args.synchronous)
+
+        def post_grouped(i: int):
+            writer.submit(engine, MessageInDB(text=f"message {i}", user_id=user_id, chat_id=chat_id))
+
+        elapsed = _run(args.posters, post_grouped)
+        print(f"group commit:       {args.posters / elapsed:8.0f} msg/s ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Compares JSON and MessagePack throughput of the main read endpoints,
+including decoding on the client.
+
+Needs the optional msgpack package. Run from the repository root:
+
+    python -m benchmarks.negotiation --messages 1000
+"""
+
+import argparse
+import json
+import tempfile
+import time
+
+import msgpack
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, create_engine
+
+from backend import auth, database as db
+from backend.main import app
+from backend.ratelimit import rate_limiter
+from backend.schema import ChatInDB, MessageInDB
+
+
+def _setup(path: str, messages: int, users: int) -> str:
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    db.engine = db.read_engine = engine
+
+    def _session():
+        with Session(engine, expire_on_commit=False) as session:
+            yield session
+
+    app.dependency_overrides[db.get_session] = _session
+    app.dependency_overrides[db.get_read_session] = _session
+    # Measure encoding, not the rate limits.
+    rate_limiter.check = lambda scope: 0
+
+    with Session(engine, expire_on_commit=False) as session:
+        members = [
+            auth.register_user(auth.UserRegistration(username=f"user{i}", email=f"user{i}@test.email", password="password"), session).user
+            for i in range(users)
+        ]
+        chat = ChatInDB(name="bench", owner_id=members[0].id)
+        session.add(chat)
+        session.commit()
+        for member in members:
+            db.add_user_to_chat_by_id(session, chat.id, member.id)
+        session.add_all(
+            MessageInDB(text=f"message {i} " + "x" * 40, user_id=members[i % users].id, chat_id=chat.id)
+            for i in range(messages)
+        )
+        session.commit()
+        return chat.id
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        chat_id = _setup(f"{directory}/bench.db", args.messages, args.users)
+        client = TestClient(app)
+        token = client.post("/auth/token", data={"username": "user0", "password": "password"}).json()["access_token"]
+
+        formats = {
+            "json": ({}, json.loads),
+            "msgpack": ({"Accept": "application/msgpack"}, lambda content: msgpack.unpackb(content, strict_map_key=False)),
+        }
+        for path in [f"/chats/{chat_id}/messages", f"/chats/{chat_id}/messages?shape=normalized", "/chats", "/users"]:
+            for name, (headers, decode) in formats.items():
+                headers = {"Authorization": f"Bearer {token}", **headers}
+                size = len(client.get(path, headers=headers).content)
+
+                start = time.perf_counter()
+                for _ in range(args.requests):
+                    decode(client.get(path, headers=headers).content)
+                elapsed = time.perf_counter() - start
+
+                print(f"{path:40} {name:8} {args.requests / elapsed:8.0f} req/s {size / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
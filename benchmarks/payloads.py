@@ -0,0 +1,59 @@
+"""Compares payload size and serialization time of the message collection shapes.
+
+Run from the repository root:
+
+    python -m benchmarks.payloads --messages 1000
+"""
+
+import argparse
+import statistics
+import time
+from datetime import datetime
+
+from backend.entities import MessageCollection, normalize_messages
+from backend.fieldsets import sparse_response
+from backend.readmodel import MessageRow, UserRow
+
+
+def _rows(messages: int, authors: int) -> list[MessageRow]:
+    users = [UserRow(i, f"user{i}", f"user{i}@test.email", datetime.now()) for i in range(1, authors + 1)]
+    return [
+        MessageRow(i, f"message {i} " + "x" * 40, 1, users[i % authors], datetime.now())
+        for i in range(1, messages + 1)
+    ]
+
+
+def _measure(name: str, render, rounds: int):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        body = render()
+        timings.append(time.perf_counter() - start)
+
+    print(f"{name:28} {len(body) / 1024:8.1f} KiB   median {statistics.median(timings) * 1000:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--authors", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = _rows(args.messages, args.authors)
+
+    def nested(fields=None):
+        collection = MessageCollection(meta={"count": len(rows)}, messages=rows)
+        return sparse_response(collection, "messages", fields).body
+
+    def normalized(fields=None):
+        return sparse_response(normalize_messages(rows), "messages", fields).body
+
+    _measure("nested", nested, args.rounds)
+    _measure("nested, fields", lambda: nested("id,text,user.id"), args.rounds)
+    _measure("normalized", normalized, args.rounds)
+    _measure("normalized, fields", lambda: normalized("id,text,user_id"), args.rounds)
+
+
+if __name__ == "__main__":
+    main()
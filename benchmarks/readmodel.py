@@ -0,0 +1,83 @@
+"""Compares ORM entities against read-model rows for serializing a large collection.
+
+Run from the repository root:
+
+    python -m benchmarks.readmodel --messages 10000
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from sqlmodel import Session, SQLModel, create_engine
+
+from backend import database as db, readmodel
+from backend.entities import MessageCollection, transform_to_message
+from backend.schema import ChatInDB, MessageInDB, UserInDB
+
+
+def _setup(path: str, messages: int, authors: int):
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        users = [
+            UserInDB(username=f"bench{i}", email=f"bench{i}@test.email", hashed_password="x")
+            for i in range(authors)
+        ]
+        chat = ChatInDB(name="bench", owner=users[0], users=users)
+        session.add(chat)
+        session.commit()
+        session.add_all(
+            MessageInDB(text=f"message {i} " + "x" * 80, user_id=users[i % authors].id, chat_id=chat.id)
+            for i in range(messages)
+        )
+        session.commit()
+        return engine, chat.id
+
+
+def _orm(engine, chat_id: int) -> bytes:
+    with Session(engine) as session:
+        messages = [transform_to_message(m) for m in db.get_chat_by_id(session, chat_id).messages]
+        return MessageCollection(meta={"count": len(messages)}, messages=messages).model_dump_json().encode()
+
+
+def _rows(engine, chat_id: int) -> bytes:
+    with Session(engine) as session:
+        messages = readmodel.list_chat_messages(session, chat_id)
+        return MessageCollection(meta={"count": len(messages)}, messages=messages).model_dump_json().encode()
+
+
+def _measure(name: str, run, rounds: int):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:10} median {statistics.median(timings) * 1000:7.1f} ms   peak {peak / 2**20:6.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--authors", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine, chat_id = _setup(f"{directory}/bench.db", args.messages, args.authors)
+        assert _orm(engine, chat_id) == _rows(engine, chat_id)
+
+        _measure("orm", lambda: _orm(engine, chat_id), args.rounds)
+        _measure("read model", lambda: _rows(engine, chat_id), args.rounds)
+
+
+if __name__ == "__main__":
+    main()
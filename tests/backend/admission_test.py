@@ -0,0 +1,68 @@
+import asyncio
+
+from backend import auth
+from backend.admission import AdmissionQueue
+
+
+def test_admission_queue_sheds_when_full():
+    async def _run():
+        queue = AdmissionQueue(limit=1, max_queue=1, max_wait=1)
+        assert await queue.acquire()
+
+        waiting = asyncio.create_task(queue.acquire())
+        await asyncio.sleep(0)
+        assert queue.stats()["queued"] == 1
+
+        # The queue is full, so this one is shed without waiting
+        assert not await queue.acquire()
+
+        queue.release(0.01)
+        assert await waiting
+        assert queue.stats()["active"] == 1
+
+        queue.release(0.01)
+        return queue.stats()
+
+    stats = asyncio.run(_run())
+    assert stats["active"] == 0
+    assert stats["admitted"] == 2
+    assert stats["shed"] == 1
+
+
+def test_admission_queue_sheds_after_deadline():
+    async def _run():
+        queue = AdmissionQueue(limit=1, max_queue=10, max_wait=0.01)
+        assert await queue.acquire()
+        assert not await queue.acquire()
+        return queue.stats()
+
+    stats = asyncio.run(_run())
+    assert stats["queued"] == 0
+    assert stats["shed"] == 1
+
+
+def test_admission_queue_sheds_on_expected_wait():
+    async def _run():
+        queue = AdmissionQueue(limit=1, max_queue=10, max_wait=1)
+        queue.service_time = 5
+        assert await queue.acquire()
+        assert not await queue.acquire()
+        return queue.stats()
+
+    assert asyncio.run(_run())["shed"] == 1
+
+
+def test_get_admission_stats(client, user_fixture, auth_header, monkeypatch):
+    user_fixture()
+    monkeypatch.setattr(auth, "admin_usernames", {"john"})
+
+    response = client.get("/admin/admission", headers=auth_header())
+    assert response.status_code == 200
+    assert set(response.json()) == {"auth", "reads", "writes"}
+
+
+def test_get_admission_stats_requires_admin(client, user_fixture, auth_header):
+    user_fixture()
+
+    response = client.get("/admin/admission", headers=auth_header())
+    assert response.status_code == 403
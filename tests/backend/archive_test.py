@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel, select
+
+from backend import archive, database as db, readmodel
+from backend.archive import archive_messages
+from backend.schema import ChatInDB, MessageArchiveInDB, MessageInDB, UserInDB
+
+
+def _chat_with_messages(session, ages_in_days: list[int]) -> ChatInDB:
+    user = UserInDB(username="joe", email="try@me.com", hashed_password="hashed_password")
+    chat = ChatInDB(name="test_chat", owner=user, users=[user])
+    session.add(chat)
+    for i, age in enumerate(ages_in_days):
+        session.add(MessageInDB(
+            text=f"message {i}",
+            user=user,
+            chat=chat,
+            created_at=datetime.now() - timedelta(days=age),
+        ))
+    session.commit()
+    return chat
+
+
+def test_archive_messages_in_batches(session):
+    chat = _chat_with_messages(session, [30, 20, 10, 0, 0])
+    cutoff = datetime.now() - timedelta(days=5)
+
+    assert archive_messages(session, session, cutoff, batch_size=2) == 2
+    assert archive_messages(session, session, cutoff, batch_size=2) == 1
+    assert archive_messages(session, session, cutoff, batch_size=2) == 0
+
+    archived = session.exec(select(MessageArchiveInDB).order_by(MessageArchiveInDB.id)).all()
+    assert [m.text for m in archived] == ["message 0", "message 1", "message 2"]
+    assert len(session.exec(select(MessageInDB)).all()) == 2
+    assert db.count_chat_messages(session, chat.id) == 5
+
+
+def test_get_chat_messages_reads_through_archive(session):
+    chat = _chat_with_messages(session, [30, 20, 10, 0, 0])
+    archive_messages(session, session, datetime.now() - timedelta(days=5), batch_size=10)
+
+    texts = lambda messages: [m.text for m in messages]
+    assert texts(readmodel.list_chat_messages(session, chat.id)) == [f"message {i}" for i in range(5)]
+    assert texts(readmodel.list_chat_messages(session, chat.id, limit=3)) == ["message 2", "message 3", "message 4"]
+
+    newest = readmodel.list_chat_messages(session, chat.id, limit=2)
+    older = readmodel.list_chat_messages(session, chat.id, limit=2, before=newest[0].id)
+    assert texts(older) == ["message 1", "message 2"]
+    assert older[0].user.username == "joe"
+
+
+@pytest.fixture
+def engines(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path}/test.db"
+    writer = db.create_writer_engine(url)
+    reader = db.create_read_engine(url, pool_size=1)
+    SQLModel.metadata.create_all(writer)
+    monkeypatch.setattr(db, "engine", writer)
+    monkeypatch.setattr(db, "read_engine", reader)
+    yield writer, reader
+    writer.dispose()
+    reader.dispose()
+
+
+def test_archive_batch_finds_messages_on_the_read_pool(engines):
+    writer, reader = engines
+    with Session(writer) as session:
+        _chat_with_messages(session, [30, 20, 0, 10])
+
+    statements = []
+    event.listen(writer, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement.split()[0]))
+
+    # The batch ends at the first message too new to archive.
+    assert archive._archive_batch(writer, reader, datetime.now() - timedelta(days=5), batch_size=10) == 2
+    assert statements == ["INSERT", "DELETE"]
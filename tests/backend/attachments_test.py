@@ -0,0 +1,150 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend import attachments, database as db
+from backend.retention import purge_messages
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(attachments, "attachment_dir", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def chat_setup(client, user_fixture, auth_header):
+    user_fixture()
+    header = auth_header()
+    client.post("/chats", json={"name": "test_chat"}, headers=header)
+    for text in ["first", "second"]:
+        client.post("/chats/1/messages", json={"text": text}, headers=header)
+    return header
+
+
+def _upload(client, header, message_id, content, filename="notes.txt", content_type="text/plain"):
+    return client.post(
+        f"/chats/1/messages/{message_id}/attachments",
+        files={"file": (filename, content, content_type)},
+        headers=header,
+    )
+
+
+def _stored_files(store):
+    return sorted(
+        name for _, _, names in os.walk(store) for name in names
+    )
+
+
+def test_upload_is_stored_by_content(client, store, chat_setup):
+    content = b"hello attachment"
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    response = _upload(client, chat_setup, 1, content)
+
+    assert response.status_code == 201
+    assert response.json()["attachment"] == {
+        "id": 1,
+        "filename": "notes.txt",
+        "content_type": "text/plain",
+        "size": len(content),
+        "sha256": sha256,
+    }
+    assert (store / sha256[:2] / sha256).read_bytes() == content
+
+    # Same content on another message: a second attachment, but still one file.
+    assert _upload(client, chat_setup, 2, content, filename="copy.txt").status_code == 201
+    assert _stored_files(store) == [sha256]
+
+    messages = client.get("/chats/1/messages", headers=chat_setup).json()["messages"]
+    assert [[a["filename"] for a in m["attachments"]] for m in messages] == [["notes.txt"], ["copy.txt"]]
+
+
+def test_upload_limits(client, store, chat_setup, user_fixture, auth_header, monkeypatch):
+    monkeypatch.setattr(attachments, "attachment_max_bytes", 10)
+
+    response = _upload(client, chat_setup, 1, b"x" * 11)
+    assert response.status_code == 422
+    assert _stored_files(store) == []
+
+    response = client.post("/chats/1/messages/1/attachments", json={"file": "x"}, headers=chat_setup)
+    assert response.status_code == 422
+
+    response = client.post("/chats/1/messages/1/attachments", data={"file": "x"}, files={"other": ("a", b"a")}, headers=chat_setup)
+    assert response.status_code == 422
+
+    user_fixture(username="jane", email="jane@test.email")
+    response = _upload(client, auth_header(username="jane"), 1, b"x")
+    assert response.status_code == 403
+
+
+def test_download_ranges(client, store, chat_setup):
+    content = bytes(range(256)) * 4
+    sha256 = _upload(client, chat_setup, 1, content, filename="bytes ü.bin", content_type="application/octet-stream").json()["attachment"]["sha256"]
+    url = "/chats/1/attachments/1"
+
+    response = client.get(url, headers=chat_setup)
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["etag"] == f'"{sha256}"'
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-disposition"] == "attachment; filename*=utf-8''bytes%20%C3%BC.bin"
+
+    response = client.get(url, headers={**chat_setup, "If-None-Match": f'"{sha256}"'})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get(url, headers={**chat_setup, "Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == content[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(content)}"
+
+    response = client.get(url, headers={**chat_setup, "Range": "bytes=-5"})
+    assert response.content == content[-5:]
+
+    response = client.get(url, headers={**chat_setup, "Range": "bytes=1000-"})
+    assert response.content == content[1000:]
+
+    response = client.get(url, headers={**chat_setup, "Range": f"bytes={len(content)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(content)}"
+
+    # A stale If-Range gets the whole file.
+    response = client.get(url, headers={**chat_setup, "Range": "bytes=0-0", "If-Range": '"other"'})
+    assert response.status_code == 200
+    assert response.content == content
+
+
+def test_files_are_removed_with_their_last_attachment(client, session, store, chat_setup):
+    shared = hashlib.sha256(b"shared").hexdigest()
+    _upload(client, chat_setup, 1, b"shared")
+    _upload(client, chat_setup, 2, b"shared")
+
+    assert client.delete("/chats/1/messages/1", headers=chat_setup).status_code == 204
+    assert _stored_files(store) == [shared]
+    assert client.get("/chats/1/attachments/1", headers=chat_setup).status_code == 404
+
+    purge_messages(session, session, datetime.now() + timedelta(days=1), 10, chat_id=1)
+    assert _stored_files(store) == []
+
+
+def test_files_are_kept_when_the_deletion_rolls_back(client, session, store, chat_setup):
+    sha256 = hashlib.sha256(b"kept").hexdigest()
+    _upload(client, chat_setup, 1, b"kept")
+
+    db.delete_attachments(session, 1, [1])
+    session.rollback()
+    assert _stored_files(store) == [sha256]
+
+    # Nothing left over for the next commit to remove.
+    session.commit()
+    assert _stored_files(store) == [sha256]
+    assert client.get("/chats/1/attachments/1", headers=chat_setup).status_code == 200
+
+
+def test_openapi_schema(client):
+    response = client.get("/openapi.json")
+    assert response.status_code == 200
+    assert "200" in response.json()["paths"]["/chats/{chat_id}/attachments/{attachment_id}"]["get"]["responses"]
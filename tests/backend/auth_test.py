@@ -0,0 +1,92 @@
+import time
+from backend.revocation import RevocationList, revoke_token
+
+
+def _login(client, username: str = "john", password: str = "strong_password") -> dict:
+    response = client.post("/auth/token", data={"username": username, "password": password})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_get_access_token_includes_refresh_token(client, user_fixture):
+    user_fixture()
+    token = _login(client)
+
+    assert token["token_type"] == "Bearer"
+    assert token["refresh_token"]
+
+
+def test_refresh_access_token(client, user_fixture):
+    user_fixture()
+    refresh_token = _login(client)["refresh_token"]
+
+    response = client.post("/auth/refresh", json={"refresh_token": refresh_token})
+    assert response.status_code == 200
+
+    token = response.json()
+    assert token["refresh_token"] != refresh_token
+
+    response = client.get("/users/me", headers={"Authorization": f"Bearer {token['access_token']}"})
+    assert response.status_code == 200
+    assert response.json()["user"]["username"] == "john"
+
+
+def test_refresh_token_reuse_revokes_family(client, user_fixture):
+    user_fixture()
+    first = _login(client)["refresh_token"]
+    second = client.post("/auth/refresh", json={"refresh_token": first}).json()["refresh_token"]
+
+    response = client.post("/auth/refresh", json={"refresh_token": first})
+    assert response.status_code == 401
+    assert response.json()["detail"]["error_description"] == "invalid refresh token"
+
+    # The token rotated from the reused one is revoked as well
+    response = client.post("/auth/refresh", json={"refresh_token": second})
+    assert response.status_code == 401
+
+
+def test_refresh_invalid_token(client):
+    response = client.post("/auth/refresh", json={"refresh_token": "not-a-token"})
+    assert response.status_code == 401
+
+
+def test_logout_revokes_access_token(client, user_fixture):
+    user_fixture()
+    token = _login(client)
+    header = {"Authorization": f"Bearer {token['access_token']}"}
+
+    response = client.post("/auth/logout", json={"refresh_token": token["refresh_token"]}, headers=header)
+    assert response.status_code == 204
+
+    response = client.get("/users/me", headers=header)
+    assert response.status_code == 401
+    assert response.json()["detail"]["error_description"] == "revoked bearer token"
+
+    response = client.post("/auth/refresh", json={"refresh_token": token["refresh_token"]})
+    assert response.status_code == 401
+
+
+def test_revoke_other_access_token(client, user_fixture):
+    user_fixture()
+    user_fixture(username="sally", email="sally@test.email")
+    current = _login(client)["access_token"]
+    other = _login(client)["access_token"]
+    sally = _login(client, username="sally")["access_token"]
+
+    for token in [other, sally]:
+        response = client.post("/auth/revoke", json={"token": token}, headers={"Authorization": f"Bearer {current}"})
+        assert response.status_code == 204
+
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {current}"}).status_code == 200
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {other}"}).status_code == 401
+    # Tokens of other users cannot be revoked
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {sally}"}).status_code == 200
+
+
+def test_revocation_list_syncs_from_database(session):
+    revoke_token(session, "revoked-elsewhere", int(time.time()) + 60)
+
+    # A fresh list stands in for another worker process
+    revocations = RevocationList(interval=60)
+    assert revocations.is_revoked(session, "revoked-elsewhere")
+    assert not revocations.is_revoked(session, "still-valid")
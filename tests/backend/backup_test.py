@@ -0,0 +1,83 @@
+import sqlite3
+import time
+
+from backend import auth, backup
+from backend.backup import BackupJob, backup_database
+from backend.schema import ChatInDB, MessageInDB, UserInDB
+
+
+def _count_messages(path: str) -> int:
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT count(*) FROM messages").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_backup_database_in_steps(client, session, tmp_path):
+    user = UserInDB(username="joe", email="try@me.com", hashed_password="hashed_password")
+    chat = ChatInDB(name="test_chat", owner=user, users=[user])
+    for i in range(200):
+        session.add(MessageInDB(text=f"message {i} " + "x" * 200, user=user, chat=chat))
+    session.commit()
+
+    job = BackupJob(str(tmp_path / "backup.db"))
+    backup_database(job, pages_per_step=5, step_sleep=0)
+
+    assert job.status == "completed"
+    assert job.pages_total > 5
+    assert job.pages_remaining == 0
+    assert job.stats()["progress"] == 1.0
+    assert _count_messages(job.path) == 200
+
+
+def test_start_backup_and_poll_progress(client, user_fixture, auth_header, monkeypatch, tmp_path):
+    user_fixture()
+    monkeypatch.setattr(auth, "admin_usernames", {"john"})
+    monkeypatch.setattr(backup, "backup_dir", str(tmp_path))
+
+    response = client.post("/admin/backups", headers=auth_header())
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+
+    for _ in range(100):
+        job = client.get(f"/admin/backups/{job_id}", headers=auth_header()).json()
+        if job["finished_at"] is not None:
+            break
+        time.sleep(0.05)
+
+    assert job["status"] == "completed"
+    assert job["path"].startswith(str(tmp_path))
+    assert job["duration"] >= 0
+
+
+def test_get_unknown_backup(client, user_fixture, auth_header, monkeypatch):
+    user_fixture()
+    monkeypatch.setattr(auth, "admin_usernames", {"john"})
+
+    response = client.get("/admin/backups/unknown", headers=auth_header())
+    assert response.status_code == 404
+
+
+def test_get_snapshot(client, session, user_fixture, auth_header, monkeypatch, tmp_path):
+    user_fixture()
+    monkeypatch.setattr(auth, "admin_usernames", {"john"})
+
+    response = client.get("/admin/snapshot", headers=auth_header())
+    assert response.status_code == 200
+    assert "X-Backup-Duration" in response.headers
+
+    path = tmp_path / "snapshot.db"
+    path.write_bytes(response.content)
+    connection = sqlite3.connect(path)
+    try:
+        assert connection.execute("SELECT username FROM users").fetchall() == [("john",)]
+    finally:
+        connection.close()
+
+
+def test_snapshot_requires_admin(client, user_fixture, auth_header):
+    user_fixture()
+
+    response = client.get("/admin/snapshot", headers=auth_header())
+    assert response.status_code == 403
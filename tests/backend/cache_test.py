@@ -0,0 +1,74 @@
+from datetime import datetime
+
+from backend.cache import MessageCache
+from backend.readmodel import MessageRow, UserRow
+
+
+def _message(id: int, chat_id: int = 1, text: str = "hello") -> MessageRow:
+    user = UserRow(id=1, username="john", email="john@test.email", created_at=datetime.now())
+    return MessageRow(id=id, text=text, chat_id=chat_id, user=user, created_at=datetime.now())
+
+
+def test_message_cache_serves_newest_messages():
+    cache = MessageCache(capacity=3, memory_budget=1_000_000)
+    assert cache.get(1, limit=2) is None
+
+    cache.fill(1, [_message(i) for i in range(1, 6)], complete=True, version=cache.version(1))
+
+    assert [m.id for m in cache.get(1, limit=2)] == [4, 5]
+    assert [m.id for m in cache.get(1, limit=2, before=5)] == [3, 4]
+    # Older messages than the buffer holds have to come from the database
+    assert cache.get(1, limit=3, before=5) is None
+    assert cache.get(1) is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 3)
+
+
+def test_message_cache_complete_chat():
+    cache = MessageCache(capacity=3, memory_budget=1_000_000)
+    cache.fill(1, [_message(1), _message(2)], complete=True, version=cache.version(1))
+
+    assert [m.id for m in cache.get(1)] == [1, 2]
+    assert [m.id for m in cache.get(1, limit=10)] == [1, 2]
+
+    cache.append(_message(3))
+    assert [m.id for m in cache.get(1)] == [1, 2, 3]
+
+    # Once the ring buffer wraps, the oldest message is gone
+    cache.append(_message(4))
+    assert cache.get(1) is None
+    assert [m.id for m in cache.get(1, limit=3)] == [2, 3, 4]
+
+
+def test_message_cache_updates():
+    cache = MessageCache(capacity=3, memory_budget=1_000_000)
+    cache.fill(1, [_message(1), _message(2)], complete=True, version=cache.version(1))
+
+    cache.replace(_message(2, text="edited"))
+    cache.remove(1, 1)
+
+    assert [(m.id, m.text) for m in cache.get(1)] == [(2, "edited")]
+
+
+def test_message_cache_drops_stale_fill():
+    cache = MessageCache(capacity=3, memory_budget=1_000_000)
+    version = cache.version(1)
+    cache.append(_message(3))
+
+    cache.fill(1, [_message(1), _message(2)], complete=True, version=version)
+    assert cache.get(1) is None
+
+
+def test_message_cache_evicts_least_recently_used_chat():
+    cache = MessageCache(capacity=3, memory_budget=1000)
+    for chat_id in [1, 2]:
+        cache.fill(chat_id, [_message(1, chat_id), _message(2, chat_id)], complete=True, version=cache.version(chat_id))
+
+    cache.get(1)
+    cache.fill(3, [_message(1, 3), _message(2, 3)], complete=True, version=cache.version(3))
+
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    assert cache.get(3) is not None
+    assert cache.stats()["size"] <= 1000
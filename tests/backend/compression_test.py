@@ -0,0 +1,97 @@
+import random
+
+import pytest
+from sqlalchemy import text
+from sqlmodel import select
+
+from backend import compression, readmodel
+from backend.recompress import recompress, storage_stats, train
+from backend.compression import Dictionaries, compress_text, decompress_text
+from backend.entities import Message, MessageCollection
+from backend.schema import ChatInDB, MessageInDB, UserInDB
+
+
+@pytest.fixture(autouse=True)
+def dictionaries(session, monkeypatch):
+    dictionaries = Dictionaries()
+    dictionaries.load(session.get_bind())
+    monkeypatch.setattr(compression, "dictionaries", dictionaries)
+    monkeypatch.setattr(compression, "compression_threshold", 100)
+    return dictionaries
+
+
+def _log(seed: int) -> str:
+    rng = random.Random(seed)
+    return "".join(
+        f"2024-03-0{rng.randint(1, 9)} 12:{rng.randint(10, 59)}:00 INFO backend.worker request handled "
+        f"path=/chats/{rng.randint(1, 500)}/messages status=200 duration_ms={rng.randint(1, 99)}\n"
+        for _ in range(20)
+    )
+
+
+def _chat(session, texts: list[str]) -> ChatInDB:
+    user = UserInDB(username="joe", email="try@me.com", hashed_password="hashed_password")
+    chat = ChatInDB(name="test_chat", owner=user, users=[user])
+    session.add(chat)
+    session.add_all(MessageInDB(text=t, user=user, chat=chat) for t in texts)
+    session.commit()
+    return chat
+
+
+def _stored(session) -> list:
+    return session.connection().execute(text("SELECT text FROM messages ORDER BY id")).scalars().all()
+
+
+def test_long_texts_are_stored_compressed(session):
+    chat = _chat(session, ["short", _log(1), "ü" * 30 + _log(2)])
+
+    stored = _stored(session)
+    assert stored[0] == "short"
+    assert all(isinstance(s, bytes) and len(s) < len(t.encode()) for s, t in zip(stored[1:], [_log(1), _log(2)]))
+
+    session.expire_all()
+    assert [m.text for m in session.exec(select(MessageInDB).order_by(MessageInDB.id))] == ["short", _log(1), "ü" * 30 + _log(2)]
+
+    # The read model leaves them compressed until they are serialized.
+    rows = readmodel.list_chat_messages(session, chat.id)
+    assert isinstance(rows[1].text, bytes)
+    collection = MessageCollection(meta={"count": len(rows)}, messages=rows)
+    assert [m["text"] for m in collection.model_dump()["messages"]] == ["short", _log(1), "ü" * 30 + _log(2)]
+    assert Message.model_validate(rows[1]).model_dump_json(include={"id"}) == '{"id":2}'
+
+
+def test_threshold():
+    assert compress_text("x" * 99) == "x" * 99
+    assert isinstance(compress_text("x" * 100), bytes)
+    assert decompress_text(compress_text("x" * 100)) == "x" * 100
+
+
+def test_trained_dictionary_and_recompression(session, dictionaries):
+    _chat(session, [_log(i) for i in range(20)])
+    plain_size = storage_stats(session, MessageInDB)[2]
+
+    without_dictionary = compress_text(_log(99))
+
+    dictionary = train(session, samples=20)
+    assert dictionaries.current() == (dictionary.id, dictionary.data)
+    with_dictionary = compress_text(_log(99))
+    assert compression.dictionary_id(with_dictionary) == dictionary.id
+    assert len(with_dictionary) < len(without_dictionary)
+    assert decompress_text(with_dictionary) == _log(99)
+
+    last_id, rewritten, before, after = recompress(session, MessageInDB, 0, batch_size=15)
+    assert (last_id, rewritten) == (15, 15)
+    assert after < before
+    assert recompress(session, MessageInDB, last_id, batch_size=15)[:2] == (20, 5)
+    assert recompress(session, MessageInDB, 20, batch_size=15) == (None, 0, 0, 0)
+    assert recompress(session, MessageInDB, 0, batch_size=50)[1] == 0
+
+    count, compressed, size = storage_stats(session, MessageInDB)
+    assert (count, compressed) == (20, 20)
+    assert size < plain_size
+    assert [decompress_text(s) for s in _stored(session)] == [_log(i) for i in range(20)]
+
+    # Another process only learns of the dictionary when it needs it.
+    other = Dictionaries()
+    other._engine = session.get_bind()
+    assert other.get(dictionary.id) == dictionary.data
@@ -5,6 +5,10 @@ from sqlmodel import Session, SQLModel, StaticPool, create_engine
 
 from backend.main import app
 from backend import auth, database as db
+from backend.cache import message_cache
+from backend.presence import presence
+from backend.ratelimit import rate_limiter
+from backend.receipts import read_markers
 from backend.schema import ChatInDB, UserInDB
 
 
@@ -16,19 +20,28 @@ def session():
         poolclass=StaticPool,
     )
     SQLModel.metadata.create_all(engine)
-    with Session(engine) as session:
+    with Session(engine, expire_on_commit=False) as session:
         yield session
 
 
 @pytest.fixture
-def client(session):
+def client(session, monkeypatch):
     def _get_session_override():
         return session
 
     app.dependency_overrides[db.get_session] = _get_session_override
+    app.dependency_overrides[db.get_read_session] = _get_session_override
+    app.dependency_overrides[db.get_chat_session] = _get_session_override
+    app.dependency_overrides[db.get_chat_read_session] = _get_session_override
+    monkeypatch.setattr(db, "engine", session.get_bind())
+    monkeypatch.setattr(db, "read_engine", session.get_bind())
+    rate_limiter.store.clear()
+    message_cache.clear()
+    presence.clear()
 
     yield TestClient(app)
 
+    read_markers.flush()
     app.dependency_overrides.clear()
 
 
@@ -50,3 +63,18 @@ def user_fixture(session):
 
     return _build_user
 
+
+
+@pytest.fixture
+def auth_header(client):
+    def _build_auth_header(
+            username: str = "john",
+            password: str = "strong_password",
+    ) -> dict[str, str]:
+        response = client.post(
+            "/auth/token",
+            data={"username": username, "password": password},
+        )
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    return _build_auth_header
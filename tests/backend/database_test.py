@@ -1,4 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from sqlalchemy import exc, func
+from sqlmodel import Session, SQLModel, select
+from backend import database as db
+from backend.cache import message_cache
 from backend.entities import *
+from backend.main import app
+from backend.receipts import read_markers
+from backend.routers import chats
+from backend.writer import GroupCommitWriter
 
 
 def test_relationship(session):
@@ -34,3 +44,196 @@ def test_relationship(session):
     assert message in chat.messages
     assert user == message.user
     assert chat == message.chat
+
+
+def test_group_commit_writer(session):
+    user = UserInDB(username="joe", email="try@me.com", hashed_password="hashed_password")
+    chat = ChatInDB(name="test_chat", owner=user, users=[user])
+    session.add(chat)
+    session.commit()
+
+    writer = GroupCommitWriter(window=0.01)
+    engine = session.get_bind()
+
+    def _post(i: int) -> MessageInDB:
+        message = MessageInDB(text=f"message {i}", user_id=user.id, chat_id=chat.id)
+        return writer.submit(engine, message)
+
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        messages = list(executor.map(_post, range(50)))
+
+    assert len({m.id for m in messages}) == 50
+    assert all(m.text == f"message {i}" for i, m in enumerate(messages))
+    session.refresh(chat)
+    assert len(chat.messages) == 50
+
+
+def test_group_commit_writer_fails_only_bad_rows(session):
+    session.add(UserInDB(username="joe", email="try@me.com", hashed_password="hashed_password"))
+    session.commit()
+
+    writer = GroupCommitWriter(window=0.05)
+    engine = session.get_bind()
+    names = ["ann", "joe", "bob", "kim"]
+
+    def _register(name: str) -> UserInDB | Exception:
+        try:
+            return writer.submit(engine, UserInDB(username=name, email=f"{name}@test.email", hashed_password="hashed_password"))
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        results = dict(zip(names, executor.map(_register, names)))
+
+    assert isinstance(results["joe"], exc.IntegrityError)
+    assert all(results[name].username == name for name in ["ann", "bob", "kim"])
+    assert len(session.exec(select(UserInDB)).all()) == 4
+
+
+def test_group_commit_writer_restores_synchronous(session):
+    engine = session.get_bind()
+    with engine.connect() as connection:
+        synchronous = connection.exec_driver_sql("PRAGMA synchronous").scalar()
+
+    writer = GroupCommitWriter(window=0.001, synchronous="OFF")
+    writer.submit(engine, UserInDB(username="joe", email="try@me.com", hashed_password="hashed_password"))
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == synchronous
+
+
+def test_read_session_keeps_snapshot_until_released(engines):
+    writer, reader = engines
+
+    def _add_user(name: str):
+        with Session(writer) as session:
+            session.add(UserInDB(username=name, email=f"{name}@test.email", hashed_password="hashed_password"))
+            session.commit()
+
+    _add_user("joe")
+    with Session(reader, expire_on_commit=False) as session:
+        count = select(func.count()).select_from(UserInDB)
+        joe = session.exec(select(UserInDB)).one()
+        assert reader.pool.checkedout() == 1
+
+        _add_user("jane")
+        assert session.exec(count).one() == 1
+
+        db.release_connection(session)
+        assert reader.pool.checkedout() == 0
+        assert joe.username == "joe"
+        assert session.exec(count).one() == 2
+
+        session.add(UserInDB(username="jim", email="jim@test.email", hashed_password="hashed_password"))
+        with pytest.raises(exc.OperationalError, match="readonly"):
+            session.commit()
+
+
+def test_get_chat_messages_does_not_cache_a_stale_snapshot(engines, monkeypatch):
+    writer, reader = engines
+    monkeypatch.setattr(db, "engine", writer)
+    message_cache.clear()
+
+    with Session(writer, expire_on_commit=False) as session:
+        user = UserInDB(username="joe", email="try@me.com", hashed_password="hashed_password")
+        chat = ChatInDB(name="test_chat", owner=user, users=[user])
+        session.add(chat)
+        session.commit()
+        db.add_message_to_chat_by_id(session, chat.id, user, "first")
+
+    is_user_in_chat = db.is_user_in_chat
+
+    def _is_user_in_chat_then_post(session, chat_id, user_id):
+        # Another message is posted once the membership check has pinned the read snapshot.
+        member = is_user_in_chat(session, chat_id, user_id)
+        with Session(writer, expire_on_commit=False) as write_session:
+            db.add_message_to_chat_by_id(write_session, chat_id, user, "second")
+        return member
+
+    def _texts() -> list[str]:
+        with Session(reader, expire_on_commit=False) as session:
+            messages = chats.get_chat_messages(chat.id, limit=None, before=None, shape="nested", fields=None, session=session, user=user)
+        return [m.text for m in messages.messages]
+
+    monkeypatch.setattr(db, "is_user_in_chat", _is_user_in_chat_then_post)
+    assert _texts() == ["first"]
+
+    monkeypatch.setattr(db, "is_user_in_chat", is_user_in_chat)
+    assert _texts() == ["first", "second"]
+
+    read_markers.flush()
+    message_cache.clear()
+
+
+@pytest.fixture
+def engines(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "pool_timeout", 0.1)
+    url = f"sqlite:///{tmp_path}/test.db"
+    writer = db.create_writer_engine(url)
+    reader = db.create_read_engine(url, pool_size=2)
+    SQLModel.metadata.create_all(writer)
+    yield writer, reader
+    writer.dispose()
+    reader.dispose()
+
+
+def test_read_engine_rejects_writes(engines):
+    _, reader = engines
+
+    with Session(reader) as session:
+        session.add(UserInDB(username="joe", email="try@me.com", hashed_password="hashed_password"))
+        with pytest.raises(exc.OperationalError, match="readonly"):
+            session.commit()
+
+
+def test_writer_engine_serializes_writes(engines):
+    writer, reader = engines
+
+    with Session(writer) as first:
+        first.add(UserInDB(username="joe", email="try@me.com", hashed_password="hashed_password"))
+        first.flush()
+
+        # The only writer connection is taken; reads go on regardless.
+        with Session(writer) as second, pytest.raises(exc.TimeoutError):
+            second.connection()
+        with Session(reader) as session:
+            assert session.exec(select(UserInDB)).all() == []
+
+        first.commit()
+
+    with Session(writer) as second:
+        second.add(UserInDB(username="jane", email="jane@test.email", hashed_password="hashed_password"))
+        second.commit()
+    with Session(reader) as session:
+        assert len(session.exec(select(UserInDB)).all()) == 2
+
+
+def test_busy_writer_returns_503(client, user_fixture, auth_header, engines, monkeypatch):
+    writer, _ = engines
+    user_fixture()
+    header = auth_header()
+    monkeypatch.setattr(db, "engine", writer)
+    app.dependency_overrides.pop(db.get_session)
+
+    with writer.connect():
+        response = client.post("/chats", json={"name": "busy"}, headers=header)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json()["detail"]["error"] == "overloaded"
+
+
+def test_create_db_and_tables_adds_missing_indexes(engines, monkeypatch):
+    writer, reader = engines
+    monkeypatch.setattr(db, "engine", writer)
+    monkeypatch.setattr(db, "read_engine", reader)
+    with writer.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_users_username_lower")
+        connection.exec_driver_sql("DROP INDEX ix_messages_chat_id_id_user_id")
+
+    db.create_db_and_tables()
+
+    with writer.connect() as connection:
+        indexes = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'").scalars().all()
+    assert "ix_users_username_lower" in indexes
+    assert "ix_messages_chat_id_id_user_id" in indexes
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+msgpack = pytest.importorskip("msgpack")
+
+MSGPACK = {"Accept": "application/msgpack"}
+
+
+@pytest.fixture
+def chat(client, user_fixture, auth_header):
+    user_fixture()
+    header = auth_header()
+    chat = client.post("/chats", json={"name": "test_chat"}, headers=header).json()["chat"]
+    return chat, header
+
+
+def test_json_is_the_default(client, chat):
+    chat, header = chat
+
+    response = client.get(f"/chats/{chat['id']}", headers=header)
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["vary"] == "Accept"
+
+
+def test_msgpack_responses(client, chat):
+    chat, header = chat
+    client.post(f"/chats/{chat['id']}/messages", json={"text": "hello"}, headers=header)
+
+    for params in [{}, {"fields": "id,text"}, {"shape": "normalized"}]:
+        url = f"/chats/{chat['id']}/messages"
+        response = client.get(url, params=params, headers={**header, **MSGPACK})
+        assert response.headers["content-type"] == "application/msgpack"
+        unpacked = msgpack.unpackb(response.content, strict_map_key=False)
+        assert json.loads(json.dumps(unpacked)) == client.get(url, params=params, headers=header).json()
+
+
+def test_msgpack_request_body(client, chat):
+    chat, header = chat
+
+    response = client.post(
+        f"/chats/{chat['id']}/messages",
+        content=msgpack.packb({"text": "hello"}),
+        headers={**header, **MSGPACK, "Content-Type": "application/msgpack"},
+    )
+    assert response.status_code == 201
+    assert msgpack.unpackb(response.content)["message"]["text"] == "hello"
+
+    response = client.post(
+        f"/chats/{chat['id']}/messages",
+        content=b"\xc1",
+        headers={**header, "Content-Type": "application/msgpack"},
+    )
+    assert response.status_code == 400
+
+
+def test_msgpack_batch(client, chat):
+    chat, header = chat
+
+    response = client.post(
+        "/batch",
+        json={"requests": [{"method": "GET", "path": f"/chats/{chat['id']}"}]},
+        headers={**header, **MSGPACK},
+    )
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content)["responses"][0]["body"]["chat"]["name"] == "test_chat"
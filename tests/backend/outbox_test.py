@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import select
+
+from backend import database as db, outbox
+from backend.outbox import claim_events, drain_events
+from backend.schema import ChatInDB, OutboxInDB, UserInDB
+from backend.writer import GroupCommitWriter
+
+
+@pytest.fixture
+def chat(session):
+    user = UserInDB(username="joe", email="try@me.com", hashed_password="hashed_password")
+    chat = ChatInDB(name="test_chat", owner=user, users=[user])
+    session.add(chat)
+    session.commit()
+    return chat
+
+
+@pytest.fixture
+def received(monkeypatch):
+    received = []
+    monkeypatch.setattr(outbox, "handlers", {"message.created": [received.append]})
+    return received
+
+
+def _drain(session, batch_size=10, max_attempts=3):
+    return drain_events(session, batch_size, lease=60, max_attempts=max_attempts, backoff=1)
+
+
+def test_message_insert_writes_an_event(session, chat, received):
+    message = db.add_message_to_chat_by_id(session, chat.id, chat.owner, "hello")
+
+    assert _drain(session) == 1
+    assert [(e.topic, e.payload["id"], e.payload["text"]) for e in received] == [("message.created", message.id, "hello")]
+    # Delivered events are gone.
+    assert session.exec(select(OutboxInDB)).all() == []
+    assert _drain(session) == 0
+
+
+def test_group_commit_writes_the_event_in_the_same_transaction(session, chat, received, monkeypatch):
+    monkeypatch.setattr(db, "message_writer", GroupCommitWriter(window=0.001))
+
+    message = db.add_message_to_chat_by_id(session, chat.id, chat.owner, "hello")
+
+    event = session.exec(select(OutboxInDB)).one()
+    assert event.payload["id"] == message.id
+
+
+def test_failed_events_are_retried_with_backoff(session, chat, monkeypatch):
+    attempts = []
+
+    def _flaky(event):
+        attempts.append(event.attempts)
+        raise ConnectionError("receiver down")
+
+    monkeypatch.setattr(outbox, "handlers", {"message.created": [_flaky]})
+    db.add_message_to_chat_by_id(session, chat.id, chat.owner, "hello")
+
+    assert _drain(session) == 1
+    event = session.exec(select(OutboxInDB)).one()
+    assert event.last_error == "ConnectionError: receiver down"
+    assert event.available_at > datetime.now()
+    # Not due yet.
+    assert _drain(session) == 0
+
+    for _ in range(2):
+        event.available_at = datetime.now() - timedelta(seconds=1)
+        session.add(event)
+        session.commit()
+        assert _drain(session) == 1
+        session.refresh(event)
+
+    assert attempts == [1, 2, 3]
+    # Given up on, but kept for inspection.
+    assert event.available_at is None
+    assert _drain(session) == 0
+
+
+def test_claimed_events_are_not_claimed_twice(session, chat, received):
+    for text in ["one", "two", "three"]:
+        db.add_message_to_chat_by_id(session, chat.id, chat.owner, text)
+
+    first = claim_events(session, batch_size=2, lease=60)
+    second = claim_events(session, batch_size=2, lease=60)
+
+    assert [e.payload["text"] for e in first] == ["one", "two"]
+    assert [e.payload["text"] for e in second] == ["three"]
+    assert claim_events(session, batch_size=2, lease=60) == []
+
+
+def test_no_events_without_handlers(session, chat, monkeypatch):
+    monkeypatch.setattr(outbox, "handlers", {})
+
+    db.add_message_to_chat_by_id(session, chat.id, chat.owner, "hello")
+
+    assert session.exec(select(OutboxInDB)).all() == []
+
+
+def test_idle_outbox_does_not_take_the_writer(session, chat, received):
+    engine = session.get_bind()
+
+    # No writer engine at all: only the read for due events may run.
+    assert outbox._drain_batch(None, engine, batch_size=10) == 0
+
+    db.add_message_to_chat_by_id(session, chat.id, chat.owner, "hello")
+    assert outbox._drain_batch(engine, engine, batch_size=10) == 1
+    assert [e.payload["text"] for e in received] == ["hello"]
+
+
+def test_event_keys_are_unique_across_shards():
+    assert outbox.OutboxEvent(1, "message.created", {}, 1).key == "1"
+    assert outbox.OutboxEvent(1, "message.created", {}, 1, shard=2).key == "2-1"
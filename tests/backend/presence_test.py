@@ -0,0 +1,69 @@
+from backend.presence import PresenceTracker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _tracker(max_entries: int = 100) -> tuple[PresenceTracker, FakeClock]:
+    clock = FakeClock()
+    return PresenceTracker(presence_ttl=10, typing_ttl=3, max_entries=max_entries, clock=clock), clock
+
+
+def test_entries_expire_after_their_ttl():
+    tracker, clock = _tracker()
+    tracker.heartbeat(1, 7, typing=True)
+    tracker.heartbeat(1, 8)
+    assert tracker.chat(1)[1] == {7: True, 8: False}
+
+    clock.now += 3
+    assert tracker.chat(1)[1] == {7: False, 8: False}
+
+    # A refresh pushes the expiry back.
+    clock.now += 5
+    tracker.heartbeat(1, 8)
+    clock.now += 5
+    assert tracker.chat(1)[1] == {8: False}
+
+    clock.now += 100
+    assert tracker.chat(1) == (0, {})
+    assert tracker.stats() == {"entries": 0, "chats": 0}
+
+
+def test_version_only_changes_on_transitions():
+    tracker, clock = _tracker()
+    tracker.heartbeat(1, 7)
+    version, _ = tracker.chat(1)
+
+    for _ in range(50):
+        tracker.heartbeat(1, 7)
+    clock.now += 2
+    tracker.heartbeat(1, 7)
+    assert tracker.chat(1)[0] == version
+
+    tracker.heartbeat(1, 7, typing=True)
+    typing_version, _ = tracker.chat(1)
+    assert typing_version > version
+    tracker.heartbeat(1, 7, typing=False)
+    assert tracker.chat(1)[0] > typing_version
+
+    tracker.leave(1, 7)
+    assert tracker.chat(1) == (0, {})
+
+
+def test_memory_is_bounded():
+    tracker, clock = _tracker(max_entries=3)
+    for user_id in range(3):
+        tracker.heartbeat(1, user_id)
+        clock.now += 1
+
+    tracker.heartbeat(2, 9)
+
+    # The entry closest to expiry made room.
+    assert tracker.chat(1)[1] == {1: False, 2: False}
+    assert tracker.chat(2)[1] == {9: False}
+    assert tracker.stats() == {"entries": 3, "chats": 2}
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from backend.ratelimit import MemoryBucketStore, RateLimit, RateLimitMiddleware, RateLimiter, SqliteBucketStore, route_limits
+
+
+def _scope(method: str, path: str, headers: list | None = None) -> dict:
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": headers or [],
+        "client": ("10.0.0.1", 1234),
+    }
+
+
+def test_memory_bucket_store():
+    store = MemoryBucketStore()
+    limit = RateLimit(rate=1, burst=3)
+
+    assert [store.take("key", limit, now=100.0) for _ in range(3)] == [0, 0, 0]
+    assert store.take("key", limit, now=100.0) == 1
+    assert store.take("other", limit, now=100.0) == 0
+    assert store.take("key", limit, now=101.0) == 0
+
+
+def test_memory_bucket_store_is_bounded():
+    store = MemoryBucketStore(max_keys=2, stripes=1)
+    limit = RateLimit(rate=1, burst=1)
+
+    store.take("a", limit, now=100.0)
+    store.take("b", limit, now=100.0)
+    store.take("c", limit, now=100.0)
+
+    # "a" was evicted, so its bucket starts out full again
+    assert store.take("a", limit, now=100.0) == 0
+    assert store.take("c", limit, now=100.0) == 1
+
+
+def test_sqlite_bucket_store(tmp_path):
+    store = SqliteBucketStore(str(tmp_path / "buckets.db"))
+    limit = RateLimit(rate=2, burst=2)
+
+    assert store.take("key", limit, now=100.0) == 0
+    assert store.take("key", limit, now=100.0) == 0
+    assert store.take("key", limit, now=100.0) == 0.5
+
+    # A second store on the same file sees the same buckets
+    assert SqliteBucketStore(str(tmp_path / "buckets.db")).take("key", limit, now=100.0) == 0.5
+
+
+def test_sqlite_bucket_store_runs_off_the_event_loop(tmp_path):
+    threads = []
+
+    class _Store(SqliteBucketStore):
+        def take(self, key, limit, now):
+            threads.append(threading.current_thread())
+            return super().take(key, limit, now)
+
+    async def _app(scope, receive, send):
+        pass
+
+    limiter = RateLimiter(store=_Store(str(tmp_path / "buckets.db")), default=RateLimit(rate=1, burst=1), routes={})
+    asyncio.run(RateLimitMiddleware(_app, limiter)(_scope("GET", "/chats"), None, None))
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_rate_limiter_routes():
+    limiter = RateLimiter(
+        store=MemoryBucketStore(),
+        default=RateLimit(rate=1, burst=5),
+        routes={"GET /chats/{chat_id}/messages": RateLimit(rate=1, burst=1)},
+    )
+
+    assert limiter.check(_scope("GET", "/chats/1/messages")) == 0
+    assert limiter.check(_scope("GET", "/chats/2/messages")) > 0
+    assert limiter.check(_scope("POST", "/chats/1/messages")) == 0
+
+
+def test_rate_limit_response(client, user_fixture, auth_header):
+    user_fixture()
+    header = auth_header()
+    chat = client.post("/chats", json={"name": "busy"}, headers=header).json()["chat"]
+
+    burst = route_limits["GET /chats/{chat_id}/messages"].burst
+    statuses = [client.get(f"/chats/{chat['id']}/messages", headers=header).status_code for _ in range(burst + 1)]
+    assert statuses == [200] * burst + [429]
+
+    response = client.get(f"/chats/{chat['id']}/messages", headers=header)
+    assert response.json()["detail"]["error"] == "rate_limited"
+    assert int(response.headers["Retry-After"]) >= 1
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+from backend import readmodel
+from backend.archive import archive_messages
+from backend.schema import ChatInDB, MessageInDB, UserInDB
+
+
+def _chat(session) -> ChatInDB:
+    john = UserInDB(username="john", email="john@test.email", hashed_password="hashed_password")
+    jane = UserInDB(username="jane", email="jane@test.email", hashed_password="hashed_password")
+    chat = ChatInDB(name="test_chat", owner=john, users=[john, jane])
+    session.add(chat)
+    for i, (user, age) in enumerate([(john, 10), (jane, 10), (john, 0), (jane, 0)]):
+        session.add(MessageInDB(
+            text=f"message {i}",
+            user=user,
+            chat=chat,
+            created_at=datetime.now() - timedelta(days=age),
+        ))
+    session.commit()
+    return chat
+
+
+def test_list_chat_messages_bypasses_identity_map(session):
+    chat = _chat(session)
+    session.expunge_all()
+
+    messages = readmodel.list_chat_messages(session, chat.id)
+
+    assert [m.text for m in messages] == ["message 0", "message 1", "message 2", "message 3"]
+    assert [m.user.username for m in messages] == ["john", "jane", "john", "jane"]
+    assert messages[0].user is messages[2].user
+    assert len(session.identity_map) == 0
+
+
+def test_list_chat_messages_reads_through_archive(session):
+    chat = _chat(session)
+    archive_messages(session, session, datetime.now() - timedelta(days=5), batch_size=10)
+
+    assert [m.id for m in readmodel.list_chat_messages(session, chat.id)] == [1, 2, 3, 4]
+    assert [m.id for m in readmodel.list_chat_messages(session, chat.id, limit=3)] == [2, 3, 4]
+    assert [m.id for m in readmodel.list_chat_messages(session, chat.id, limit=2, before=3)] == [1, 2]
+
+
+def test_list_users_and_chats(session):
+    chat = _chat(session)
+    session.add(ChatInDB(name="another_chat", owner_id=2, users=[session.get(UserInDB, 2)]))
+    session.commit()
+
+    assert [u.username for u in readmodel.list_users(session)] == ["john", "jane"]
+    assert [u.username for u in readmodel.list_chat_users(session, chat.id)] == ["john", "jane"]
+    assert [(c.name, c.owner.username) for c in readmodel.list_user_chats(session, 2)] == [
+        ("another_chat", "jane"),
+        ("test_chat", "john"),
+    ]
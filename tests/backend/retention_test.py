@@ -0,0 +1,145 @@
+import asyncio
+from datetime import datetime, timedelta
+from secrets import token_hex
+
+import pytest
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel, select
+
+from backend import database as db, readmodel, retention
+from backend.archive import archive_messages
+from backend.retention import get_retention_cutoffs, purge_messages
+from backend.schema import ChatInDB, MessageInDB, UserInDB
+
+
+def _chats_with_messages(session, ages_in_days: list[int], padding: int = 0) -> list[ChatInDB]:
+    user = UserInDB(username="joe", email="try@me.com", hashed_password="hashed_password")
+    chats = [ChatInDB(name=name, owner=user, users=[user]) for name in ["strict", "default"]]
+    for chat in chats:
+        session.add(chat)
+        for age in ages_in_days:
+            session.add(MessageInDB(
+                # Random padding, which compression cannot shrink.
+                text=" ".join([f"{age} days old", token_hex(padding // 2)]).strip(),
+                user=user,
+                chat=chat,
+                created_at=datetime.now() - timedelta(days=age),
+            ))
+    session.commit()
+    return chats
+
+
+def test_purge_messages_by_policy(session):
+    strict, default = _chats_with_messages(session, [30, 20, 10, 0])
+    archive_messages(session, session, datetime.now() - timedelta(days=25), batch_size=10)
+    db.set_retention_policy(session, strict.id, 5)
+
+    cutoffs = get_retention_cutoffs(session, default_days=15)
+    assert [chat_id for chat_id, _ in cutoffs] == [strict.id, default.id]
+
+    for chat_id, older_than in cutoffs:
+        while purge_messages(session, session, older_than, batch_size=1, chat_id=chat_id):
+            pass
+
+    texts = lambda chat: [m.text for m in readmodel.list_chat_messages(session, chat.id)]
+    assert texts(strict) == ["0 days old"]
+    assert texts(default) == ["10 days old", "0 days old"]
+
+
+def test_purge_messages_batch_size(session):
+    strict, _ = _chats_with_messages(session, [30, 20, 10, 0])
+
+    assert purge_messages(session, session, datetime.now() - timedelta(days=5), batch_size=2, chat_id=strict.id) == 2
+    assert len(session.exec(select(MessageInDB).where(MessageInDB.chat_id == strict.id)).all()) == 2
+
+
+def test_update_chat_retention(client, user_fixture, auth_header):
+    user_fixture()
+    user_fixture(username="sally", email="sally@test.email")
+    chat = client.post("/chats", json={"name": "compliance"}, headers=auth_header()).json()["chat"]
+
+    response = client.put(f"/chats/{chat['id']}/retention", json={"max_age_days": 30}, headers=auth_header())
+    assert response.status_code == 200
+    assert response.json()["retention_policy"] == {"chat_id": chat["id"], "max_age_days": 30}
+
+    response = client.put(f"/chats/{chat['id']}/retention", json={"max_age_days": 0}, headers=auth_header())
+    assert response.status_code == 422
+
+    response = client.put(f"/chats/{chat['id']}/retention", json={"max_age_days": 1}, headers=auth_header(username="sally"))
+    assert response.status_code == 403
+
+
+@pytest.fixture
+def file_engine(tmp_path, monkeypatch):
+    # Incremental vacuum needs a database file set up by the writer engine.
+    engine = db.create_writer_engine(f"sqlite:///{tmp_path}/test.db")
+    read_engine = db.create_read_engine(f"sqlite:///{tmp_path}/test.db", pool_size=1)
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(db, "read_engine", read_engine)
+    yield engine
+    engine.dispose()
+    read_engine.dispose()
+
+
+def test_purge_batch_finds_messages_on_the_read_pool(file_engine):
+    with Session(file_engine) as session:
+        strict, default = [chat.id for chat in _chats_with_messages(session, [30, 20, 0])]
+        db.set_retention_policy(session, strict, 5)
+
+    statements = []
+    event.listen(file_engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+
+    cutoffs = retention._get_cutoffs(default_days=60)
+    assert [chat_id for chat_id, _ in cutoffs] == [strict, default]
+    assert retention._purge_batch(cutoffs[0][1], batch_size=10, chat_id=strict) == 2
+    assert retention._purge_batch(cutoffs[1][1], batch_size=10, chat_id=default) == 0
+
+    # The writer only deletes, and looks up the attachments of what it deletes.
+    assert [s.split()[0] for s in statements] == ["DELETE", "SELECT"]
+    assert "FROM attachments" in statements[1]
+
+
+def _freelist_count(engine) -> int:
+    with engine.connect() as connection:
+        return connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+
+
+def test_incremental_vacuum(file_engine):
+    with Session(file_engine) as session:
+        strict, _ = _chats_with_messages(session, [30] * 50, padding=4000)
+        purge_messages(session, session, datetime.now() - timedelta(days=5), batch_size=50, chat_id=strict.id)
+
+    freed = _freelist_count(file_engine)
+    assert freed > 10
+
+    retention._incremental_vacuum(10)
+    assert _freelist_count(file_engine) == freed - 10
+
+
+def test_run_retention(file_engine, monkeypatch):
+    monkeypatch.setattr(retention, "vacuum_pages", 10 ** 6)
+    with Session(file_engine) as session:
+        strict, default = _chats_with_messages(session, [30] * 20 + [0], padding=4000)
+        db.set_retention_policy(session, strict.id, 5)
+
+    def _texts() -> list[str]:
+        with Session(file_engine) as session:
+            return [" ".join(m.text.split()[:3]) for m in session.exec(select(MessageInDB).order_by(MessageInDB.id))]
+
+    async def _run():
+        task = asyncio.create_task(retention.run_retention(default_days=60, interval=60, batch_size=3))
+        try:
+            for _ in range(500):
+                await asyncio.sleep(0.01)
+                if len(_texts()) == 22 and not _freelist_count(file_engine):
+                    return
+        finally:
+            task.cancel()
+
+    asyncio.run(_run())
+
+    # The chat with a policy is purged and its pages handed back; the other
+    # chat's messages are within the default.
+    assert _texts() == ["0 days old"] + ["30 days old"] * 20 + ["0 days old"]
+    assert _freelist_count(file_engine) == 0
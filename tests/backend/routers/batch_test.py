@@ -0,0 +1,120 @@
+from sqlmodel import select
+from backend import auth, database as db
+from backend.admission import AdmissionQueue, admission_queues
+from backend.entities import InvalidStateException
+from backend.ratelimit import route_limits
+from backend.schema import ChatInDB, MessageInDB
+
+
+def test_batch(client, user_fixture, auth_header):
+    user_fixture()
+    header = auth_header()
+    chat = client.post("/chats", json={"name": "test_chat"}, headers=header).json()["chat"]
+
+    response = client.post("/batch", json={"requests": [
+        {"method": "POST", "path": f"/chats/{chat['id']}/messages", "body": {"text": "hello"}},
+        {"method": "GET", "path": f"/chats/{chat['id']}?include=users"},
+        {"method": "GET", "path": f"/chats/{chat['id']}/messages?limit=10"},
+        {"method": "GET", "path": "/chats/42"},
+        {"method": "PUT", "path": f"/chats/{chat['id']}", "body": {}},
+    ]}, headers=header)
+    assert response.status_code == 200
+
+    results = response.json()["responses"]
+    assert [r["status"] for r in results] == [201, 200, 200, 404, 422]
+    assert results[0]["body"]["message"]["text"] == "hello"
+    assert results[1]["body"]["meta"] == {"message_count": 1, "user_count": 1}
+    assert [m["text"] for m in results[2]["body"]["messages"]] == ["hello"]
+    assert results[3]["body"]["detail"]["entity_name"] == "Chat"
+
+
+def test_batch_authenticates_once(client, user_fixture, auth_header, monkeypatch):
+    user_fixture()
+    header = auth_header()
+
+    calls = []
+    decode = auth._decode_access_token
+    monkeypatch.setattr(auth, "_decode_access_token", lambda *args: calls.append(1) or decode(*args))
+
+    response = client.post("/batch", json={"requests": [
+        {"method": "GET", "path": "/users/me"},
+        {"method": "GET", "path": "/chats"},
+    ]}, headers=header)
+
+    assert [r["status"] for r in response.json()["responses"]] == [200, 200]
+    assert len(calls) == 1
+
+
+def test_batch_requires_authentication(client):
+    response = client.post("/batch", json={"requests": [{"method": "GET", "path": "/users/me"}]})
+    assert response.status_code == 401
+
+
+def test_batch_cannot_be_nested(client, user_fixture, auth_header):
+    user_fixture()
+
+    response = client.post("/batch", json={"requests": [
+        {"method": "POST", "path": "/batch", "body": {"requests": []}},
+    ]}, headers=auth_header())
+    assert response.status_code == 422
+
+
+def test_batch_nesting_is_rejected_before_running(client, user_fixture, auth_header, session):
+    user_fixture()
+    header = auth_header()
+    chat = client.post("/chats", json={"name": "test_chat"}, headers=header).json()["chat"]
+
+    response = client.post("/batch", json={"requests": [
+        {"method": "POST", "path": f"/chats/{chat['id']}/messages", "body": {"text": "hello"}},
+        {"method": "POST", "path": "/batch/", "body": {"requests": []}},
+    ]}, headers=header)
+    assert response.status_code == 422
+    assert session.exec(select(MessageInDB)).all() == []
+
+
+def test_batch_discards_writes_of_failed_requests(client, user_fixture, auth_header, session, monkeypatch):
+    user_fixture()
+    header = auth_header()
+    chat = client.post("/chats", json={"name": "test_chat"}, headers=header).json()["chat"]
+
+    def _create_new_chat(session, owner, name):
+        session.add(ChatInDB(name=name, owner_id=owner.id))
+        session.flush()
+        raise InvalidStateException(error_description="failed halfway")
+
+    monkeypatch.setattr(db, "create_new_chat", _create_new_chat)
+
+    response = client.post("/batch", json={"requests": [
+        {"method": "POST", "path": "/chats", "body": {"name": "half_made"}},
+        {"method": "POST", "path": f"/chats/{chat['id']}/messages", "body": {"text": "hello"}},
+    ]}, headers=header)
+    assert [r["status"] for r in response.json()["responses"]] == [422, 201]
+    assert [c.name for c in session.exec(select(ChatInDB)).all()] == ["test_chat"]
+
+
+def test_batch_requests_are_rate_limited(client, user_fixture, auth_header):
+    user_fixture()
+    header = auth_header()
+    chat = client.post("/chats", json={"name": "test_chat"}, headers=header).json()["chat"]
+    for _ in range(route_limits["GET /chats/{chat_id}/messages"].burst):
+        client.get(f"/chats/{chat['id']}/messages", headers=header)
+
+    response = client.post("/batch", json={"requests": [
+        {"method": "GET", "path": f"/chats/{chat['id']}/messages"},
+        {"method": "GET", "path": f"/chats/{chat['id']}"},
+    ]}, headers=header)
+    assert response.status_code == 200
+    assert [r["status"] for r in response.json()["responses"]] == [429, 200]
+
+
+def test_batch_requests_are_admitted(client, user_fixture, auth_header, monkeypatch):
+    user_fixture()
+    header = auth_header()
+    monkeypatch.setitem(admission_queues, "reads", AdmissionQueue(limit=0, max_queue=0, max_wait=0))
+
+    response = client.post("/batch", json={"requests": [
+        {"method": "GET", "path": "/users/me"},
+        {"method": "POST", "path": "/chats", "body": {"name": "test_chat"}},
+    ]}, headers=header)
+    assert response.status_code == 200
+    assert [r["status"] for r in response.json()["responses"]] == [503, 201]
@@ -1,6 +1,10 @@
 from datetime import datetime
 from fastapi.testclient import TestClient
+from backend import database as db
+from backend.cache import message_cache
 from backend.main import app
+from backend.receipts import read_markers
+from backend.writer import GroupCommitWriter
 
 
 def test_get_all_chats():
@@ -226,3 +230,291 @@ def test_get_invalid_chat_users():
     assert "entity_id" in detail
     assert detail["entity_id"] == chat_id
 
+
+
+def test_get_chats_by_ids(client, user_fixture, auth_header):
+    user_fixture()
+    user_fixture(username="sally", email="sally@test.email")
+    header = auth_header()
+
+    mine = client.post("/chats", json={"name": "mine"}, headers=header).json()["chat"]
+    other = client.post("/chats", json={"name": "other"}, headers=auth_header(username="sally")).json()["chat"]
+
+    response = client.get("/chats", params={"ids": f"{other['id']},{mine['id']},42"}, headers=header)
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["meta"] == {"count": 1, "missing": [42], "forbidden": [other["id"]]}
+    assert [chat["name"] for chat in data["chats"]] == ["mine"]
+    assert data["chats"][0]["owner"]["username"] == "john"
+
+
+def test_get_inbox(client, user_fixture, auth_header):
+    user_fixture()
+    guest = user_fixture(username="sally", email="sally@test.email")
+    owner_header = auth_header()
+    guest_header = auth_header(username="sally")
+
+    quiet = client.post("/chats", json={"name": "quiet"}, headers=owner_header).json()["chat"]
+    busy = client.post("/chats", json={"name": "busy"}, headers=owner_header).json()["chat"]
+    client.put(f"/chats/{busy['id']}/users/{guest.user.id}", headers=owner_header)
+    for text in ["first", "second"]:
+        client.post(f"/chats/{busy['id']}/messages", json={"text": text}, headers=guest_header)
+
+    response = client.get("/chats/inbox", headers=owner_header)
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["meta"]["count"] == 2
+    assert [entry["chat"]["id"] for entry in data["chats"]] == [busy["id"], quiet["id"]]
+    assert data["chats"][0]["last_message"]["text"] == "second"
+    assert data["chats"][0]["message_count"] == 2
+    assert data["chats"][0]["unread_count"] == 2
+    assert data["chats"][1]["last_message"] is None
+    assert data["chats"][1]["unread_count"] == 0
+
+    client.get(f"/chats/{busy['id']}/messages", headers=owner_header)
+    response = client.get("/chats/inbox", headers=owner_header)
+    assert response.json()["chats"][0]["unread_count"] == 0
+
+    # Messages a user sent themselves are never unread
+    response = client.get("/chats/inbox", headers=guest_header)
+    assert response.json()["chats"][0]["unread_count"] == 0
+
+
+def test_get_inbox_pagination(client, user_fixture, auth_header):
+    user_fixture()
+    header = auth_header()
+    for name in ["a", "b", "c"]:
+        client.post("/chats", json={"name": name}, headers=header)
+
+    first_page = client.get("/chats/inbox", params={"limit": 2}, headers=header).json()
+    assert [entry["chat"]["name"] for entry in first_page["chats"]] == ["c", "b"]
+
+    cursor = first_page["meta"]["next_cursor"]
+    second_page = client.get("/chats/inbox", params={"limit": 2, "cursor": cursor}, headers=header).json()
+    assert [entry["chat"]["name"] for entry in second_page["chats"]] == ["a"]
+    assert second_page["meta"]["next_cursor"] is None
+
+
+def test_mark_chat_read(client, user_fixture, auth_header):
+    user_fixture()
+    user_fixture(username="sally", email="sally@test.email")
+    owner_header = auth_header()
+    guest_header = auth_header(username="sally")
+
+    chat = client.post("/chats", json={"name": "busy"}, headers=owner_header).json()["chat"]
+    client.put(f"/chats/{chat['id']}/users/2", headers=owner_header)
+    message_ids = [
+        client.post(f"/chats/{chat['id']}/messages", json={"text": text}, headers=guest_header).json()["message"]["id"]
+        for text in ["first", "second", "third"]
+    ]
+
+    response = client.put(f"/chats/{chat['id']}/read", json={"message_id": message_ids[1]}, headers=owner_header)
+    assert response.status_code == 200
+    assert response.json()["read_marker"] == {
+        "chat_id": chat["id"],
+        "last_read_message_id": message_ids[1],
+        "unread_count": 1,
+    }
+
+    # Markers never move backwards
+    response = client.put(f"/chats/{chat['id']}/read", json={"message_id": message_ids[0]}, headers=owner_header)
+    assert response.json()["read_marker"]["last_read_message_id"] == message_ids[1]
+
+    response = client.get("/chats/inbox", headers=owner_header)
+    assert response.json()["chats"][0]["unread_count"] == 1
+
+    response = client.put(f"/chats/{chat['id']}/read", json={"message_id": message_ids[0]}, headers=guest_header)
+    assert response.json()["read_marker"]["unread_count"] == 0
+
+
+def test_mark_chat_read_past_newest_message(client, user_fixture, auth_header):
+    user_fixture()
+    user_fixture(username="sally", email="sally@test.email")
+    owner_header = auth_header()
+    guest_header = auth_header(username="sally")
+
+    chat = client.post("/chats", json={"name": "busy"}, headers=owner_header).json()["chat"]
+    client.put(f"/chats/{chat['id']}/users/2", headers=owner_header)
+    message = client.post(f"/chats/{chat['id']}/messages", json={"text": "first"}, headers=guest_header).json()["message"]
+
+    response = client.put(f"/chats/{chat['id']}/read", json={"message_id": 2 ** 62}, headers=owner_header)
+    assert response.json()["read_marker"]["last_read_message_id"] == message["id"]
+
+    # Later messages are still unread
+    client.post(f"/chats/{chat['id']}/messages", json={"text": "second"}, headers=guest_header)
+    response = client.get("/chats/inbox", headers=owner_header)
+    assert response.json()["chats"][0]["unread_count"] == 1
+
+
+def test_get_inbox_sees_pending_read_markers(client, user_fixture, auth_header, monkeypatch):
+    user_fixture()
+    user_fixture(username="sally", email="sally@test.email")
+    owner_header = auth_header()
+    guest_header = auth_header(username="sally")
+    monkeypatch.setattr(read_markers, "interval", 60)
+
+    chat = client.post("/chats", json={"name": "busy"}, headers=owner_header).json()["chat"]
+    client.put(f"/chats/{chat['id']}/users/2", headers=owner_header)
+    message_ids = [
+        client.post(f"/chats/{chat['id']}/messages", json={"text": text}, headers=guest_header).json()["message"]["id"]
+        for text in ["first", "second"]
+    ]
+
+    client.put(f"/chats/{chat['id']}/read", json={"message_id": message_ids[0]}, headers=owner_header)
+    response = client.get("/chats/inbox", headers=owner_header)
+    assert response.json()["chats"][0]["unread_count"] == 1
+
+    # Reading the inbox does not write the marker
+    assert read_markers.pending_for_user(1) == {chat["id"]: message_ids[0]}
+
+
+def test_read_markers_kept_when_flush_fails(client, user_fixture, auth_header, monkeypatch):
+    user_fixture()
+    header = auth_header()
+    monkeypatch.setattr(read_markers, "interval", 60)
+    chat = client.post("/chats", json={"name": "busy"}, headers=header).json()["chat"]
+    message_id = client.post(f"/chats/{chat['id']}/messages", json={"text": "hi"}, headers=header).json()["message"]["id"]
+    client.put(f"/chats/{chat['id']}/read", json={"message_id": message_id}, headers=header)
+
+    upsert_read_markers = db.upsert_read_markers
+    def _fail(session, markers):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(db, "upsert_read_markers", _fail)
+    read_markers.flush()
+    assert read_markers.pending_for_user(1) == {chat["id"]: message_id}
+
+    monkeypatch.setattr(db, "upsert_read_markers", upsert_read_markers)
+    read_markers.flush()
+    assert read_markers.pending_for_user(1) == {}
+    response = client.get("/chats/inbox", headers=header)
+    assert response.json()["chats"][0]["unread_count"] == 0
+
+
+def test_mark_chat_read_requires_membership(client, user_fixture, auth_header):
+    user_fixture()
+    user_fixture(username="sally", email="sally@test.email")
+
+    chat = client.post("/chats", json={"name": "private"}, headers=auth_header()).json()["chat"]
+    response = client.put(f"/chats/{chat['id']}/read", json={"message_id": 1}, headers=auth_header(username="sally"))
+    assert response.status_code == 403
+
+
+def test_add_message_with_group_commit(client, user_fixture, auth_header, monkeypatch):
+    monkeypatch.setattr(db, "message_writer", GroupCommitWriter(window=0.001))
+    user_fixture()
+    header = auth_header()
+
+    chat = client.post("/chats", json={"name": "busy"}, headers=header).json()["chat"]
+    response = client.post(f"/chats/{chat['id']}/messages", json={"text": "hello"}, headers=header)
+    assert response.status_code == 201
+
+    message = response.json()["message"]
+    assert message["text"] == "hello"
+    assert message["user"]["username"] == "john"
+
+    response = client.get(f"/chats/{chat['id']}/messages", headers=header)
+    assert [m["id"] for m in response.json()["messages"]] == [message["id"]]
+
+
+def test_get_chat_messages_pages(client, user_fixture, auth_header):
+    user_fixture()
+    header = auth_header()
+    chat = client.post("/chats", json={"name": "busy"}, headers=header).json()["chat"]
+    ids = [
+        client.post(f"/chats/{chat['id']}/messages", json={"text": f"message {i}"}, headers=header).json()["message"]["id"]
+        for i in range(5)
+    ]
+
+    def _get(**params):
+        response = client.get(f"/chats/{chat['id']}/messages", params=params, headers=header)
+        assert response.status_code == 200
+        return [(m["id"], m["text"]) for m in response.json()["messages"]]
+
+    hits = message_cache.stats()["hits"]
+    assert [id for id, _ in _get()] == ids
+    assert [id for id, _ in _get(limit=2)] == ids[3:]
+    assert [id for id, _ in _get(limit=2, before=ids[3])] == ids[1:3]
+    assert message_cache.stats()["hits"] == hits + 2
+
+    # Writes keep the cached messages current
+    client.put(f"/chats/{chat['id']}/messages/{ids[4]}", json={"text": "edited"}, headers=header)
+    client.delete(f"/chats/{chat['id']}/messages/{ids[3]}", headers=header)
+    assert _get(limit=2) == [(ids[2], "message 2"), (ids[4], "edited")]
+
+
+def test_get_chat_messages_fields_and_shape(client, user_fixture, auth_header):
+    user_fixture()
+    user_fixture(username="sally", email="sally@test.email")
+    header = auth_header()
+    chat = client.post("/chats", json={"name": "busy"}, headers=header).json()["chat"]
+    client.put(f"/chats/{chat['id']}/users/2", headers=header)
+    for username in ["john", "sally", "john"]:
+        client.post(f"/chats/{chat['id']}/messages", json={"text": username}, headers=auth_header(username=username))
+
+    url = f"/chats/{chat['id']}/messages"
+    response = client.get(url, params={"fields": "id,user.username"}, headers=header)
+    assert response.status_code == 200
+    assert response.json() == {
+        "meta": {"count": 3},
+        "messages": [
+            {"id": 1, "user": {"username": "john"}},
+            {"id": 2, "user": {"username": "sally"}},
+            {"id": 3, "user": {"username": "john"}},
+        ],
+    }
+
+    response = client.get(url, params={"shape": "normalized"}, headers=header)
+    data = response.json()
+    assert [(m["text"], m["user_id"]) for m in data["messages"]] == [("john", 1), ("sally", 2), ("john", 1)]
+    assert "user" not in data["messages"][0]
+    assert {id: user["username"] for id, user in data["users"].items()} == {"1": "john", "2": "sally"}
+
+    response = client.get(url, params={"shape": "normalized", "fields": "id,user_id"}, headers=header)
+    assert response.json()["messages"][0] == {"id": 1, "user_id": 1}
+
+    response = client.get(url, params={"fields": "id,user.password"}, headers=header)
+    assert response.status_code == 422
+
+
+def test_get_chat_messages_schema(client):
+    response = client.get("/openapi.json").json()["paths"]["/chats/{chat_id}/messages"]["get"]["responses"]["200"]
+
+    assert "fields" in response["description"]
+    assert response["content"]["application/json"]["schema"]["anyOf"] == [
+        {"$ref": "#/components/schemas/MessageCollection"},
+        {"$ref": "#/components/schemas/NormalizedMessageCollection"},
+    ]
+
+
+def test_presence(client, user_fixture, auth_header):
+    user_fixture()
+    user_fixture(username="sally", email="sally@test.email")
+    user_fixture(username="guest", email="guest@test.email")
+    header, sally = auth_header(), auth_header(username="sally")
+    chat = client.post("/chats", json={"name": "busy"}, headers=header).json()["chat"]
+    client.put(f"/chats/{chat['id']}/users/2", headers=header)
+    url = f"/chats/{chat['id']}/presence"
+
+    assert client.put(url, json={"typing": True}, headers=sally).status_code == 204
+    assert client.put(url, json={}, headers=auth_header(username="guest")).status_code == 403
+
+    response = client.get(f"/chats/{chat['id']}/users", headers=header)
+    assert [(u["username"], u["online"], u["typing"]) for u in response.json()["users"]] == [
+        ("john", False, False),
+        ("sally", True, True),
+    ]
+
+    response = client.get(url, headers=header)
+    assert response.json()["presence"] == [{"user_id": 2, "typing": True}]
+    etag = response.headers["etag"]
+
+    # Heartbeats that change nothing keep the ETag.
+    client.put(url, json={"typing": True}, headers=sally)
+    assert client.get(url, headers={**header, "If-None-Match": etag}).status_code == 304
+
+    client.delete(url, headers=sally)
+    response = client.get(url, headers={**header, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json() == {"meta": {"count": 0, "version": 0}, "presence": []}
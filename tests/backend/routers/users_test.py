@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta
 from fastapi.testclient import TestClient
+from backend import entities
 from backend.main import app
 import json
 
@@ -23,6 +24,72 @@ def test_get_all_users(client, user_fixture):
     }
 
 
+def test_search_users(client, user_fixture):
+    for username, email in [
+        ["Jimmy", "jimmy@test.com"],
+        ["jill", "jill@test.com"],
+        ["sally", "JIM.fan@generic.email"],
+        ["bob", "bob@test.com"],
+    ]:
+        user_fixture(username=username, email=email)
+
+    response = client.get("/users/search", params={"prefix": "ji"})
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["meta"]["count"] == 3
+    assert [user["username"] for user in data["users"]] == ["jill", "Jimmy", "sally"]
+
+    response = client.get("/users/search", params={"prefix": "ji", "limit": 1})
+    assert [user["username"] for user in response.json()["users"]] == ["jill"]
+
+
+def test_search_users_non_ascii(client, user_fixture):
+    user_fixture(username="Émile", email="emile@test.com")
+
+    response = client.get("/users/search", params={"prefix": "Émi"})
+    assert [user["username"] for user in response.json()["users"]] == ["Émile"]
+
+    response = client.get("/users/search", params={"prefix": "ÉMI"})
+    assert [user["username"] for user in response.json()["users"]] == ["Émile"]
+
+
+def test_search_users_requires_prefix(client):
+    response = client.get("/users/search", params={"prefix": ""})
+    assert response.status_code == 422
+
+
+def test_get_users_by_ids(client, user_fixture):
+    for username in ["john", "sally", "bob"]:
+        user_fixture(username=username, email=f"{username}@test.email")
+
+    response = client.get("/users", params={"ids": "3,1,42,1"})
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["meta"] == {"count": 2, "missing": [42]}
+    assert [user["username"] for user in data["users"]] == ["bob", "john"]
+
+
+def test_get_users_fields(client, user_fixture):
+    user_fixture()
+
+    response = client.get("/users", params={"fields": "id,username"})
+    assert response.status_code == 200
+    assert response.json() == {"meta": {"count": 1}, "users": [{"id": 1, "username": "john"}]}
+
+    response = client.get("/users", params={"fields": "id,nickname"})
+    assert response.status_code == 422
+
+
+def test_get_users_by_ids_limits(client, monkeypatch):
+    monkeypatch.setattr(entities, "max_ids", 2)
+
+    assert client.get("/users", params={"ids": "1,2,3"}).status_code == 422
+    assert client.get("/users", params={"ids": "1,two"}).status_code == 422
+    assert client.get("/users", params={"ids": ""}).status_code == 422
+
+
 # def test_create_new_user():
 #     user_id = "new_user"
 #     create_params = {
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from backend import attachments, auth, database as db
+from backend.backup import BackupJob, backup_database
+from backend.cache import message_cache
+from backend.main import app
+from backend.ratelimit import rate_limiter
+from backend.receipts import read_markers
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    path = str(tmp_path / "main.db")
+    writer = db.create_writer_engine(f"sqlite:///{path}")
+    reader = db.create_read_engine(f"sqlite:///{path}", pool_size=1)
+    shard_engines = db.create_shard_engines(path, 2)
+    monkeypatch.setattr(db, "engine", writer)
+    monkeypatch.setattr(db, "read_engine", reader)
+    monkeypatch.setattr(db, "shard_engines", shard_engines)
+    monkeypatch.setattr(db, "shard_count", 2)
+    monkeypatch.setattr(db, "_chat_shards", {})
+    monkeypatch.setattr(attachments, "attachment_dir", str(tmp_path / "attachments"))
+    db.create_db_and_tables()
+    app.dependency_overrides.clear()
+    rate_limiter.store.clear()
+    message_cache.clear()
+
+    yield path
+
+    read_markers.flush()
+    message_cache.clear()
+    for shard_writer, shard_reader in [(writer, reader), *shard_engines]:
+        shard_writer.dispose()
+        shard_reader.dispose()
+
+
+@pytest.fixture
+def headers(sharded):
+    with Session(db.engine, expire_on_commit=False) as session:
+        auth.register_user(auth.UserRegistration(username="john", email="john@test.email", password="strong_password"), session)
+
+    client = TestClient(app)
+    response = client.post("/auth/token", data={"username": "john", "password": "strong_password"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def _texts(path: str) -> list[str]:
+    with sqlite3.connect(path) as connection:
+        return [text for text, in connection.execute("SELECT text FROM messages ORDER BY id")]
+
+
+def test_messages_are_stored_in_the_shard_of_their_chat(sharded, headers):
+    client = TestClient(app)
+    for name in ["one", "two"]:
+        chat_id = client.post("/chats", json={"name": name}, headers=headers).json()["chat"]["id"]
+        response = client.post(f"/chats/{chat_id}/messages", json={"text": f"hello {name}"}, headers=headers)
+        assert response.status_code == 201
+
+    assert db.shard_of(1) == 1 and db.shard_of(2) == 0
+    assert _texts(sharded) == ["hello two"]
+    assert _texts(db.shard_path(sharded, 1)) == ["hello one"]
+
+    messages = client.get("/chats/1/messages", headers=headers).json()["messages"]
+    assert [(m["text"], m["user"]["username"]) for m in messages] == [("hello one", "john")]
+
+    inbox = client.get("/chats/inbox", headers=headers).json()["chats"]
+    assert [(entry["chat"]["name"], entry["last_message"]["text"]) for entry in inbox] == [
+        ("two", "hello two"),
+        ("one", "hello one"),
+    ]
+
+
+def test_attachments_and_batches_use_the_shard_of_their_chat(sharded, headers, tmp_path):
+    client = TestClient(app)
+    client.post("/chats", json={"name": "one"}, headers=headers)
+    client.post("/chats/1/messages", json={"text": "hello"}, headers=headers)
+
+    response = client.post("/chats/1/messages/1/attachments", files={"file": ("a.txt", b"content")}, headers=headers)
+    assert response.status_code == 201
+    stored = attachments.file_path(str(tmp_path / "attachments" / "shard1"), hashlib.sha256(b"content").hexdigest())
+    assert os.path.isfile(stored)
+    assert client.get("/chats/1/attachments/1", headers=headers).content == b"content"
+
+    response = client.post("/batch", json={"requests": [
+        {"method": "POST", "path": "/chats/1/messages", "body": {"text": "batched"}},
+        {"method": "DELETE", "path": "/chats/1/messages/1"},
+    ]}, headers=headers)
+    assert [result["status"] for result in response.json()["responses"]] == [201, 204]
+    assert _texts(db.shard_path(sharded, 1)) == ["batched"]
+    assert not os.path.isfile(stored)
+
+
+def test_backups_copy_every_shard(sharded, headers, tmp_path):
+    client = TestClient(app)
+    client.post("/chats", json={"name": "one"}, headers=headers)
+    client.post("/chats/1/messages", json={"text": "hello"}, headers=headers)
+
+    job = BackupJob(str(tmp_path / "backup.db"))
+    backup_database(job, pages_per_step=5, step_sleep=0)
+
+    assert job.status == "completed"
+    assert job.pages_remaining == 0
+    assert _texts(db.shard_path(job.path, 1)) == ["hello"]
+
+
+def test_shard_count_cannot_be_lowered(sharded, headers, monkeypatch):
+    client = TestClient(app)
+    client.post("/chats", json={"name": "one"}, headers=headers)
+
+    monkeypatch.setattr(db, "shard_engines", [])
+    monkeypatch.setattr(db, "shard_count", 1)
+    with pytest.raises(RuntimeError, match="cannot be lowered"):
+        db.create_db_and_tables()
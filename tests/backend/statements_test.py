@@ -0,0 +1,82 @@
+import pytest
+from sqlalchemy import event
+from sqlmodel import Session
+from backend import database as db
+from backend.main import app
+
+
+@pytest.fixture
+def statements(session):
+    executed = []
+
+    def _record(_connection, _cursor, statement, *_args):
+        # The revocation list syncs itself on its own schedule, independent of the request.
+        if "revoked_tokens" not in statement:
+            executed.append(statement.split(None, 1)[0].upper())
+
+    event.listen(session.get_bind(), "before_cursor_execute", _record)
+    yield executed
+    event.remove(session.get_bind(), "before_cursor_execute", _record)
+
+
+@pytest.fixture(autouse=True)
+def write_session(client, session):
+    # Writes get a session of their own, as outside the tests, so that rows
+    # loaded while authenticating are not at hand when the response is built.
+    with Session(session.get_bind(), expire_on_commit=False) as write_session:
+        app.dependency_overrides[db.get_session] = lambda: write_session
+        yield write_session
+
+
+@pytest.fixture
+def chat_setup(client, user_fixture, auth_header):
+    user_fixture()
+    user_fixture(username="jane", email="jane@test.email")
+    header = auth_header()
+    client.post("/chats", json={"name": "test_chat"}, headers=header)
+    client.post("/chats/1/messages", json={"text": "hello"}, headers=header)
+    return header
+
+
+@pytest.mark.parametrize("method, path, body, expected", [
+    # Authenticate, load the chat, check membership, insert the message; no
+    # outbox event without a handler for it.
+    ("post", "/chats/1/messages", {"text": "hi"}, ["SELECT", "SELECT", "SELECT", "INSERT"]),
+    # Edits and deletes also look up the message's attachments.
+    ("put", "/chats/1/messages/1", {"text": "hi"}, ["SELECT", "SELECT", "SELECT", "UPDATE", "SELECT"]),
+    ("delete", "/chats/1/messages/1", None, ["SELECT", "SELECT", "SELECT", "DELETE", "SELECT"]),
+    ("put", "/chats/1", {"name": "renamed"}, ["SELECT", "SELECT", "UPDATE"]),
+    # Authenticate, load the chat, the new member and the current members, insert.
+    ("put", "/chats/1/users/2", None, ["SELECT", "SELECT", "SELECT", "SELECT", "INSERT"]),
+    # Authenticate, load the user to update, update.
+    ("put", "/users/me", {"username": "johnny"}, ["SELECT", "SELECT", "UPDATE"]),
+])
+def test_write_statements(client, chat_setup, statements, method, path, body, expected):
+    response = client.request(method, path, json=body, headers=chat_setup)
+
+    assert response.status_code < 300
+    assert statements == expected
+
+
+def test_create_chat_statements(client, user_fixture, auth_header, statements):
+    user_fixture()
+    header = auth_header()
+    statements.clear()
+
+    response = client.post("/chats", json={"name": "test_chat"}, headers=header)
+
+    assert response.status_code == 201
+    assert response.json()["chat"]["id"] == 1
+    # The chat and its owner's membership are written in the same transaction.
+    assert statements == ["SELECT", "INSERT", "INSERT"]
+
+
+def test_register_statements(client, statements):
+    response = client.post(
+        "/auth/registration",
+        json={"username": "john", "email": "john@test.email", "password": "strong_password"},
+    )
+
+    assert response.status_code == 201
+    assert response.json()["user"]["id"] == 1
+    assert statements == ["INSERT"]